@@ -1,4 +1,4 @@
-from flask import Flask, render_template
+from flask import Flask, render_template, g, request
 from flask_login import LoginManager, current_user
 from flask_wtf.csrf import generate_csrf
 from config import Config
@@ -6,6 +6,13 @@ from models import db, User, CartItem
 from routes.auth import auth_bp
 from routes.main import main_bp
 from routes.admin import admin_bp
+from catalog_cache import init_catalog_cache
+from report_cache import init_report_cache
+from notifications import init_notifications, add_maintenance_task
+from upload_storage import IMMUTABLE_URL_RE, cleanup_orphaned_uploads
+from image_queue import init_image_processing
+from idempotency import new_idempotency_key, cleanup_idempotency_keys
+from commands import register_commands
 
 def create_app():
     """Створення та налаштування Flask додатку"""
@@ -29,19 +36,30 @@ def create_app():
     # Контекстний процесор для кількості товарів у кошику та CSRF токена
     @app.context_processor
     def inject_globals():
-        cart_count = 0
-        try:
-            if hasattr(current_user, 'is_authenticated') and current_user.is_authenticated:
-                cart_items = CartItem.query.filter_by(user_id=current_user.id).all()
-                cart_count = sum(item.quantity for item in cart_items)
-        except:
-            pass
+        def cart_count():
+            """Кількість товарів у кошику (рахується лише якщо шаблон її показує)"""
+            if not current_user.is_authenticated:
+                return 0
+            if 'cart_count' not in g:
+                g.cart_count = CartItem.count_for_user(current_user.id)
+            return g.cart_count
         
         def csrf_token():
             """Генерує CSRF токен для використання в шаблонах"""
             return generate_csrf()
         
-        return dict(cart_count=cart_count, csrf_token=csrf_token)
+        return dict(cart_count=cart_count, csrf_token=csrf_token, idempotency_key=new_idempotency_key)
+    
+    # Файли з адресацією за вмістом записуються один раз вже остаточними і
+    # ніколи не змінюються (upload_storage.write_once), тому кешуються назавжди
+    @app.after_request
+    def cache_immutable_uploads(response):
+        if response.status_code in (200, 304) and IMMUTABLE_URL_RE.match(request.path):
+            response.cache_control.public = True
+            response.cache_control.max_age = 365 * 24 * 60 * 60
+            response.cache_control.immutable = True
+            response.cache_control.no_cache = None
+        return response
     
     # Обробка помилок
     @app.errorhandler(404)
@@ -57,106 +75,56 @@ def create_app():
     def forbidden_error(error):
         return render_template('errors/403.html'), 403
     
+    # Кеш відрендереного каталогу та відстеження змін товарів/категорій
+    init_catalog_cache(app)
+    
+    # Кеш статистики адмін-панелі та відстеження змін замовлень
+    init_report_cache(app)
+    
+    # Фоновий диспетчер черги повідомлень Telegram (також прибирає прострочені Idempotency-Key
+    # та файли завантажень без посилань)
+    init_notifications(app)
+    add_maintenance_task(cleanup_idempotency_keys)
+    add_maintenance_task(cleanup_orphaned_uploads)
+    
+    # Фонова обробка завантажених зображень у пулі процесів
+    init_image_processing(app)
+    
     # Реєстрація Blueprint
     app.register_blueprint(auth_bp)
     app.register_blueprint(main_bp)
     app.register_blueprint(admin_bp)
     
+    # CLI команди (flask migrate тощо)
+    register_commands(app)
+    
     # Створення таблиць бази даних
     with app.app_context():
-        db.create_all()
-        
-        # Міграція: додавання колонки is_active до таблиці products (якщо не існує)
-        try:
-            from sqlalchemy import inspect, text
-            inspector = inspect(db.engine)
+        # SQLite: WAL (читання не блокуються записом) та очікування замість
+        # помилки "database is locked", коли пише інший воркер
+        if db.engine.dialect.name == 'sqlite':
+            from sqlalchemy import event
             
-            # Перевіряємо чи існує таблиця products
-            if 'products' in inspector.get_table_names():
-                columns = [col['name'] for col in inspector.get_columns('products')]
-                if 'is_active' not in columns:
-                    print("Додаємо колонку is_active до таблиці products...")
-                    with db.engine.begin() as conn:
-                        # SQLite не підтримує BOOLEAN, використовуємо INTEGER (0 = False, 1 = True)
-                        conn.execute(text("ALTER TABLE products ADD COLUMN is_active INTEGER DEFAULT 1 NOT NULL"))
-                    print("Колонка is_active успішно додана!")
-        except Exception as e:
-            print(f"Помилка при міграції is_active (можливо колонка вже існує): {e}")
+            @event.listens_for(db.engine, 'connect')
+            def set_sqlite_pragmas(dbapi_connection, connection_record):
+                cursor = dbapi_connection.cursor()
+                cursor.execute(f'PRAGMA busy_timeout = {Config.SQLITE_BUSY_TIMEOUT_MS}')
+                cursor.execute('PRAGMA journal_mode = WAL')
+                cursor.close()
         
-        # Міграція: створення таблиці product_images (якщо не існує)
-        try:
-            from sqlalchemy import inspect, text
-            inspector = inspect(db.engine)
-            tables = inspector.get_table_names()
-            if 'product_images' not in tables:
-                print("Створюємо таблицю product_images...")
-                with db.engine.begin() as conn:
-                    conn.execute(text("""
-                        CREATE TABLE product_images (
-                            id INTEGER PRIMARY KEY AUTOINCREMENT,
-                            product_id INTEGER NOT NULL,
-                            image_url VARCHAR(500) NOT NULL,
-                            is_primary INTEGER DEFAULT 0 NOT NULL,
-                            display_order INTEGER DEFAULT 0 NOT NULL,
-                            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                            FOREIGN KEY (product_id) REFERENCES products(id) ON DELETE CASCADE
-                        )
-                    """))
-                print("Таблиця product_images успішно створена!")
-            else:
-                # Міграція: додавання колонки display_order до таблиці product_images (якщо не існує)
-                columns = [col['name'] for col in inspector.get_columns('product_images')]
-                if 'display_order' not in columns:
-                    print("Додаємо колонку display_order до таблиці product_images...")
-                    with db.engine.begin() as conn:
-                        conn.execute(text("ALTER TABLE product_images ADD COLUMN display_order INTEGER DEFAULT 0 NOT NULL"))
-                        # Встановлюємо порядок для існуючих зображень
-                        conn.execute(text("""
-                            UPDATE product_images 
-                            SET display_order = (
-                                SELECT COUNT(*) 
-                                FROM product_images p2 
-                                WHERE p2.product_id = product_images.product_id 
-                                AND (p2.created_at < product_images.created_at OR (p2.created_at = product_images.created_at AND p2.id <= product_images.id))
-                            ) - 1
-                        """))
-                    print("Колонка display_order успішно додана!")
-        except Exception as e:
-            print(f"Помилка при міграції product_images (можливо таблиця вже існує): {e}")
+        db.create_all()
         
-        # Міграція: створення таблиці settings (якщо не існує)
+        # Версійні міграції схеми (див. migrations.py)
         try:
-            from sqlalchemy import inspect, text
-            inspector = inspect(db.engine)
-            tables = inspector.get_table_names()
-            if 'settings' not in tables:
-                print("Створюємо таблицю settings...")
-                with db.engine.begin() as conn:
-                    conn.execute(text("""
-                        CREATE TABLE settings (
-                            id INTEGER PRIMARY KEY AUTOINCREMENT,
-                            key VARCHAR(100) NOT NULL UNIQUE,
-                            value TEXT,
-                            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
-                        )
-                    """))
-                print("Таблиця settings успішно створена!")
+            from migrations import upgrade
+            upgrade(db.engine)
         except Exception as e:
-            print(f"Помилка при міграції settings (можливо таблиця вже існує): {e}")
+            print(f"Помилка при виконанні міграцій: {e}")
         
-        # Міграція: додавання колонки is_blocked до таблиці users (якщо не існує)
-        try:
-            from sqlalchemy import inspect, text
-            inspector = inspect(db.engine)
-            if 'users' in inspector.get_table_names():
-                columns = [col['name'] for col in inspector.get_columns('users')]
-                if 'is_blocked' not in columns:
-                    print("Додаємо колонку is_blocked до таблиці users...")
-                    with db.engine.begin() as conn:
-                        conn.execute(text("ALTER TABLE users ADD COLUMN is_blocked INTEGER DEFAULT 0 NOT NULL"))
-                    print("Колонка is_blocked успішно додана!")
-        except Exception as e:
-            print(f"Помилка при міграції is_blocked (можливо колонка вже існує): {e}")
+        # Повнотекстовий індекс для пошуку товарів та триграмний - для користувачів
+        from search import init_search_index, init_user_search_index
+        init_search_index()
+        init_user_search_index()
         
         # Створюємо директорію для завантажених файлів
         import os
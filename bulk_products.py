@@ -0,0 +1,98 @@
+"""Масові операції з товарами в адмін-панелі.
+
+Вибір товарів - або список id з форми (product_ids), або "всі, що
+відповідають фільтру" (select_all + search): тоді id не передаються
+формою, а читаються з БД порціями за ключем id.
+
+Кожна порція - окрема коротка транзакція з одним UPDATE/DELETE ... WHERE
+id IN (...), тому блокування запису SQLite не утримується весь час
+операції, а об'єкти Product не завантажуються в сесію. Файли зображень
+видаляються після commit фоновим диспетчером (notifications.py), якщо
+їх не використовують інші товари.
+"""
+from sqlalchemy import delete, select, update
+
+CHUNK_SIZE = 500
+
+
+def _form_ids(value):
+    return sorted({int(part) for part in value.split(',') if part.strip().isdigit()})
+
+
+def iter_selected_ids(form, chunk_size=CHUNK_SIZE):
+    """Порції id вибраних товарів (списки до chunk_size елементів)"""
+    from models import db, Product
+    from search import apply_search
+
+    if form.get('select_all') != '1':
+        ids = _form_ids(form.get('product_ids', ''))
+        for start in range(0, len(ids), chunk_size):
+            yield ids[start:start + chunk_size]
+        return
+
+    query = Product.query
+    search = form.get('search', '').strip()
+    if search:
+        query, _ = apply_search(query, search)
+    last_id = 0
+    while True:
+        ids = [row[0] for row in query.with_entities(Product.id).filter(
+            Product.id > last_id
+        ).order_by(Product.id).limit(chunk_size)]
+        # Завершуємо транзакцію читання: наступна порція - окрема транзакція
+        db.session.rollback()
+        if not ids:
+            return
+        yield ids
+        last_id = ids[-1]
+
+
+def bulk_update(id_chunks, **values):
+    """UPDATE products SET values по порціях id; повертає кількість змінених товарів"""
+    from models import db, Product
+
+    total = 0
+    for ids in id_chunks:
+        result = db.session.execute(
+            update(Product).where(Product.id.in_(ids)).values(**values),
+            execution_options={'synchronize_session': False}
+        )
+        db.session.commit()
+        total += result.rowcount
+    return total
+
+
+def bulk_delete(id_chunks):
+    """Видаляє товари по порціях id. Повертає (видалено, пропущено).
+
+    Товари, які є в замовленнях, не видаляються (елементи замовлень
+    посилаються на них) - їх можна деактивувати.
+    """
+    from models import db, Product, ProductImage, CartItem, OrderItem
+    from images import local_path
+    from upload_storage import enqueue_file_deletions
+
+    deleted = skipped = 0
+    for ids in id_chunks:
+        ordered = set(db.session.scalars(
+            select(OrderItem.product_id).where(OrderItem.product_id.in_(ids)).distinct()
+        ))
+        ids = [product_id for product_id in ids if product_id not in ordered]
+        skipped += len(ordered)
+        if not ids:
+            db.session.rollback()
+            continue
+
+        urls = list(db.session.scalars(select(Product.image_url).where(Product.id.in_(ids))))
+        urls += db.session.scalars(select(ProductImage.image_url).where(ProductImage.product_id.in_(ids)))
+        # Похідні та файли, спільні з іншими товарами, враховує диспетчер
+        files = [local_path(url) for url in urls if local_path(url)]
+
+        options = {'synchronize_session': False}
+        db.session.execute(delete(CartItem).where(CartItem.product_id.in_(ids)), execution_options=options)
+        db.session.execute(delete(ProductImage).where(ProductImage.product_id.in_(ids)), execution_options=options)
+        result = db.session.execute(delete(Product).where(Product.id.in_(ids)), execution_options=options)
+        enqueue_file_deletions(files)
+        db.session.commit()
+        deleted += result.rowcount
+    return deleted, skipped
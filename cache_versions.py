@@ -0,0 +1,38 @@
+"""Лічильники версій кешів, спільні для всіх воркерів Gunicorn.
+
+Кожен воркер тримає власні кеші в пам'яті, тому інвалідація має дійти до
+всіх процесів. Версія зберігається у маленькому файлі в Config.SHARED_STATE_DIR
+(за замовчуванням /dev/shm): читання - один read() без звернення до БД,
+зміна версії - атомарна заміна файлу.
+"""
+import os
+import time
+from config import Config
+
+
+def _version_path(name):
+    return os.path.join(Config.SHARED_STATE_DIR, f'{name}.version')
+
+
+def get_version(name):
+    """Поточна версія кешу (рядок) або '0', якщо її ще не змінювали"""
+    try:
+        with open(_version_path(name)) as f:
+            return f.read().strip() or '0'
+    except OSError:
+        return '0'
+
+
+def bump_version(name):
+    """Змінює версію кешу, щоб усі воркери перебудували свої дані"""
+    version = f'{time.time_ns()}-{os.getpid()}'
+    path = _version_path(name)
+    try:
+        os.makedirs(Config.SHARED_STATE_DIR, exist_ok=True)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(version)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print(f"Помилка оновлення версії кешу {name}: {e}")
+    return version
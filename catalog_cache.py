@@ -0,0 +1,243 @@
+"""Кеш відрендереного каталогу.
+
+- Повні сторінки каталогу та товару для анонімних відвідувачів
+  (декоратор cached_page).
+- HTML карток товарів (product_card у шаблонах) - для всіх відвідувачів.
+- Умовні запити: ETag та Last-Modified, відповідь 304 без рендерингу
+  шаблону для анонімних відвідувачів.
+
+Ключі містять версію каталогу 'catalog'. Вона змінюється після commit,
+який змінив Product, ProductImage або Category, і старі записи одразу
+перестають використовуватися всіма воркерами.
+"""
+import hashlib
+from datetime import datetime
+from functools import wraps
+from flask import request, session, current_app, g, has_request_context, make_response
+from flask_login import current_user
+from markupsafe import Markup
+from sqlalchemy import event, func, select
+from werkzeug.http import is_resource_modified
+from sqlalchemy.orm import Session
+import shared_cache
+from cache_versions import get_version, bump_version
+
+VERSION_NAME = 'catalog'
+PAGES_NAMESPACE = 'catalog_pages'
+CARDS_NAMESPACE = 'catalog_cards'
+
+# Запобіжник: навіть без змін каталогу запис живе не довше години
+CACHE_TTL = 3600
+
+_CATALOG_TABLES = {'products', 'product_images', 'categories'}
+
+
+def catalog_version():
+    """Поточна версія каталогу (читається один раз за запит)"""
+    if not has_request_context():
+        return get_version(VERSION_NAME)
+    if 'catalog_version' not in g:
+        g.catalog_version = get_version(VERSION_NAME)
+    return g.catalog_version
+
+
+def invalidate_catalog():
+    """Робить застарілим увесь кеш каталогу в усіх воркерах"""
+    version = bump_version(VERSION_NAME)
+    if has_request_context():
+        g.catalog_version = version
+    shared_cache.clear(PAGES_NAMESPACE)
+    shared_cache.clear(CARDS_NAMESPACE)
+
+
+def _touches_catalog(objects):
+    return any(getattr(obj, '__tablename__', None) in _CATALOG_TABLES for obj in objects)
+
+
+def _track_flush(session, flush_context, instances):
+    if _touches_catalog(session.new) or _touches_catalog(session.dirty) or _touches_catalog(session.deleted):
+        session.info['catalog_changed'] = True
+
+
+def _track_bulk(orm_execute_state):
+    # query.update()/query.delete() не проходять через flush
+    if orm_execute_state.is_update or orm_execute_state.is_delete:
+        mapper = orm_execute_state.bind_mapper
+        if mapper is not None and mapper.local_table.name in _CATALOG_TABLES:
+            orm_execute_state.session.info['catalog_changed'] = True
+
+
+def _after_commit(session):
+    if session.info.pop('catalog_changed', False):
+        invalidate_catalog()
+
+
+def _after_rollback(session):
+    session.info.pop('catalog_changed', None)
+
+
+def init_catalog_cache(app):
+    """Підключає відстеження змін каталогу та функцію product_card для шаблонів"""
+    if not event.contains(Session, 'before_flush', _track_flush):
+        event.listen(Session, 'before_flush', _track_flush)
+        event.listen(Session, 'do_orm_execute', _track_bulk)
+        event.listen(Session, 'after_commit', _after_commit)
+        event.listen(Session, 'after_rollback', _after_rollback)
+    app.jinja_env.globals['product_card'] = product_card
+
+
+def product_card(product):
+    """HTML картки товару для каталогу (з кешу фрагментів)"""
+    authenticated = bool(current_user.is_authenticated)
+    key = f'{catalog_version()}:{product.id}:{int(authenticated)}'
+
+    def render():
+        template = current_app.jinja_env.get_template('partials/product_card.html')
+        return template.render(product=product, current_user=current_user)
+
+    return Markup(shared_cache.get_or_set(CARDS_NAMESPACE, key, render, ttl=CACHE_TTL))
+
+
+def _is_cacheable_request():
+    # Flash-повідомлення показуються один раз, тому такі сторінки не кешуємо
+    return (
+        request.method == 'GET'
+        and not current_user.is_authenticated
+        and '_flashes' not in session
+    )
+
+
+def _version_time(version):
+    """Час зміни версії каталогу (версія має вигляд '<time_ns>-<pid>')"""
+    try:
+        return datetime.utcfromtimestamp(int(version.split('-', 1)[0]) / 1e9)
+    except (ValueError, OverflowError):
+        return None
+
+
+def _latest(*values):
+    values = [v for v in values if v is not None]
+    return max(values) if values else None
+
+
+def catalog_last_modified():
+    """Час останньої зміни каталогу: товари, зображення, категорії.
+
+    Видалення не залишають слідів у таблицях, тому враховується також час
+    зміни версії каталогу. Результат кешується до наступної зміни версії.
+    """
+    version = catalog_version()
+
+    def compute():
+        from models import db, Product, ProductImage, Category
+        row = db.session.query(
+            select(func.max(Product.updated_at)).scalar_subquery(),
+            select(func.max(ProductImage.created_at)).scalar_subquery(),
+            select(func.max(Category.updated_at)).scalar_subquery(),
+        ).one()
+        return _latest(*row, _version_time(version))
+
+    return shared_cache.get_or_set(PAGES_NAMESPACE, f'{version}:last_modified', compute, ttl=CACHE_TTL)
+
+
+def product_last_modified(product_id):
+    """Час останньої зміни товару, його зображень та категорії (None - товару немає).
+
+    Обробка зображень (image_queue) оновлює рядки без власних міток часу,
+    тому, як і в catalog_last_modified, враховується час зміни версії
+    каталогу.
+    """
+    version = catalog_version()
+
+    def compute():
+        from models import db, Product, ProductImage, Category
+        row = db.session.query(
+            Product.updated_at,
+            select(func.max(ProductImage.created_at))
+            .where(ProductImage.product_id == Product.id).scalar_subquery(),
+            Category.updated_at,
+        ).outerjoin(Category, Category.id == Product.category_id).filter(Product.id == product_id).first()
+        # False замість None, щоб відсутність товару теж кешувалась
+        return _latest(*row, _version_time(version)) if row else False
+
+    return shared_cache.get_or_set(PAGES_NAMESPACE, f'{version}:last_modified:product:{product_id}',
+                                   compute, ttl=CACHE_TTL) or None
+
+
+def catalog_count(key, query):
+    """Кількість товарів запиту каталогу (key - його фільтри).
+
+    Рахується один раз на версію каталогу, а не для кожної сторінки:
+    сторінки з різними курсорами мають однаковий key.
+    """
+    version = catalog_version()
+    return shared_cache.get_or_set(PAGES_NAMESPACE, f'{version}:count:{key}',
+                                   lambda: query.order_by(None).count(), ttl=CACHE_TTL)
+
+
+def _not_modified(etag, last_modified):
+    response = make_response('', 304)
+    response.set_etag(etag)
+    if last_modified:
+        response.last_modified = last_modified
+    response.cache_control.no_cache = True
+    return response
+
+
+def conditional_response(response):
+    """ETag з тіла відповіді та 304, якщо клієнт вже має цю версію.
+
+    Для персональних JSON відповідей (кошик): дані вже зібрано, але тіло
+    не передається повторно.
+    """
+    response = make_response(response)
+    if response.status_code == 200 and not response.direct_passthrough:
+        response.add_etag()
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        response.vary.add('Cookie')
+        response.make_conditional(request)
+    return response
+
+
+def cached_page(params=(), last_modified=None):
+    """Кешує HTML сторінки для анонімних відвідувачів.
+
+    Ключ складається з версії каталогу, endpoint, аргументів маршруту та
+    лише перелічених параметрів запиту (довільні параметри не створюють
+    нових записів). Ключ також є сильним ETag: на If-None-Match /
+    If-Modified-Since відповідаємо 304 без рендерингу. last_modified -
+    функція від аргументів маршруту; за замовчуванням - час зміни каталогу.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if not _is_cacheable_request():
+                # Сторінки авторизованих містять CSRF токени з міткою часу,
+                # тому ETag від тіла для них ніколи не збігся б
+                return f(*args, **kwargs)
+            view_args = ','.join(f'{k}={v}' for k, v in sorted(kwargs.items()))
+            query_args = '&'.join(f'{name}={request.args.get(name, "")}' for name in params)
+            key = f'{catalog_version()}:{request.endpoint}:{view_args}:{query_args}'
+            etag = hashlib.sha1(key.encode('utf-8')).hexdigest()
+            modified_at = last_modified(**kwargs) if last_modified else catalog_last_modified()
+
+            if not is_resource_modified(request.environ, etag=etag, last_modified=modified_at):
+                return _not_modified(etag, modified_at)
+
+            body = shared_cache.get_or_set(
+                PAGES_NAMESPACE, key, lambda: f(*args, **kwargs),
+                ttl=CACHE_TTL, should_cache=lambda value: isinstance(value, str)
+            )
+            response = make_response(body)
+            if response.status_code == 200:
+                response.set_etag(etag)
+                if modified_at:
+                    response.last_modified = modified_at
+                # Кешувати можна, але перед використанням перевіряти ETag
+                response.cache_control.public = True
+                response.cache_control.no_cache = True
+                response.vary.add('Cookie')
+            return response
+        return decorated_function
+    return decorator
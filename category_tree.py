@@ -0,0 +1,111 @@
+"""Кеш дерева категорій у пам'яті процесу.
+
+Дерево завантажується одним запитом і зберігається до зміни версії
+'category_tree' (див. cache_versions). Адмін-маршрути категорій викликають
+invalidate_category_tree() після commit, і всі воркери перебудовують дерево
+при наступному зверненні.
+"""
+import threading
+from cache_versions import get_version, bump_version
+
+VERSION_NAME = 'category_tree'
+
+
+class CategoryNode:
+    """Вузол дерева категорій (без прив'язки до сесії SQLAlchemy)"""
+    __slots__ = ('id', 'name', 'parent_id', 'children', 'full_path', 'descendant_ids')
+
+    def __init__(self, id, name, parent_id):
+        self.id = id
+        self.name = name
+        self.parent_id = parent_id
+        self.children = []
+        self.full_path = name
+        self.descendant_ids = frozenset()
+
+
+class CategoryTree:
+    """Незмінне дерево категорій: id -> вузол, нащадки та повні шляхи"""
+
+    def __init__(self, rows):
+        self.nodes = {row.id: CategoryNode(row.id, row.name, row.parent_id) for row in rows}
+        self.roots = []
+        for node in self.nodes.values():
+            parent = self.nodes.get(node.parent_id)
+            if parent is not None:
+                parent.children.append(node)
+            else:
+                self.roots.append(node)
+        for root in self.roots:
+            self._fill(root, None, set())
+
+    def _fill(self, node, parent, visited):
+        """Обчислює full_path та множину нащадків (захист від циклів через visited)"""
+        visited.add(node.id)
+        node.full_path = f"{parent.full_path} > {node.name}" if parent else node.name
+        ids = {node.id}
+        for child in node.children:
+            if child.id not in visited:
+                ids |= self._fill(child, node, visited)
+        node.descendant_ids = frozenset(ids)
+        return ids
+
+    def get(self, category_id):
+        return self.nodes.get(category_id)
+
+    def descendant_ids(self, category_id):
+        """ID категорії та всіх її підкатегорій (будь-якої глибини)"""
+        node = self.nodes.get(category_id)
+        return node.descendant_ids if node else frozenset()
+
+    def full_path(self, category_id):
+        node = self.nodes.get(category_id)
+        return node.full_path if node else None
+
+    def flat(self):
+        """Усі категорії в порядку обходу дерева (батьківська перед дочірніми)"""
+        result = []
+
+        def walk(nodes):
+            for node in nodes:
+                result.append(node)
+                walk(node.children)
+        walk(self.roots)
+        return result
+
+    def menu(self):
+        """Головні категорії з прямими підкатегоріями для каталогу"""
+        return [{
+            'id': root.id,
+            'name': root.name,
+            'full_path': root.full_path,
+            'children': [{'id': child.id, 'name': child.name, 'full_path': child.full_path}
+                         for child in root.children]
+        } for root in self.roots]
+
+
+_lock = threading.Lock()
+_tree = None
+_tree_version = None
+
+
+def get_category_tree():
+    """Повертає дерево категорій, перебудовуючи його лише після зміни версії"""
+    global _tree, _tree_version
+    version = get_version(VERSION_NAME)
+    if _tree is not None and _tree_version == version:
+        return _tree
+    with _lock:
+        if _tree is None or _tree_version != version:
+            from models import db, Category
+            rows = db.session.query(Category.id, Category.name, Category.parent_id).order_by(Category.id).all()
+            _tree = CategoryTree(rows)
+            _tree_version = version
+    return _tree
+
+
+def invalidate_category_tree():
+    """Позначає дерево застарілим у всіх воркерах (викликати після commit)"""
+    global _tree
+    _tree = None
+    bump_version(VERSION_NAME)
@@ -0,0 +1,103 @@
+"""CLI команди додатку (flask <команда>)"""
+import click
+from config import Config
+from models import db
+
+
+def register_commands(app):
+    """Реєструє CLI команди"""
+
+    @app.cli.command('migrate')
+    @click.option('--status', 'show_status', is_flag=True, help='Показати стан міграцій без застосування')
+    def migrate_command(show_status):
+        """Застосувати міграції схеми бази даних"""
+        from migrations import upgrade, status
+        if show_status:
+            for version, description, applied in status(db.engine):
+                click.echo(f"{'[x]' if applied else '[ ]'} {version}: {description}")
+            return
+        applied = upgrade(db.engine)
+        click.echo(f"Застосовано міграцій: {len(applied)}")
+
+    @app.cli.command('rebuild-search-index')
+    def rebuild_search_index_command():
+        """Перебудувати пошукові індекси товарів і користувачів (SQLite FTS5)"""
+        from search import rebuild_search_index
+        rebuilt = rebuild_search_index()
+        click.echo(f"Перебудовано: {', '.join(rebuilt)}" if rebuilt else 'Повнотекстовий індекс не використовується')
+
+    @app.cli.command('outbox-dispatch')
+    @click.option('--once', is_flag=True, help='Один прохід по черзі замість постійної роботи')
+    def outbox_dispatch_command(once):
+        """Відправляти повідомлення з черги (окремий процес диспетчера)"""
+        from flask import current_app
+        from notifications import run_dispatcher
+        click.echo('Диспетчер повідомлень запущено' + ('' if once else ' (Ctrl+C для зупинки)'))
+        try:
+            run_dispatcher(current_app._get_current_object(), once=once)
+        except KeyboardInterrupt:
+            pass
+
+    @app.cli.command('rebuild-order-stats')
+    def rebuild_order_stats_command():
+        """Перерахувати денну статистику замовлень з orders та order_items"""
+        from order_stats import rebuild_order_stats
+        with db.engine.begin() as conn:
+            rebuild_order_stats(conn)
+        # Перебудова йде повз сесію, тому кеш звітів скидаємо явно
+        from report_cache import invalidate_reports
+        invalidate_reports()
+        click.echo('Статистику замовлень перераховано')
+
+    @app.cli.command('process-images')
+    @click.option('--once', is_flag=True, help='Обробити чергу один раз замість постійної роботи')
+    def process_images_command(once):
+        """Обробляти завантажені зображення (окремий процес обробника)"""
+        from flask import current_app
+        from image_queue import run_image_worker
+        click.echo('Обробник зображень запущено' + ('' if once else ' (Ctrl+C для зупинки)'))
+        try:
+            run_image_worker(current_app._get_current_object(), once=once)
+        except KeyboardInterrupt:
+            pass
+
+    @app.cli.command('build-image-variants')
+    @click.option('--workers', type=int, default=None, help='Кількість процесів (за замовчуванням - кількість CPU)')
+    @click.option('--force', is_flag=True, help='Перестворити похідні для всіх зображень')
+    def build_image_variants_command(workers, force):
+        """Створити похідні (srcset, WebP/AVIF, placeholder) для завантажених зображень"""
+        from images import available_formats, backfill_variants
+        click.echo(f"Формати: {', '.join(available_formats())}")
+        processed, failed = backfill_variants(workers=workers, force=force, echo=click.echo)
+        click.echo(f"Готово: оброблено {processed}, помилок {failed}")
+
+    @app.cli.command('gc-uploads')
+    @click.option('--dry-run', is_flag=True, help='Лише показати файли без посилань')
+    @click.option('--grace', type=float, default=None,
+                  help='Не чіпати файли, новіші за стільки годин (за замовчуванням - Config.UPLOAD_ORPHAN_GRACE)')
+    def gc_uploads_command(dry_run, grace):
+        """Знайти завантажені файли без посилань і поставити їх у чергу видалення"""
+        from upload_storage import collect_orphans
+        count, size = collect_orphans(grace=None if grace is None else grace * 3600,
+                                      dry_run=dry_run, echo=click.echo)
+        if dry_run:
+            click.echo(f"Файлів без посилань: {count} ({size} байт)")
+        else:
+            click.echo(f"Поставлено на видалення: {count} ({size} байт); "
+                       f"диспетчер видалить їх через {Config.UPLOAD_DELETE_DELAY} с")
+
+    @app.cli.command('export-orders')
+    @click.option('--from', 'date_from', default='', help='Початкова дата РРРР-ММ-ДД')
+    @click.option('--to', 'date_to', default='', help='Кінцева дата РРРР-ММ-ДД (включно)')
+    @click.option('--format', 'fmt', type=click.Choice(['csv', 'ndjson']), default='csv')
+    @click.option('--output', '-o', type=click.File('w', encoding='utf-8'), default='-',
+                  help='Файл для запису (за замовчуванням stdout)')
+    def export_orders_command(date_from, date_to, fmt, output):
+        """Експортувати замовлення з елементами за період"""
+        from order_export import parse_date_range, iter_export
+        try:
+            start, end = parse_date_range(date_from, date_to)
+        except ValueError:
+            raise click.BadParameter('Дата має бути у форматі РРРР-ММ-ДД')
+        for chunk in iter_export(fmt, start, end):
+            output.write(chunk)
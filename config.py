@@ -1,4 +1,5 @@
 import os
+import tempfile
 from datetime import timedelta
 
 class Config:
@@ -11,8 +12,65 @@ class Config:
     UPLOAD_FOLDER = 'static/uploads'
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB максимум
     ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
+    # Через скільки секунд після видалення запису видаляти файл (див. upload_storage.py)
+    UPLOAD_DELETE_DELAY = 600
+    # Файли без посилань, старші за цей час (секунд), видаляє flask gc-uploads
+    # та диспетчер не частіше ніж раз на UPLOAD_GC_INTERVAL
+    UPLOAD_ORPHAN_GRACE = 24 * 3600
+    UPLOAD_GC_INTERVAL = 24 * 3600
+    
+    # Похідні зображень для srcset (див. images.py)
+    IMAGE_VARIANT_WIDTHS = (160, 320, 640, 1024, 1600)
+    IMAGE_VARIANT_QUALITY = 80
+    IMAGE_PLACEHOLDER_WIDTH = 16
+    # Обмеження завантажень (захист від "бомб" декомпресії)
+    UPLOAD_MAX_FILE_SIZE = 10 * 1024 * 1024  # Байт на один файл
+    IMAGE_MAX_DIMENSION = 12000  # Пікселів по стороні
+    IMAGE_MAX_PIXELS = 50_000_000
+    IMAGE_ORIGINAL_MAX_SIDE = 2560  # Більші оригінали зменшуються при обробці
+    
+    # Обробка завантажених зображень у пулі процесів (див. image_queue.py)
+    # false - обробник запускається окремо: flask process-images
+    IMAGE_PROCESSING_IN_APP = os.environ.get('IMAGE_PROCESSING_IN_APP', 'true').lower() == 'true'
+    IMAGE_WORKERS = int(os.environ.get('IMAGE_WORKERS', 2))  # Процесів у пулі
+    IMAGE_POLL_INTERVAL = 2  # Як часто перевіряти чергу (секунди)
+    
+    # Обмеження синхронізації кошика з localStorage (/api/cart/sync)
+    CART_SYNC_MAX_ITEMS = 200
+    CART_SYNC_MAX_BYTES = 64 * 1024
+    CART_MAX_QUANTITY = 10000
+    
+    # Скільки чекати на блокування запису SQLite іншим воркером (мс)
+    SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 15000))
+    
+    # Idempotency-Key для checkout та додавання в кошик (див. idempotency.py)
+    IDEMPOTENCY_TTL = 24 * 60 * 60  # Скільки зберігати першу відповідь (секунди)
+    IDEMPOTENCY_LOCK_TIMEOUT = 60  # Після цього незавершений запит з ключем вважається перерваним
+    
+    # Кеш статистики адмін-панелі між воркерами (секунди, див. report_cache.py)
+    REPORT_CACHE_TTL = 60
+    
+    # Спільна директорія для стану, який мають бачити всі воркери Gunicorn
+    # (версії кешів тощо). /dev/shm - у пам'яті, як і worker_tmp_dir
+    SHARED_STATE_DIR = os.environ.get('SHARED_STATE_DIR') or (
+        '/dev/shm/shop' if os.path.isdir('/dev/shm') else os.path.join(tempfile.gettempdir(), 'shop')
+    )
     
     # Налаштування Telegram бота
     TELEGRAM_BOT_TOKEN = os.environ.get('TELEGRAM_BOT_TOKEN') or ''  # Токен бота
     TELEGRAM_CHAT_ID = os.environ.get('TELEGRAM_CHAT_ID') or ''  # ID групи або каналу
     TELEGRAM_ENABLED = os.environ.get('TELEGRAM_ENABLED', 'false').lower() == 'true'  # Увімкнути/вимкнути
+    TELEGRAM_API_URL = os.environ.get('TELEGRAM_API_URL') or 'https://api.telegram.org'  # Можна вказати локальну заглушку
+    TELEGRAM_TIMEOUT = 10  # Таймаут запиту до Bot API (секунди)
+    
+    # Черга повідомлень (outbox) та фоновий диспетчер, див. notifications.py
+    # false - диспетчер запускається окремо: flask outbox-dispatch
+    OUTBOX_DISPATCHER_IN_APP = os.environ.get('OUTBOX_DISPATCHER_IN_APP', 'true').lower() == 'true'
+    OUTBOX_POLL_INTERVAL = 2  # Як часто перевіряти чергу (секунди)
+    OUTBOX_BATCH_SIZE = 100  # Скільки повідомлень брати за один прохід
+    OUTBOX_MAX_ATTEMPTS = 8  # Після цього повідомлення позначається failed
+    OUTBOX_RETRY_BASE_DELAY = 5  # Затримка повтору: 5, 10, 20, ... секунд
+    OUTBOX_RETRY_MAX_DELAY = 900
+    OUTBOX_RETENTION_DAYS = 7  # Скільки зберігати відправлені повідомлення
+    TELEGRAM_MIN_INTERVAL = 3.0  # Мінімум секунд між повідомленнями (ліміт Telegram для груп - 20/хв)
+    TELEGRAM_DIGEST_THRESHOLD = 3  # Більше повідомлень у черзі - об'єднуються в дайджест
@@ -2,7 +2,8 @@ from flask_wtf import FlaskForm
 from flask_wtf.file import FileAllowed, MultipleFileField
 from wtforms import StringField, PasswordField, TextAreaField, IntegerField, SelectField, SubmitField, BooleanField
 from wtforms.validators import DataRequired, Email, EqualTo, Length, ValidationError, Optional
-from models import User, Product, Category
+from models import User
+from category_tree import get_category_tree
 
 class LoginForm(FlaskForm):
     """Форма входу"""
@@ -44,33 +45,27 @@ class CategoryForm(FlaskForm):
         super(CategoryForm, self).__init__(*args, **kwargs)
         self.parent_id.choices = [(0, 'Без батьківської категорії')]
         
-        # Отримуємо всі головні категорії
-        categories = Category.query.filter_by(parent_id=None).all()
+        # Головні категорії та нащадки беремо з кешу дерева категорій
+        tree = get_category_tree()
         
         # Якщо редагуємо категорію, виключаємо її та всі її підкатегорії зі списку
         excluded_ids = set()
         current_parent_id = None
         if category_id:
             excluded_ids.add(category_id)
-            # Додаємо всі підкатегорії поточної категорії
-            category = Category.query.get(category_id)
-            if category:
+            excluded_ids.update(tree.descendant_ids(category_id))
+            node = tree.get(category_id)
+            if node:
                 # Зберігаємо поточну батьківську категорію, щоб вона завжди була доступна
-                current_parent_id = category.parent_id
-                def get_all_children(cat):
-                    children_ids = {cat.id}
-                    for child in cat.children:
-                        children_ids.update(get_all_children(child))
-                    return children_ids
-                excluded_ids.update(get_all_children(category))
+                current_parent_id = node.parent_id
         
-        for cat in categories:
+        for cat in tree.roots:
             if cat.id not in excluded_ids:
                 self.parent_id.choices.append((cat.id, cat.name))
         
         # Якщо поточна батьківська категорія не в списку (через виключення), додаємо її
         if current_parent_id and current_parent_id not in [choice[0] for choice in self.parent_id.choices]:
-            parent_cat = Category.query.get(current_parent_id)
+            parent_cat = tree.get(current_parent_id)
             if parent_cat:
                 # Вставляємо після першого елемента (0, 'Без батьківської категорії')
                 self.parent_id.choices.insert(1, (parent_cat.id, parent_cat.name))
@@ -94,15 +89,8 @@ class ProductForm(FlaskForm):
         super(ProductForm, self).__init__(*args, **kwargs)
         self.category_id.choices = [(0, 'Без категорії')]
         # Додаємо всі категорії з повним шляхом
-        def add_categories(categories, prefix=""):
-            for cat in categories:
-                full_name = f"{prefix}{cat.name}"
-                self.category_id.choices.append((cat.id, full_name))
-                if cat.children:
-                    add_categories(cat.children, f"{full_name} > ")
-        
-        main_categories = Category.query.filter_by(parent_id=None).all()
-        add_categories(main_categories)
+        for node in get_category_tree().flat():
+            self.category_id.choices.append((node.id, node.full_path))
 
 
 class OrderStatusForm(FlaskForm):
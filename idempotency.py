@@ -0,0 +1,210 @@
+"""Idempotency-Key для POST запитів, що змінюють дані (checkout, кошик).
+
+Клієнт передає ключ у заголовку Idempotency-Key (або в полі форми
+idempotency_key). Перший запит з ключем виконується і його відповідь
+зберігається в таблиці idempotency_keys на Config.IDEMPOTENCY_TTL;
+повтори з тим самим ключем отримують збережену відповідь без повторного
+виконання. Для звичайних HTML форм (ключ у полі форми, не JSON) помилки
+та повтори - це перенаправлення з flash-повідомленням: ключ рендериться в
+сторінку і повторно надсилається, наприклад, після кнопки "Назад". Таблиця спільна для всіх воркерів, а унікальний індекс
+(user_id, key) гарантує, що паралельні повтори не виконаються двічі:
+вони чекають на завершення першого запиту і отримують його відповідь.
+
+Прострочені ключі видаляє фоновий диспетчер (notifications.py).
+"""
+import hashlib
+import json
+import time
+from datetime import datetime, timedelta
+from functools import wraps
+from flask import request, jsonify, make_response, flash, redirect, url_for
+from flask_login import current_user
+from sqlalchemy.exc import IntegrityError
+from config import Config
+
+HEADER = 'Idempotency-Key'
+FORM_FIELD = 'idempotency_key'
+MAX_KEY_LENGTH = 255
+
+# Скільки повтор чекає на завершення першого запиту з тим самим ключем
+WAIT_TIMEOUT = 10.0
+WAIT_INTERVAL = 0.1
+
+# Поля форми, які не впливають на зміст запиту
+_IGNORED_FIELDS = {'csrf_token', FORM_FIELD}
+
+
+def _request_key():
+    key = request.headers.get(HEADER) or request.form.get(FORM_FIELD)
+    return key.strip() if key else None
+
+
+def _request_hash():
+    """Відбиток запиту: той самий ключ з іншими параметрами - помилка клієнта"""
+    form = sorted((k, v) for k, v in request.form.items(multi=True) if k not in _IGNORED_FIELDS)
+    payload = json.dumps([request.method, request.path, form, request.get_json(silent=True)],
+                         sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def _is_form_request():
+    """Звичайна HTML форма з ключем у полі форми, а не API клієнт"""
+    return not request.is_json and not request.headers.get(HEADER)
+
+
+def _back():
+    """Перенаправлення на сторінку з формою (лише в межах сайту)"""
+    referrer = request.referrer
+    if referrer and referrer.startswith(request.host_url):
+        return redirect(referrer)
+    return redirect(url_for('main.index'))
+
+
+def _error(message, status, form_message):
+    if _is_form_request():
+        flash(form_message, 'error')
+        return _back()
+    response = jsonify({'success': False, 'message': message})
+    response.status_code = status
+    return response
+
+
+def _replay(record):
+    if _is_form_request():
+        # Перше повідомлення вже показано; без цього повтор був би непомітним
+        flash('Цю форму вже було надіслано раніше, повторно запит не виконувався', 'info')
+    response = make_response(record.response_body or b'', record.status_code)
+    if record.content_type:
+        response.content_type = record.content_type
+    if record.location:
+        response.headers['Location'] = record.location
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def _is_stale(record, now):
+    """Ключ прострочений або перший запит перервався, не зберігши відповідь"""
+    if record.expires_at <= now:
+        return True
+    lock_timeout = timedelta(seconds=Config.IDEMPOTENCY_LOCK_TIMEOUT)
+    return record.status_code is None and record.created_at < now - lock_timeout
+
+
+def _existing_response(user_id, key, request_hash):
+    """Відповідь для повтору, або None, якщо ключа (вже) немає і запит можна виконати"""
+    from models import db, IdempotencyKey
+
+    deadline = time.monotonic() + WAIT_TIMEOUT
+    first = True
+    while True:
+        if not first:
+            # rollback завершує транзакцію читання, щоб побачити свіжий стан
+            db.session.rollback()
+        first = False
+        record = IdempotencyKey.query.filter_by(user_id=user_id, key=key).first()
+        if record is None:
+            return None
+        if _is_stale(record, datetime.utcnow()):
+            IdempotencyKey.query.filter_by(id=record.id).delete(synchronize_session=False)
+            db.session.commit()
+            return None
+        if record.request_hash != request_hash:
+            return _error('Idempotency-Key вже використано для іншого запиту', 422,
+                          'Цю форму вже було надіслано з іншими даними, спробуйте ще раз')
+        if record.status_code is not None:
+            return _replay(record)
+        if time.monotonic() >= deadline:
+            response = _error('Запит з цим Idempotency-Key ще обробляється', 409,
+                              'Попередній запит ще обробляється, зачекайте кілька секунд')
+            response.headers['Retry-After'] = '1'
+            return response
+        time.sleep(WAIT_INTERVAL)
+
+
+def _claim(user_id, key, request_hash):
+    """Резервує ключ. Повертає (id запису, None) або (None, відповідь для повтору)"""
+    from models import db, IdempotencyKey
+
+    for _ in range(3):
+        response = _existing_response(user_id, key, request_hash)
+        if response is not None:
+            return None, response
+        now = datetime.utcnow()
+        record = IdempotencyKey(
+            user_id=user_id,
+            key=key,
+            request_hash=request_hash,
+            created_at=now,
+            expires_at=now + timedelta(seconds=Config.IDEMPOTENCY_TTL)
+        )
+        db.session.add(record)
+        try:
+            db.session.commit()
+            return record.id, None
+        except IntegrityError:
+            # Паралельний запит з тим самим ключем встиг першим
+            db.session.rollback()
+    return None, _error('Не вдалося обробити Idempotency-Key', 409,
+                        'Не вдалося обробити форму, спробуйте ще раз')
+
+
+def _store(record_id, response):
+    from models import db, IdempotencyKey
+
+    db.session.rollback()
+    query = IdempotencyKey.query.filter_by(id=record_id)
+    if response.status_code >= 500 or response.direct_passthrough:
+        # Помилку сервера можна повторити з тим самим ключем
+        query.delete(synchronize_session=False)
+    else:
+        query.update({
+            'status_code': response.status_code,
+            'response_body': response.get_data(),
+            'content_type': response.content_type,
+            'location': response.headers.get('Location'),
+        }, synchronize_session=False)
+    db.session.commit()
+
+
+def idempotent(f):
+    """Декоратор маршруту: виконує запит з Idempotency-Key не більше одного разу.
+
+    Ставиться після login_required/check_user_blocked. Запити без ключа
+    обробляються як звичайно.
+    """
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        key = _request_key()
+        if not key or not current_user.is_authenticated:
+            return f(*args, **kwargs)
+        if len(key) > MAX_KEY_LENGTH:
+            return _error('Некоректний Idempotency-Key', 400, 'Некоректна форма, оновіть сторінку')
+
+        record_id, response = _claim(current_user.id, key, _request_hash())
+        if response is not None:
+            return response
+
+        try:
+            response = make_response(f(*args, **kwargs))
+        except Exception:
+            _store(record_id, make_response('', 500))
+            raise
+        _store(record_id, response)
+        return response
+    return decorated_function
+
+
+def new_idempotency_key():
+    """Новий ключ для форм (шаблони: <input name="idempotency_key">)"""
+    import uuid
+    return uuid.uuid4().hex
+
+
+def cleanup_idempotency_keys():
+    """Видаляє прострочені ключі"""
+    from models import db, IdempotencyKey
+    deleted = IdempotencyKey.query.filter(
+        IdempotencyKey.expires_at < datetime.utcnow()
+    ).delete(synchronize_session=False)
+    db.session.commit()
+    return deleted
@@ -0,0 +1,182 @@
+"""Фонова обробка завантажених зображень у пулі процесів.
+
+Маршрути адмін-панелі лише зберігають файл і створюють ProductImage зі
+станом processing_state='pending' - запит завершується одразу, без
+декодування Pillow. Обробник вибирає такі записи з БД і виконує
+images.process_upload() (оптимізований оригінал - новий файл, похідні
+для srcset) у пулі з Config.IMAGE_WORKERS процесів, а результат (разом з
+новим image_url) записує в ProductImage зі станом 'ready' (або 'failed'). Поки зображення обробляється, сторінки
+показують заглушку (partials/picture.html).
+
+Черга - це самі записи в БД, тому після перезапуску незавершені
+зображення обробляються знову. Як і диспетчер повідомлень
+(notifications.py), одночасно працює лише один обробник (flock
+images.lock): потік в одному з воркерів Gunicorn
+(Config.IMAGE_PROCESSING_IN_APP) або окремий процес `flask process-images`.
+"""
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from sqlalchemy import func
+from config import Config
+
+STATE_PENDING = 'pending'
+STATE_READY = 'ready'
+STATE_FAILED = 'failed'
+
+_wakeup = threading.Event()
+_thread = None
+_thread_pid = None
+_thread_start_lock = threading.Lock()
+
+
+def notify_image_worker():
+    """Будить обробник, якщо він працює в цьому процесі (викликати після commit)"""
+    _wakeup.set()
+
+
+def _process_in_worker(task):
+    """Виконується в процесі пулу: (URL, шлях) -> (URL, поля ProductImage або None, помилка)"""
+    from images import process_upload
+    url, path = task
+    try:
+        return url, process_upload(path), None
+    except Exception as e:
+        return url, None, str(e)
+
+
+def process_pending(pool, limit=None):
+    """Обробляє до limit файлів, зображення яких у стані 'pending'. Повертає кількість файлів.
+
+    Файл, спільний для кількох записів (upload_storage.py), обробляється
+    один раз. Оброблена версія - новий файл (файли з адресацією за вмістом
+    не змінюються), тому записи переводяться на її URL, а завантажений файл
+    ставиться в чергу видалення. Викликається в контексті додатку.
+    """
+    from sqlalchemy import and_, update
+    from images import local_path
+    from models import db, Product, ProductImage
+    from upload_storage import enqueue_file_deletions
+
+    limit = limit or Config.IMAGE_WORKERS * 2
+    urls = [url for (url,) in db.session.query(ProductImage.image_url).filter(
+        ProductImage.processing_state == STATE_PENDING
+    ).group_by(ProductImage.image_url).order_by(func.min(ProductImage.id)).limit(limit)]
+    # Не тримаємо транзакцію читання, поки працює пул
+    db.session.rollback()
+    if not urls:
+        return 0
+
+    paths = {url: local_path(url) for url in urls}
+    tasks = [(url, path) for url, path in paths.items() if path and os.path.exists(path)]
+    results = list(pool.map(_process_in_worker, tasks))
+    results += [(url, None, 'файл не знайдено') for url in urls if (url, paths[url]) not in tasks]
+
+    for url, fields, error in results:
+        pending = and_(ProductImage.image_url == url, ProductImage.processing_state == STATE_PENDING)
+        if error:
+            print(f"Помилка обробки зображення {url}: {error}")
+            db.session.execute(update(ProductImage).where(pending).values(processing_state=STATE_FAILED),
+                               execution_options={'synchronize_session': False})
+            continue
+        new_url = fields['image_url']
+        result = db.session.execute(
+            update(ProductImage).where(pending).values(processing_state=STATE_READY, **fields),
+            execution_options={'synchronize_session': False}
+        )
+        if new_url == url:
+            if result.rowcount == 0:
+                # Зображення видалили, поки воно оброблялося: диспетчер прибере створені похідні
+                enqueue_file_deletions([paths[url]])
+            continue
+        # Головне зображення товару (Product.image_url) теж переводимо на оброблений файл
+        db.session.execute(
+            update(Product).where(Product.image_url == url).values(image_url=new_url),
+            execution_options={'synchronize_session': False}
+        )
+        # Завантажений файл більше не потрібен (диспетчер перевірить посилання); оброблений -
+        # якщо зображення видалили, поки воно оброблялося
+        enqueue_file_deletions([paths[url]] + ([local_path(new_url)] if result.rowcount == 0 else []))
+    db.session.commit()
+    return len(results)
+
+
+def reuse_processed(product_image):
+    """Якщо завантажено вже оброблений файл (його URL має готовий запис) - копіює результат (без commit)"""
+    from models import ProductImage
+    processed = ProductImage.query.filter(
+        ProductImage.image_url == product_image.image_url,
+        ProductImage.processing_state == STATE_READY
+    ).first()
+    if processed is None:
+        return False
+    for field in ('variants', 'width', 'height', 'placeholder'):
+        setattr(product_image, field, getattr(processed, field))
+    product_image.processing_state = STATE_READY
+    return True
+
+
+def _make_pool():
+    # spawn: воркер Gunicorn має потоки та відкриті з'єднання, fork їх копіював би
+    return ProcessPoolExecutor(max_workers=Config.IMAGE_WORKERS,
+                               mp_context=multiprocessing.get_context('spawn'))
+
+
+def run_image_worker(app, stop_event=None, once=False):
+    """Цикл обробника. Поки блокування тримає інший процес - лише чекає на нього"""
+    from models import db
+    from notifications import try_lock
+
+    stop_event = stop_event or threading.Event()
+    lock = None
+    pool = None
+    try:
+        while not stop_event.is_set():
+            if lock is None:
+                lock = try_lock('images.lock')
+            if lock is not None:
+                with app.app_context():
+                    try:
+                        pool = pool or _make_pool()
+                        while process_pending(pool) and not stop_event.is_set():
+                            pass
+                    except Exception as e:
+                        db.session.rollback()
+                        print(f"Помилка обробника зображень: {e}")
+                        # Пул міг зламатися (процес завершився аварійно) - створимо новий
+                        if pool is not None:
+                            pool.shutdown(wait=False, cancel_futures=True)
+                            pool = None
+            if once:
+                break
+            _wakeup.wait(Config.IMAGE_POLL_INTERVAL)
+            _wakeup.clear()
+    finally:
+        if pool is not None:
+            pool.shutdown()
+        if lock not in (None, True):
+            lock.close()
+
+
+def _ensure_worker_thread(app):
+    """Запускає потік обробника в поточному процесі (один раз, також після fork)"""
+    global _thread, _thread_pid
+    if _thread_pid == os.getpid() and _thread is not None and _thread.is_alive():
+        return
+    with _thread_start_lock:
+        if _thread_pid == os.getpid() and _thread is not None and _thread.is_alive():
+            return
+        _thread = threading.Thread(target=run_image_worker, args=(app,), name='image-worker', daemon=True)
+        _thread.start()
+        _thread_pid = os.getpid()
+
+
+def init_image_processing(app):
+    """Запускає обробник у воркері при першому запиті (не в CLI командах)"""
+    if not app.config.get('IMAGE_PROCESSING_IN_APP'):
+        return
+
+    @app.before_request
+    def start_image_worker():
+        _ensure_worker_thread(app)
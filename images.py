@@ -0,0 +1,335 @@
+"""Похідні зображення товарів для адаптивних <img srcset> / <picture>.
+
+Для кожного завантаженого зображення створюються копії кількох ширин
+(Config.IMAGE_VARIANT_WIDTHS) у форматах WebP, AVIF (якщо Pillow його
+підтримує, наприклад з пакетом pillow-avif-plugin) та JPEG як запасний
+варіант, а також крихітний розмитий placeholder (data URI), який
+показується, поки завантажується саме зображення.
+
+Файли кладуться поруч з оригіналом у підкаталог variants/:
+static/uploads/products/variants/<ім'я>-<ширина>.<формат>. Їх URL, розміри
+оригіналу та placeholder зберігаються в ProductImage (variants, width,
+height, placeholder).
+
+build_variants() не потребує контексту додатку, тому може виконуватися в
+окремих процесах (`flask build-image-variants`).
+
+Завантаження перевіряються до збереження (inspect_upload): лише за
+заголовком, без декодування пікселів, з обмеженнями Config.IMAGE_MAX_*
+проти "бомб" декомпресії. Декодування повністю - лише у фоні, один раз на
+файл (process_upload); оптимізований оригінал - новий файл, а не
+перезаписаний завантажений.
+"""
+import base64
+import io
+import os
+from config import Config
+
+try:
+    from PIL import Image, ImageOps
+    # Запобіжник Pillow від "бомб": відкриття більших зображень - помилка
+    Image.MAX_IMAGE_PIXELS = Config.IMAGE_MAX_PIXELS
+    HAS_PIL = True
+except ImportError:
+    HAS_PIL = False
+
+VARIANTS_DIR = 'variants'
+
+# Порядок важливий: у <picture> браузер бере перше підтримуване джерело
+FORMAT_ORDER = ('avif', 'webp', 'jpeg')
+MIME_TYPES = {'avif': 'image/avif', 'webp': 'image/webp', 'jpeg': 'image/jpeg'}
+_EXTENSIONS = {'avif': 'avif', 'webp': 'webp', 'jpeg': 'jpg'}
+_PIL_FORMATS = {'avif': 'AVIF', 'webp': 'WEBP', 'jpeg': 'JPEG'}
+
+# Формати, які приймаються при завантаженні, та розширення, під яким їх зберігати
+UPLOAD_FORMATS = {'JPEG': 'jpg', 'PNG': 'png', 'GIF': 'gif', 'WEBP': 'webp'}
+
+
+def available_formats():
+    """Формати похідних, які вміє записувати встановлений Pillow"""
+    if not HAS_PIL:
+        return ()
+    try:
+        import pillow_avif  # noqa: F401 - реєструє AVIF у Pillow < 11.3
+    except ImportError:
+        pass
+    Image.init()
+    return tuple(fmt for fmt in FORMAT_ORDER if _PIL_FORMATS[fmt] in Image.SAVE)
+
+
+def local_path(url):
+    """'/static/uploads/...' -> 'static/uploads/...' (None для зовнішніх URL)"""
+    if url and url.startswith('/' + Config.UPLOAD_FOLDER + '/'):
+        return url[1:]
+    return None
+
+
+def _variant_path(source_path, width, fmt):
+    folder, filename = os.path.split(source_path)
+    stem = os.path.splitext(filename)[0]
+    return os.path.join(folder, VARIANTS_DIR, f'{stem}-{width}.{_EXTENSIONS[fmt]}').replace('\\', '/')
+
+
+def _prepare(img, fmt):
+    """Режим кольору, який підтримує формат (JPEG - без прозорості, на білому тлі)"""
+    has_alpha = img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info)
+    if fmt == 'jpeg':
+        if has_alpha:
+            rgba = img.convert('RGBA')
+            background = Image.new('RGB', rgba.size, (255, 255, 255))
+            background.paste(rgba, mask=rgba.getchannel('A'))
+            return background
+        return img.convert('RGB') if img.mode != 'RGB' else img
+    if has_alpha:
+        return img.convert('RGBA') if img.mode != 'RGBA' else img
+    return img.convert('RGB') if img.mode != 'RGB' else img
+
+
+def _save(img, path, fmt):
+    """Атомарно записує похідну. Похідні файлів з адресацією за вмістом -
+    write-once (upload_storage.py): наявна не перезаписується"""
+    from upload_storage import IMMUTABLE_URL_RE, write_once
+    immutable = IMMUTABLE_URL_RE.match('/' + path)
+    if immutable and os.path.exists(path):
+        return
+    options = {'quality': Config.IMAGE_VARIANT_QUALITY}
+    if fmt == 'jpeg':
+        options.update(optimize=True, progressive=True)
+    elif fmt == 'webp':
+        options.update(method=4)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    img.save(tmp_path, _PIL_FORMATS[fmt], **options)
+    if immutable:
+        write_once(tmp_path, path)
+    else:
+        os.replace(tmp_path, path)
+
+
+def _placeholder(img):
+    """Крихітна копія зображення як data URI (браузер розтягує її з розмиттям)"""
+    width = Config.IMAGE_PLACEHOLDER_WIDTH
+    height = max(1, round(img.height * width / img.width))
+    small = _prepare(img, 'jpeg').resize((width, height), Image.BILINEAR)
+    buffer = io.BytesIO()
+    small.save(buffer, 'JPEG', quality=40)
+    return 'data:image/jpeg;base64,' + base64.b64encode(buffer.getvalue()).decode('ascii')
+
+
+class ImageRejected(ValueError):
+    """Завантажений файл не є допустимим зображенням"""
+
+
+def inspect_upload(path):
+    """Перевіряє завантажений файл за заголовком (без декодування пікселів).
+
+    Повертає розширення для збереження за справжнім форматом файлу (а не
+    за іменем), або ImageRejected, якщо формат не підтримується чи
+    розміри перевищують Config.IMAGE_MAX_DIMENSION / IMAGE_MAX_PIXELS.
+    """
+    if not HAS_PIL:
+        raise ImageRejected('Обробка зображень недоступна (не встановлено Pillow)')
+    try:
+        with Image.open(path) as img:
+            pil_format = img.format
+            width, height = img.size
+    except Image.DecompressionBombError:
+        raise ImageRejected('Зображення має завелику кількість пікселів')
+    except Exception:
+        raise ImageRejected('Файл не є зображенням')
+    if pil_format not in UPLOAD_FORMATS:
+        raise ImageRejected(f'Непідтримуваний формат зображення: {pil_format}')
+    _check_size(width, height)
+    return UPLOAD_FORMATS[pil_format]
+
+
+def _check_size(width, height):
+    if max(width, height) > Config.IMAGE_MAX_DIMENSION:
+        raise ImageRejected(f'Зображення завелике: {width}x{height}, максимум {Config.IMAGE_MAX_DIMENSION} px по стороні')
+    if width * height > Config.IMAGE_MAX_PIXELS:
+        raise ImageRejected(f'Зображення завелике: {width * height} пікселів, максимум {Config.IMAGE_MAX_PIXELS}')
+
+
+def _open(path, max_side=None):
+    """Декодує зображення один раз, з урахуванням EXIF орієнтації.
+
+    Для великих JPEG використовується draft(): декодер одразу зменшує
+    зображення в 2/4/8 разів, не розпаковуючи всі пікселі.
+    """
+    with Image.open(path) as img:
+        _check_size(*img.size)
+        pil_format = img.format
+        is_animated = getattr(img, 'is_animated', False)
+        if max_side and pil_format == 'JPEG' and img.mode in ('RGB', 'L', 'CMYK'):
+            img.draft(img.mode, (max_side, max_side))
+        img = ImageOps.exif_transpose(img)
+        img.load()
+    return img, pil_format, is_animated
+
+
+def _build_variants(img, source_path, formats):
+    width, height = img.size
+    widths = [w for w in Config.IMAGE_VARIANT_WIDTHS if w < width] or [width]
+    if width <= max(Config.IMAGE_VARIANT_WIDTHS) and width not in widths:
+        # Найбільша копія - у розмірі оригіналу
+        widths.append(width)
+
+    os.makedirs(os.path.join(os.path.dirname(source_path), VARIANTS_DIR), exist_ok=True)
+    variants = {fmt: [] for fmt in formats}
+    # Від більшої ширини до меншої: кожна копія зменшується з попередньої
+    current = img
+    for target in sorted(widths, reverse=True):
+        if target < current.width:
+            current = current.resize((target, max(1, round(height * target / width))), Image.LANCZOS)
+        for fmt in formats:
+            path = _variant_path(source_path, target, fmt)
+            _save(_prepare(current, fmt), path, fmt)
+            variants[fmt].insert(0, [target, '/' + path])
+
+    return {
+        'width': width,
+        'height': height,
+        'variants': variants,
+        'placeholder': _placeholder(img),
+    }
+
+
+def build_variants(source_path, formats=None):
+    """Створює похідні файли для source_path (шлях 'static/uploads/...').
+
+    Повертає словник з полями для ProductImage: width, height, placeholder
+    та variants ({формат: [[ширина, URL], ...]} за зростанням ширини).
+    Ширини, більші за оригінал, не створюються; якщо оригінал не ширший за
+    найбільшу з Config.IMAGE_VARIANT_WIDTHS, найбільша копія - в його розмірі.
+    """
+    img, _, _ = _open(source_path)
+    return _build_variants(img, source_path, formats or available_formats())
+
+
+def _store_processed(img, path, pil_format):
+    """Зберігає оптимізовану версію як новий файл з адресацією за вмістом; повертає його шлях.
+
+    Файл path не змінюється (upload_storage.write_once): оброблена версія
+    має інший вміст, отже інший хеш і URL.
+    """
+    from upload_storage import store_stream, upload_folder
+    options = {}
+    if pil_format == 'JPEG':
+        img = _prepare(img, 'jpeg')
+        options = {'quality': 85, 'optimize': True, 'progressive': True}
+    elif pil_format == 'PNG':
+        options = {'optimize': True}
+    elif pil_format == 'WEBP':
+        options = {'quality': 85, 'method': 4}
+    buffer = io.BytesIO()
+    img.save(buffer, pil_format, **options)
+    buffer.seek(0)
+    return store_stream(buffer, UPLOAD_FORMATS[pil_format], upload_folder(path))
+
+
+def process_upload(path):
+    """Повна обробка нового завантаження за одне декодування.
+
+    Зображення зменшується до Config.IMAGE_ORIGINAL_MAX_SIDE (великі JPEG -
+    вже при декодуванні), оптимізована версія у своєму форматі (без EXIF)
+    записується один раз як новий файл, і з того самого зображення
+    створюються похідні. Анімовані GIF не перекодовуються. Виконується в
+    процесі пулу (image_queue.py); повертає поля для ProductImage разом з
+    новим image_url.
+    """
+    max_side = Config.IMAGE_ORIGINAL_MAX_SIDE
+    img, pil_format, is_animated = _open(path, max_side=max_side)
+    if not is_animated:
+        if max(img.size) > max_side:
+            img.thumbnail((max_side, max_side), Image.LANCZOS)
+        path = _store_processed(img, path, pil_format)
+    fields = _build_variants(img, path, available_formats())
+    fields['image_url'] = '/' + path
+    return fields
+
+
+def srcset(entries):
+    """[[ширина, URL], ...] -> значення атрибута srcset"""
+    return ', '.join(f'{url} {width}w' for width, url in entries)
+
+
+def _build_in_worker(task):
+    """Виконується в процесі пулу: (id, шлях) -> (id, результат або None, помилка)"""
+    image_id, path = task
+    try:
+        return image_id, build_variants(path), None
+    except Exception as e:
+        return image_id, None, str(e)
+
+
+def _adopt_legacy_images():
+    """Створює ProductImage для старих товарів, у яких є лише Product.image_url.
+
+    Похідні зберігаються в ProductImage, тож без такого запису товар і далі
+    віддавав би повний оригінал. Зовнішні URL не чіпаються. Повертає
+    кількість створених записів.
+    """
+    from datetime import datetime
+    from models import db, Product, ProductImage
+
+    rows = db.session.query(Product.id, Product.image_url).filter(
+        Product.image_url.startswith('/' + Config.UPLOAD_FOLDER + '/'),
+        ~Product.images.any()
+    ).all()
+    now = datetime.utcnow()
+    db.session.add_all(
+        ProductImage(product_id=product_id, image_url=url, is_primary=True, display_order=0, created_at=now)
+        for product_id, url in rows
+    )
+    db.session.commit()
+    return len(rows)
+
+
+def backfill_variants(workers=None, force=False, batch_size=200, echo=print):
+    """Створює похідні для вже завантажених зображень паралельно в пулі процесів.
+
+    Старі товари, у яких є лише Product.image_url, спочатку отримують
+    ProductImage для цього файлу. Обробляє ProductImage без похідних
+    (force - усі) пачками по batch_size; кожна пачка зберігається окремим
+    commit. Повертає (оброблено, помилок).
+    """
+    from concurrent.futures import ProcessPoolExecutor
+    from sqlalchemy import update
+    from models import db, ProductImage
+
+    adopted = _adopt_legacy_images()
+    if adopted:
+        echo(f"Додано записи зображень для старих товарів (лише image_url): {adopted}")
+
+    processed = failed = 0
+    last_id = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        while True:
+            query = db.session.query(ProductImage.id, ProductImage.image_url).filter(ProductImage.id > last_id)
+            if not force:
+                query = query.filter(ProductImage.variants.is_(None))
+            rows = query.order_by(ProductImage.id).limit(batch_size).all()
+            db.session.rollback()
+            if not rows:
+                break
+            last_id = rows[-1].id
+
+            tasks = []
+            for image_id, url in rows:
+                path = local_path(url)
+                if path and os.path.exists(path):
+                    tasks.append((image_id, path))
+                else:
+                    echo(f"Пропущено #{image_id}: файл не знайдено ({url})")
+            for image_id, result, error in pool.map(_build_in_worker, tasks):
+                if error:
+                    failed += 1
+                    echo(f"Помилка #{image_id}: {error}")
+                    continue
+                db.session.execute(
+                    update(ProductImage).where(ProductImage.id == image_id).values(**result),
+                    execution_options={'synchronize_session': False}
+                )
+                processed += 1
+            db.session.commit()
+            echo(f"Оброблено: {processed}")
+    return processed, failed
@@ -0,0 +1,221 @@
+"""Версійні міграції схеми бази даних.
+
+Кожна міграція має номер і застосовується один раз; застосовані версії
+записуються в таблицю schema_migrations. Міграції ідемпотентні: нова база,
+створена db.create_all(), вже має всі колонки та індекси, і міграції лише
+позначаються як виконані.
+
+Запуск: автоматично в create_app() або вручну `flask migrate`.
+"""
+import os
+from datetime import datetime
+from sqlalchemy import inspect, text
+from config import Config
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+MIGRATIONS = []
+
+
+def migration(version, description):
+    """Реєструє функцію міграції fn(conn) з номером version"""
+    def decorator(f):
+        MIGRATIONS.append((version, description, f))
+        return f
+    return decorator
+
+
+def _columns(conn, table):
+    inspector = inspect(conn)
+    if table not in inspector.get_table_names():
+        return None
+    return [col['name'] for col in inspector.get_columns(table)]
+
+
+def _datetime(conn):
+    """Тип колонки дати й часу: PostgreSQL не знає DATETIME"""
+    return 'TIMESTAMP' if conn.dialect.name == 'postgresql' else 'DATETIME'
+
+
+def _boolean(conn, default):
+    """Логічна колонка: у SQLite - INTEGER (0/1), у PostgreSQL - BOOLEAN, як у моделях"""
+    if conn.dialect.name == 'postgresql':
+        return f"BOOLEAN DEFAULT {'TRUE' if default else 'FALSE'} NOT NULL"
+    return f'INTEGER DEFAULT {int(default)} NOT NULL'
+
+
+def _add_column(conn, table, column, definition):
+    """Додає колонку, якщо її ще немає. Повертає True, якщо колонку додано"""
+    columns = _columns(conn, table)
+    if columns is None or column in columns:
+        return False
+    conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {definition}"))
+    return True
+
+
+@migration(1, 'products.is_active')
+def _products_is_active(conn):
+    _add_column(conn, 'products', 'is_active', _boolean(conn, True))
+
+
+@migration(2, 'product_images.display_order')
+def _product_images_display_order(conn):
+    if _add_column(conn, 'product_images', 'display_order', 'INTEGER DEFAULT 0 NOT NULL'):
+        # Встановлюємо порядок для існуючих зображень
+        conn.execute(text("""
+            UPDATE product_images
+            SET display_order = (
+                SELECT COUNT(*)
+                FROM product_images p2
+                WHERE p2.product_id = product_images.product_id
+                AND (p2.created_at < product_images.created_at OR (p2.created_at = product_images.created_at AND p2.id <= product_images.id))
+            ) - 1
+        """))
+
+
+@migration(3, 'users.is_blocked')
+def _users_is_blocked(conn):
+    _add_column(conn, 'users', 'is_blocked', _boolean(conn, False))
+
+
+@migration(4, 'products.updated_at, categories.updated_at')
+def _updated_at(conn):
+    for table in ('products', 'categories'):
+        if _add_column(conn, table, 'updated_at', _datetime(conn)):
+            conn.execute(text(f"UPDATE {table} SET updated_at = COALESCE(created_at, CURRENT_TIMESTAMP)"))
+
+
+@migration(5, 'індекси для частих запитів, унікальний (user_id, product_id) у кошику')
+def _hot_path_indexes(conn):
+    # Перед унікальним індексом об'єднуємо дублікати рядків кошика (сумуємо кількість)
+    conn.execute(text("""
+        UPDATE cart_items
+        SET quantity = (
+            SELECT SUM(c2.quantity) FROM cart_items c2
+            WHERE c2.user_id = cart_items.user_id AND c2.product_id = cart_items.product_id
+        )
+        WHERE id IN (
+            SELECT MIN(id) FROM cart_items GROUP BY user_id, product_id HAVING COUNT(*) > 1
+        )
+    """))
+    conn.execute(text("""
+        DELETE FROM cart_items
+        WHERE id NOT IN (SELECT MIN(id) FROM cart_items GROUP BY user_id, product_id)
+    """))
+    # Назви збігаються з __table_args__ моделей, тому create_all() на новій базі
+    # створює ті самі індекси
+    statements = [
+        "CREATE UNIQUE INDEX IF NOT EXISTS uq_cart_items_user_product ON cart_items (user_id, product_id)",
+        "CREATE INDEX IF NOT EXISTS ix_orders_user_created ON orders (user_id, created_at)",
+        "CREATE INDEX IF NOT EXISTS ix_orders_status_created ON orders (status, created_at)",
+        "CREATE INDEX IF NOT EXISTS ix_order_items_order_id ON order_items (order_id)",
+        "CREATE INDEX IF NOT EXISTS ix_order_items_product_id ON order_items (product_id)",
+        "CREATE INDEX IF NOT EXISTS ix_product_images_product_order ON product_images (product_id, display_order)",
+        "CREATE INDEX IF NOT EXISTS ix_products_active_created ON products (is_active, created_at)",
+        "CREATE INDEX IF NOT EXISTS ix_products_active_name ON products (is_active, name)",
+    ]
+    for statement in statements:
+        conn.execute(text(statement))
+
+
+@migration(6, 'заповнення order_stats_daily та product_sales_daily')
+def _order_stats_rollup(conn):
+    # Таблиці створює db.create_all(); тут - дані для вже наявних замовлень
+    from order_stats import rebuild_order_stats
+    rebuild_order_stats(conn)
+
+
+@migration(7, 'індекс orders.created_at (експорт за період)')
+def _orders_created_index(conn):
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_orders_created_at ON orders (created_at)"))
+
+
+@migration(8, 'індекс users.created_at (список користувачів)')
+def _users_created_index(conn):
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_users_created_at ON users (created_at)"))
+
+
+@migration(9, 'product_images: похідні зображень (variants, width, height, placeholder)')
+def _product_image_variants(conn):
+    _add_column(conn, 'product_images', 'variants', 'JSON')
+    _add_column(conn, 'product_images', 'width', 'INTEGER')
+    _add_column(conn, 'product_images', 'height', 'INTEGER')
+    _add_column(conn, 'product_images', 'placeholder', 'TEXT')
+
+
+@migration(10, 'product_images.processing_state')
+def _product_image_processing_state(conn):
+    _add_column(conn, 'product_images', 'processing_state', "VARCHAR(20) DEFAULT 'ready' NOT NULL")
+
+
+@migration(11, 'індекси image_url (посилання на файли у сховищі завантажень)')
+def _image_url_indexes(conn):
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_product_images_image_url ON product_images (image_url)"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_products_image_url ON products (image_url)"))
+
+
+def _ensure_version_table(conn):
+    conn.execute(text(f"""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            description VARCHAR(200),
+            applied_at {_datetime(conn)}
+        )
+    """))
+
+
+def applied_versions(conn):
+    _ensure_version_table(conn)
+    return {row[0] for row in conn.execute(text("SELECT version FROM schema_migrations"))}
+
+
+class _MigrationLock:
+    """Блокування між воркерами Gunicorn, які одночасно запускають create_app()"""
+
+    def __enter__(self):
+        self.file = None
+        if fcntl is None:
+            return self
+        try:
+            os.makedirs(Config.SHARED_STATE_DIR, exist_ok=True)
+            self.file = open(os.path.join(Config.SHARED_STATE_DIR, 'migrations.lock'), 'a')
+            fcntl.flock(self.file, fcntl.LOCK_EX)
+        except OSError as e:
+            print(f"Не вдалося заблокувати міграції: {e}")
+        return self
+
+    def __exit__(self, *exc):
+        if self.file is not None:
+            self.file.close()
+
+
+def upgrade(engine):
+    """Застосовує всі ще не виконані міграції. Повертає список застосованих версій"""
+    applied = []
+    with _MigrationLock():
+        with engine.begin() as conn:
+            done = applied_versions(conn)
+        for version, description, fn in sorted(MIGRATIONS, key=lambda m: m[0]):
+            if version in done:
+                continue
+            print(f"Міграція {version}: {description}...")
+            # Кожна міграція та запис про неї - в одній транзакції
+            with engine.begin() as conn:
+                fn(conn)
+                conn.execute(
+                    text("INSERT INTO schema_migrations (version, description, applied_at) VALUES (:v, :d, :t)"),
+                    {'v': version, 'd': description, 't': datetime.utcnow()}
+                )
+            applied.append(version)
+    return applied
+
+
+def status(engine):
+    """Список (version, description, applied) для всіх міграцій"""
+    with engine.begin() as conn:
+        done = applied_versions(conn)
+    return [(version, description, version in done)
+            for version, description, _ in sorted(MIGRATIONS, key=lambda m: m[0])]
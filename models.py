@@ -5,6 +5,18 @@ from datetime import datetime
 
 db = SQLAlchemy()
 
+def _upsert_insert(model):
+    """insert() з підтримкою on_conflict_do_update для поточної СУБД або None"""
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+    elif dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        return None
+    return insert(model)
+
+
 class Category(db.Model):
     """Модель категорії"""
     __tablename__ = 'categories'
@@ -13,6 +25,7 @@ class Category(db.Model):
     name = db.Column(db.String(100), nullable=False, unique=True)
     parent_id = db.Column(db.Integer, db.ForeignKey('categories.id'), nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     # Зв'язки
     children = db.relationship('Category', backref=db.backref('parent', remote_side=[id]), lazy=True)
@@ -24,6 +37,11 @@ class Category(db.Model):
     @property
     def full_path(self):
         """Повний шлях категорії (батьківська категорія > категорія)"""
+        # Беремо готовий шлях з кешу дерева, щоб не завантажувати parent
+        from category_tree import get_category_tree
+        node = get_category_tree().get(self.id) if self.id else None
+        if node is not None and node.name == self.name:
+            return node.full_path
         if self.parent:
             return f"{self.parent.name} > {self.name}"
         return self.name
@@ -43,6 +61,11 @@ class User(UserMixin, db.Model):
     is_blocked = db.Column(db.Boolean, default=False, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
+    __table_args__ = (
+        # Список користувачів в адмін-панелі (нові першими)
+        db.Index('ix_users_created_at', 'created_at'),
+    )
+    
     # Зв'язки
     cart_items = db.relationship('CartItem', backref='user', lazy=True, cascade='all, delete-orphan')
     orders = db.relationship('Order', backref='user', lazy=True)
@@ -62,6 +85,12 @@ class User(UserMixin, db.Model):
 class Product(db.Model):
     """Модель товару"""
     __tablename__ = 'products'
+    __table_args__ = (
+        # Каталог: спочатку активні, далі за датою або назвою (keyset пагінація)
+        db.Index('ix_products_active_created', 'is_active', 'created_at'),
+        db.Index('ix_products_active_name', 'is_active', 'name'),
+        db.Index('ix_products_image_url', 'image_url'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(200), nullable=False)
@@ -70,6 +99,7 @@ class Product(db.Model):
     category_id = db.Column(db.Integer, db.ForeignKey('categories.id'), nullable=True)
     is_active = db.Column(db.Boolean, default=True, nullable=False)  # Чи активний товар
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     # Для зворотної сумісності (старе поле category)
     category = db.Column(db.String(100))
@@ -95,11 +125,26 @@ class Product(db.Model):
         # Для зворотної сумісності використовуємо image_url
         return self.image_url
     
+    @property
+    def category_path(self):
+        """Повний шлях категорії з кешу дерева (без завантаження category_obj)"""
+        if self.category_id:
+            from category_tree import get_category_tree
+            path = get_category_tree().full_path(self.category_id)
+            if path:
+                return path
+        return self.category
+    
     @property
     def additional_images(self):
         """Повертає додаткові зображення (без головного)"""
         return [img for img in self.images if not img.is_primary]
     
+    @property
+    def primary_image(self):
+        """ProductImage головного зображення (для srcset) або None"""
+        return next((img for img in self.images if img.is_primary), None) or (self.images[0] if self.images else None)
+    
     @property
     def image_urls(self):
         """Повертає всі URL зображень у правильному порядку"""
@@ -113,11 +158,22 @@ class Product(db.Model):
                 urls.insert(0, self.image_url)
         
         return urls
+    
+    @property
+    def image_records(self):
+        """ProductImage для кожного URL з image_urls (None - зображення без запису)"""
+        by_url = {img.image_url: img for img in self.images}
+        return [by_url.get(url) for url in self.image_urls]
 
 
 class ProductImage(db.Model):
     """Модель зображення товару"""
     __tablename__ = 'product_images'
+    __table_args__ = (
+        db.Index('ix_product_images_product_order', 'product_id', 'display_order'),
+        # Пошук посилань на файл (upload_storage.is_referenced)
+        db.Index('ix_product_images_image_url', 'image_url'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=False)
@@ -125,6 +181,24 @@ class ProductImage(db.Model):
     is_primary = db.Column(db.Boolean, default=False, nullable=False)  # Чи є головним зображенням
     display_order = db.Column(db.Integer, default=0, nullable=False)  # Порядок відображення
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Похідні для srcset (див. images.py): {формат: [[ширина, URL], ...]}
+    variants = db.Column(db.JSON)
+    width = db.Column(db.Integer)
+    height = db.Column(db.Integer)
+    placeholder = db.Column(db.Text)  # data URI розмитої мініатюри
+    # pending - чекає на обробку (image_queue.py), ready - оброблене, failed - помилка обробки
+    processing_state = db.Column(db.String(20), default='ready', nullable=False)
+    
+    @property
+    def is_processing(self):
+        return self.processing_state == 'pending'
+    
+    @property
+    def sources(self):
+        """[(MIME тип, srcset), ...] для <source> у <picture>, від найкращого формату"""
+        from images import FORMAT_ORDER, MIME_TYPES, srcset
+        variants = self.variants or {}
+        return [(MIME_TYPES[fmt], srcset(variants[fmt])) for fmt in FORMAT_ORDER if variants.get(fmt)]
     
     def __repr__(self):
         return f'<ProductImage {self.id}>'
@@ -133,6 +207,10 @@ class ProductImage(db.Model):
 class CartItem(db.Model):
     """Модель елемента кошика"""
     __tablename__ = 'cart_items'
+    __table_args__ = (
+        # Один рядок кошика на товар для кожного користувача
+        db.Index('uq_cart_items_user_product', 'user_id', 'product_id', unique=True),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
@@ -142,11 +220,68 @@ class CartItem(db.Model):
     
     def __repr__(self):
         return f'<CartItem {self.id}>'
+    
+    @staticmethod
+    def add_quantity(user_id, product_id, quantity):
+        """Атомарно додає кількість товару в кошик (INSERT ... ON CONFLICT DO UPDATE).
+        
+        Одна інструкція без попереднього SELECT, тому паралельні запити
+        (подвійний клік, кілька вкладок, різні воркери) не створюють
+        дублікатів і не втрачають збільшення.
+        """
+        stmt = _upsert_insert(CartItem)
+        if stmt is None:
+            # СУБД без upsert: звичайне читання та запис
+            cart_item = CartItem.query.filter_by(user_id=user_id, product_id=product_id).first()
+            if cart_item:
+                cart_item.quantity = CartItem.quantity + quantity
+            else:
+                db.session.add(CartItem(user_id=user_id, product_id=product_id, quantity=quantity))
+            db.session.flush()
+            return
+        stmt = stmt.values(user_id=user_id, product_id=product_id, quantity=quantity, created_at=datetime.utcnow())
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['user_id', 'product_id'],
+            set_={'quantity': CartItem.quantity + stmt.excluded.quantity}
+        )
+        db.session.execute(stmt)
+    
+    @staticmethod
+    def insert_or_keep_max(rows):
+        """Пакетна вставка рядків кошика; при конфлікті залишається більша кількість.
+        
+        rows - список словників user_id, product_id, quantity, created_at.
+        Рядок, який паралельний запит встиг вставити між читанням і вставкою,
+        не спричиняє IntegrityError.
+        """
+        stmt = _upsert_insert(CartItem)
+        if stmt is None:
+            db.session.execute(db.insert(CartItem), rows)
+            return
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['user_id', 'product_id'],
+            set_={'quantity': db.case(
+                (stmt.excluded.quantity > CartItem.quantity, stmt.excluded.quantity),
+                else_=CartItem.quantity
+            )}
+        )
+        db.session.execute(stmt, rows)
+    
+    @staticmethod
+    def count_for_user(user_id):
+        """Загальна кількість товарів у кошику (один SUM по індексу user_id)"""
+        total = db.session.query(db.func.sum(CartItem.quantity)).filter(CartItem.user_id == user_id).scalar()
+        return int(total or 0)
 
 
 class Order(db.Model):
     """Модель замовлення"""
     __tablename__ = 'orders'
+    __table_args__ = (
+        db.Index('ix_orders_user_created', 'user_id', 'created_at'),
+        db.Index('ix_orders_status_created', 'status', 'created_at'),
+        db.Index('ix_orders_created_at', 'created_at'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
@@ -166,6 +301,10 @@ class Order(db.Model):
 class OrderItem(db.Model):
     """Модель елемента замовлення"""
     __tablename__ = 'order_items'
+    __table_args__ = (
+        db.Index('ix_order_items_order_id', 'order_id'),
+        db.Index('ix_order_items_product_id', 'product_id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     order_id = db.Column(db.Integer, db.ForeignKey('orders.id'), nullable=False)
@@ -176,6 +315,125 @@ class OrderItem(db.Model):
         return f'<OrderItem {self.id}>'
 
 
+class OrderStatsDaily(db.Model):
+    """Денна статистика замовлень за статусами (підтримується інкрементально, див. order_stats.py)"""
+    __tablename__ = 'order_stats_daily'
+    
+    day = db.Column(db.Date, primary_key=True)
+    status = db.Column(db.String(50), primary_key=True)
+    orders = db.Column(db.Integer, default=0, nullable=False)
+    units = db.Column(db.Integer, default=0, nullable=False)  # Кількість товарів у цих замовленнях
+    
+    def __repr__(self):
+        return f'<OrderStatsDaily {self.day} {self.status}>'
+    
+    @staticmethod
+    def add(day, status, orders, units):
+        """Атомарно додає (або віднімає, з від'ємними значеннями) до рядка дня та статусу"""
+        stmt = _upsert_insert(OrderStatsDaily)
+        if stmt is None:
+            row = db.session.get(OrderStatsDaily, (day, status))
+            if row is None:
+                db.session.add(OrderStatsDaily(day=day, status=status, orders=orders, units=units))
+            else:
+                row.orders = OrderStatsDaily.orders + orders
+                row.units = OrderStatsDaily.units + units
+            db.session.flush()
+            return
+        stmt = stmt.values(day=day, status=status, orders=orders, units=units)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['day', 'status'],
+            set_={
+                'orders': OrderStatsDaily.orders + stmt.excluded.orders,
+                'units': OrderStatsDaily.units + stmt.excluded.units,
+            }
+        )
+        db.session.execute(stmt)
+
+
+class ProductSalesDaily(db.Model):
+    """Продано одиниць товару за день (усі замовлення, як і топ товарів)"""
+    __tablename__ = 'product_sales_daily'
+    
+    day = db.Column(db.Date, primary_key=True)
+    product_id = db.Column(db.Integer, primary_key=True)
+    units = db.Column(db.Integer, default=0, nullable=False)
+    
+    def __repr__(self):
+        return f'<ProductSalesDaily {self.day} {self.product_id}>'
+    
+    @staticmethod
+    def add_many(day, units_by_product):
+        """Атомарно додає продані одиниці {product_id: units} за день (один пакетний запит)"""
+        rows = [{'day': day, 'product_id': product_id, 'units': units}
+                for product_id, units in units_by_product.items()]
+        if not rows:
+            return
+        stmt = _upsert_insert(ProductSalesDaily)
+        if stmt is None:
+            for row in rows:
+                existing = db.session.get(ProductSalesDaily, (day, row['product_id']))
+                if existing is None:
+                    db.session.add(ProductSalesDaily(**row))
+                else:
+                    existing.units = ProductSalesDaily.units + row['units']
+            db.session.flush()
+            return
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['day', 'product_id'],
+            set_={'units': ProductSalesDaily.units + stmt.excluded.units}
+        )
+        db.session.execute(stmt, rows)
+
+
+class OutboxMessage(db.Model):
+    """Повідомлення, що очікує відправки (transactional outbox).
+    
+    Записується в тій самій транзакції, що й подія (наприклад, замовлення),
+    і відправляється фоновим диспетчером (див. notifications.py).
+    """
+    __tablename__ = 'outbox_messages'
+    __table_args__ = (
+        db.Index('ix_outbox_messages_status_next', 'status', 'next_attempt_at'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    channel = db.Column(db.String(50), default='telegram', nullable=False)
+    payload = db.Column(db.Text, nullable=False)
+    status = db.Column(db.String(20), default='pending', nullable=False)  # pending, sent, failed
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    next_attempt_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime)
+    
+    def __repr__(self):
+        return f'<OutboxMessage {self.id} {self.status}>'
+
+
+class IdempotencyKey(db.Model):
+    """Збережена відповідь на POST запит з Idempotency-Key (див. idempotency.py)"""
+    __tablename__ = 'idempotency_keys'
+    __table_args__ = (
+        db.Index('uq_idempotency_keys_user_key', 'user_id', 'key', unique=True),
+        db.Index('ix_idempotency_keys_expires_at', 'expires_at'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    key = db.Column(db.String(255), nullable=False)
+    request_hash = db.Column(db.String(64), nullable=False)
+    status_code = db.Column(db.Integer)  # None - запит ще обробляється
+    response_body = db.Column(db.LargeBinary)
+    content_type = db.Column(db.String(100))
+    location = db.Column(db.String(500))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False)
+    
+    def __repr__(self):
+        return f'<IdempotencyKey {self.user_id}:{self.key}>'
+
+
 class Settings(db.Model):
     """Модель налаштувань системи"""
     __tablename__ = 'settings'
@@ -0,0 +1,276 @@
+"""Черга повідомлень (transactional outbox) та фоновий диспетчер Telegram.
+
+enqueue_telegram() лише додає запис OutboxMessage до поточної сесії: він
+зберігається тим самим commit, що й замовлення, або зникає разом з ним
+при rollback. HTTP запит до Telegram виконує диспетчер поза запитом
+користувача - з повторами та експоненційною затримкою, не частіше за
+Config.TELEGRAM_MIN_INTERVAL, а під час сплеску замовлень об'єднує
+повідомлення в дайджест.
+
+Одночасно працює лише один диспетчер (flock у Config.SHARED_STATE_DIR):
+потік в одному з воркерів Gunicorn (Config.OUTBOX_DISPATCHER_IN_APP) або
+окремий процес `flask outbox-dispatch`. Якщо воркер-диспетчер
+перезапускається, блокування підхоплює інший.
+
+Доставка "щонайменше один раз": якщо процес завершиться між відправкою
+та записом статусу, повідомлення буде надіслано повторно.
+
+Через ту саму чергу диспетчер видаляє файли завантажень після commit
+(канал 'delete_file', див. upload_storage.py) та виконує періодичне
+прибирання (add_maintenance_task).
+"""
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from config import Config
+
+try:
+    import fcntl
+except ImportError:  # Windows: один процес, блокування не потрібне
+    fcntl = None
+
+CHANNEL_TELEGRAM = 'telegram'
+
+# Максимальна довжина повідомлення Telegram
+MESSAGE_LIMIT = 4096
+DIGEST_SEPARATOR = '\n\n──────────\n\n'
+
+_wakeup = threading.Event()
+_thread = None
+_thread_pid = None
+_thread_start_lock = threading.Lock()
+_last_sent_at = 0.0
+
+
+def enqueue_telegram(text):
+    """Ставить повідомлення в чергу (збережеться разом з поточною транзакцією)"""
+    from models import db, OutboxMessage
+    db.session.add(OutboxMessage(channel=CHANNEL_TELEGRAM, payload=text))
+
+
+def notify_dispatcher():
+    """Будить диспетчер, якщо він працює в цьому процесі (викликати після commit)"""
+    _wakeup.set()
+
+
+def _truncate(text, limit=MESSAGE_LIMIT):
+    """Обрізає текст по межі рядка (HTML теги в повідомленнях не переносяться між рядками)"""
+    if len(text) <= limit:
+        return text
+    cut = text.rfind('\n', 0, limit - 2)
+    if cut <= 0:
+        cut = limit - 2
+    return text[:cut] + '\n…'
+
+
+def _digest_groups(messages):
+    """Розбиває повідомлення на групи, кожна з яких вміщується в одне повідомлення Telegram"""
+    if len(messages) <= Config.TELEGRAM_DIGEST_THRESHOLD:
+        return [[message] for message in messages]
+    groups = []
+    current, length = [], 0
+    for message in messages:
+        size = len(message.payload) + len(DIGEST_SEPARATOR)
+        if current and length + size > MESSAGE_LIMIT - 100:
+            groups.append(current)
+            current, length = [], 0
+        current.append(message)
+        length += size
+    if current:
+        groups.append(current)
+    return groups
+
+
+def _group_text(group):
+    if len(group) == 1:
+        return _truncate(group[0].payload)
+    header = f"📬 <b>Дайджест: {len(group)} повідомлень</b>"
+    return _truncate(DIGEST_SEPARATOR.join([header] + [message.payload for message in group]))
+
+
+def _retry_after(error):
+    """Затримка з відповіді 429 Telegram (parameters.retry_after), якщо є"""
+    response = getattr(error, 'response', None)
+    if response is None or response.status_code != 429:
+        return None
+    try:
+        return int(response.json()['parameters']['retry_after'])
+    except (ValueError, KeyError, TypeError):
+        return None
+
+
+def _throttle():
+    """Витримує Config.TELEGRAM_MIN_INTERVAL між відправками"""
+    global _last_sent_at
+    wait = _last_sent_at + Config.TELEGRAM_MIN_INTERVAL - time.monotonic()
+    if wait > 0:
+        time.sleep(wait)
+    _last_sent_at = time.monotonic()
+
+
+def _schedule_retry(group, error, now):
+    retry_after = _retry_after(error)
+    for message in group:
+        message.attempts += 1
+        message.last_error = str(error)[:1000]
+        if message.attempts >= Config.OUTBOX_MAX_ATTEMPTS:
+            message.status = 'failed'
+            print(f"Повідомлення #{message.id} не відправлено після {message.attempts} спроб: {error}")
+            continue
+        delay = retry_after or min(
+            Config.OUTBOX_RETRY_BASE_DELAY * 2 ** (message.attempts - 1),
+            Config.OUTBOX_RETRY_MAX_DELAY
+        )
+        message.next_attempt_at = now + timedelta(seconds=delay)
+
+
+def dispatch_once():
+    """Один прохід по черзі: відправляє повідомлення, час яких настав.
+
+    Повертає кількість відправлених (або пропущених) повідомлень; якщо вона
+    дорівнює Config.OUTBOX_BATCH_SIZE, у черзі можуть бути ще. Викликається
+    в контексті додатку.
+    """
+    from models import db, OutboxMessage
+    from utils import get_telegram_settings, send_telegram_message
+
+    now = datetime.utcnow()
+    due = OutboxMessage.query.filter(
+        OutboxMessage.channel == CHANNEL_TELEGRAM,
+        OutboxMessage.status == 'pending',
+        OutboxMessage.next_attempt_at <= now
+    ).order_by(OutboxMessage.id).limit(Config.OUTBOX_BATCH_SIZE).all()
+    if not due:
+        return 0
+
+    enabled, bot_token, chat_id = get_telegram_settings()
+    if not enabled or not bot_token or not chat_id:
+        # Як і раніше: при вимкненому Telegram повідомлення не відправляються
+        for message in due:
+            message.status = 'skipped'
+        db.session.commit()
+        return len(due)
+
+    processed = 0
+    for group in _digest_groups(due):
+        _throttle()
+        try:
+            send_telegram_message(_group_text(group), raise_errors=True)
+        except Exception as e:
+            _schedule_retry(group, e, datetime.utcnow())
+            db.session.commit()
+            # Telegram недоступний - решта черги чекає наступного проходу
+            return processed
+        sent_at = datetime.utcnow()
+        for message in group:
+            message.status = 'sent'
+            message.sent_at = sent_at
+            message.attempts += 1
+        db.session.commit()
+        processed += len(group)
+    return processed
+
+
+def cleanup_outbox():
+    """Видаляє відправлені та пропущені повідомлення, старші за Config.OUTBOX_RETENTION_DAYS"""
+    from models import db, OutboxMessage
+    cutoff = datetime.utcnow() - timedelta(days=Config.OUTBOX_RETENTION_DAYS)
+    deleted = OutboxMessage.query.filter(
+        OutboxMessage.status.in_(('sent', 'skipped')),
+        OutboxMessage.created_at < cutoff
+    ).delete(synchronize_session=False)
+    db.session.commit()
+    return deleted
+
+
+# Як часто диспетчер викликає завдання прибирання (секунди)
+MAINTENANCE_INTERVAL = 3600
+
+# Періодичне прибирання, яке виконує диспетчер
+_maintenance_tasks = [cleanup_outbox]
+
+
+def add_maintenance_task(task):
+    """Додає функцію, яку диспетчер викликатиме в контексті додатку.
+
+    Диспетчер викликає завдання не частіше ніж раз на MAINTENANCE_INTERVAL.
+    Завдання, якому потрібен рідший розклад, перевіряє його саме (наприклад,
+    upload_storage.cleanup_orphaned_uploads - раз на Config.UPLOAD_GC_INTERVAL).
+    """
+    if task not in _maintenance_tasks:
+        _maintenance_tasks.append(task)
+
+
+def try_lock(name='outbox.lock'):
+    """Файл з утриманим flock name у Config.SHARED_STATE_DIR або None, якщо його тримає інший процес"""
+    if fcntl is None:
+        return True
+    try:
+        os.makedirs(Config.SHARED_STATE_DIR, exist_ok=True)
+        lock_file = open(os.path.join(Config.SHARED_STATE_DIR, name), 'a')
+    except OSError as e:
+        print(f"Не вдалося відкрити блокування {name}: {e}")
+        return None
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return lock_file
+    except OSError:
+        lock_file.close()
+        return None
+
+
+def run_dispatcher(app, stop_event=None, once=False):
+    """Цикл диспетчера. Поки блокування тримає інший процес - лише чекає на нього"""
+    from models import db
+    from upload_storage import delete_files_once
+
+    stop_event = stop_event or threading.Event()
+    lock = None
+    last_cleanup = 0.0
+    while not stop_event.is_set():
+        if lock is None:
+            lock = try_lock()
+        if lock is not None:
+            with app.app_context():
+                try:
+                    while not stop_event.is_set():
+                        processed = (dispatch_once(), delete_files_once())
+                        if Config.OUTBOX_BATCH_SIZE not in processed:
+                            break
+                    if time.monotonic() - last_cleanup > MAINTENANCE_INTERVAL:
+                        for task in _maintenance_tasks:
+                            task()
+                        last_cleanup = time.monotonic()
+                except Exception as e:
+                    db.session.rollback()
+                    print(f"Помилка диспетчера повідомлень: {e}")
+        if once:
+            break
+        _wakeup.wait(Config.OUTBOX_POLL_INTERVAL)
+        _wakeup.clear()
+    if lock not in (None, True):
+        lock.close()
+
+
+def _ensure_dispatcher_thread(app):
+    """Запускає потік диспетчера в поточному процесі (один раз, також після fork)"""
+    global _thread, _thread_pid
+    if _thread_pid == os.getpid() and _thread is not None and _thread.is_alive():
+        return
+    with _thread_start_lock:
+        if _thread_pid == os.getpid() and _thread is not None and _thread.is_alive():
+            return
+        _thread = threading.Thread(target=run_dispatcher, args=(app,), name='outbox-dispatcher', daemon=True)
+        _thread.start()
+        _thread_pid = os.getpid()
+
+
+def init_notifications(app):
+    """Запускає диспетчер у воркері при першому запиті (не в CLI командах)"""
+    if not app.config.get('OUTBOX_DISPATCHER_IN_APP'):
+        return
+
+    @app.before_request
+    def start_outbox_dispatcher():
+        _ensure_dispatcher_thread(app)
@@ -0,0 +1,123 @@
+"""Потоковий експорт замовлень (CSV / NDJSON) для бухгалтерії.
+
+Рядок експорту - елемент замовлення разом з даними замовлення,
+користувача, товару та повним шляхом категорії. Дані читаються порціями
+за ключем (created_at, id) замовлення: кожна порція - два короткі
+запити, тому пам'ять не залежить від розміру експорту, а транзакція
+читання не тримається весь час експорту.
+
+Використання: /admin/orders/export (адмін-панель) або
+`flask export-orders` (для дуже великих вивантажень: HTTP відповідь
+синхронного воркера Gunicorn обмежена його timeout).
+"""
+import csv
+import io
+import json
+from datetime import datetime, timedelta
+from sqlalchemy import literal, tuple_
+
+FORMATS = ('csv', 'ndjson')
+CHUNK_SIZE = 500
+
+COLUMNS = [
+    'order_id', 'created_at', 'status', 'username', 'email', 'city', 'institution',
+    'item_id', 'product_id', 'product_name', 'category_path', 'quantity',
+]
+
+
+def parse_date_range(date_from, date_to):
+    """Рядки 'YYYY-MM-DD' -> (початок, кінець) для created_at; date_to включно.
+
+    Порожні значення - без обмеження. Некоректна дата - ValueError.
+    """
+    start = datetime.strptime(date_from, '%Y-%m-%d') if date_from else None
+    end = datetime.strptime(date_to, '%Y-%m-%d') + timedelta(days=1) if date_to else None
+    return start, end
+
+
+def iter_export_rows(start=None, end=None, chunk_size=CHUNK_SIZE):
+    """Генератор рядків експорту (кортежі в порядку COLUMNS, None - немає значення)"""
+    from models import db, Order, OrderItem, Product, User
+    from category_tree import get_category_tree
+
+    tree = get_category_tree()
+    last_key = None
+    while True:
+        query = db.session.query(
+            Order.id, Order.created_at, Order.status, User.username, User.email, Order.city, Order.institution
+        ).outerjoin(User, User.id == Order.user_id).filter(Order.created_at.isnot(None))
+        if start is not None:
+            query = query.filter(Order.created_at >= start)
+        if end is not None:
+            query = query.filter(Order.created_at < end)
+        if last_key is not None:
+            query = query.filter(tuple_(Order.created_at, Order.id) > tuple_(
+                literal(last_key[0], type_=Order.created_at.type), literal(last_key[1], type_=Order.id.type)
+            ))
+        orders = query.order_by(Order.created_at, Order.id).limit(chunk_size).all()
+        if not orders:
+            break
+
+        items = {}
+        for item in db.session.query(
+            OrderItem.order_id, OrderItem.id, OrderItem.product_id, Product.name,
+            Product.category_id, Product.category, OrderItem.quantity
+        ).outerjoin(Product, Product.id == OrderItem.product_id).filter(
+            OrderItem.order_id.in_([order.id for order in orders])
+        ).order_by(OrderItem.order_id, OrderItem.id):
+            items.setdefault(item.order_id, []).append(item)
+
+        # Завершуємо транзакцію читання між порціями
+        db.session.rollback()
+
+        for order in orders:
+            order_part = (
+                order.id, order.created_at.isoformat(sep=' '),
+                order.status, order.username, order.email, order.city, order.institution,
+            )
+            order_items = items.get(order.id)
+            if not order_items:
+                yield order_part + (None, None, None, None, None)
+                continue
+            for item in order_items:
+                category_path = tree.full_path(item.category_id) or item.category
+                yield order_part + (item.id, item.product_id, item.name, category_path, item.quantity)
+
+        last_key = (orders[-1].created_at, orders[-1].id)
+        if len(orders) < chunk_size:
+            break
+
+
+def iter_csv(rows, chunk_rows=CHUNK_SIZE):
+    """CSV частинами по chunk_rows рядків (з BOM, щоб Excel коректно відкривав кирилицю)"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    buffer.write('\ufeff')
+    writer.writerow(COLUMNS)
+    count = 0
+    for row in rows:
+        writer.writerow(row)
+        count += 1
+        if count % chunk_rows == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def iter_ndjson(rows, chunk_rows=CHUNK_SIZE):
+    """NDJSON (один JSON об'єкт на рядок) частинами по chunk_rows рядків"""
+    lines = []
+    for row in rows:
+        lines.append(json.dumps(dict(zip(COLUMNS, row)), ensure_ascii=False))
+        if len(lines) >= chunk_rows:
+            yield '\n'.join(lines) + '\n'
+            lines = []
+    if lines:
+        yield '\n'.join(lines) + '\n'
+
+
+def iter_export(fmt, start=None, end=None):
+    """Частини тексту експорту у форматі fmt ('csv' або 'ndjson')"""
+    rows = iter_export_rows(start, end)
+    return iter_ndjson(rows) if fmt == 'ndjson' else iter_csv(rows)
@@ -0,0 +1,122 @@
+"""Денна статистика замовлень (rollup таблиці order_stats_daily та product_sales_daily).
+
+Таблиці оновлюються інкрементально в тій самій транзакції, що й
+замовлення: record_new_order() при оформленні, change_order_status() при
+зміні статусу. Тому статистика для dashboard та звітів читається за
+O(днів), незалежно від загальної кількості замовлень.
+
+Якщо дані розійшлися (ручні зміни в БД, старі замовлення) - повна
+перебудова: `flask rebuild-order-stats` (також виконується міграцією 6).
+"""
+from datetime import datetime
+from sqlalchemy import delete, func, insert, select, update
+
+
+def record_new_order(created_at, status, lines):
+    """Враховує нове замовлення; lines - список (product_id, quantity)"""
+    from models import OrderStatsDaily, ProductSalesDaily
+
+    day = created_at.date()
+    units_by_product = {}
+    for product_id, quantity in lines:
+        units_by_product[product_id] = units_by_product.get(product_id, 0) + quantity
+    OrderStatsDaily.add(day, status, 1, sum(units_by_product.values()))
+    ProductSalesDaily.add_many(day, units_by_product)
+
+
+def change_order_status(order, new_status, expected_status=None):
+    """Змінює статус замовлення та переносить його в статистиці.
+
+    Умовний UPDATE ... WHERE status = <старий статус>: якщо статус
+    паралельно змінив інший запит, нічого не змінюється і повертається
+    False, тому статистика не рахує замовлення двічі. Commit - за
+    викликаючим кодом.
+    """
+    from models import db, Order, OrderItem, OrderStatsDaily
+
+    old_status = expected_status or order.status
+    if old_status == new_status:
+        return False
+    result = db.session.execute(
+        update(Order)
+        .where(Order.id == order.id, Order.status == old_status)
+        .values(status=new_status, updated_at=datetime.utcnow())
+    )
+    if result.rowcount != 1:
+        return False
+
+    units = db.session.query(func.coalesce(func.sum(OrderItem.quantity), 0)).filter(
+        OrderItem.order_id == order.id
+    ).scalar()
+    day = order.created_at.date()
+    OrderStatsDaily.add(day, old_status, -1, -units)
+    OrderStatsDaily.add(day, new_status, 1, units)
+    return True
+
+
+def rebuild_order_stats(conn):
+    """Перераховує таблиці статистики з orders та order_items (conn - відкрита транзакція)"""
+    from models import Order, OrderItem, OrderStatsDaily, ProductSalesDaily
+
+    day = func.date(Order.created_at)
+    order_units = select(
+        OrderItem.order_id, func.sum(OrderItem.quantity).label('units')
+    ).group_by(OrderItem.order_id).subquery()
+
+    conn.execute(delete(OrderStatsDaily))
+    conn.execute(delete(ProductSalesDaily))
+    conn.execute(insert(OrderStatsDaily).from_select(
+        ['day', 'status', 'orders', 'units'],
+        select(day, Order.status, func.count(Order.id), func.coalesce(func.sum(order_units.c.units), 0))
+        .outerjoin(order_units, order_units.c.order_id == Order.id)
+        .where(Order.created_at.isnot(None))
+        .group_by(day, Order.status)
+    ))
+    conn.execute(insert(ProductSalesDaily).from_select(
+        ['day', 'product_id', 'units'],
+        select(day, OrderItem.product_id, func.sum(OrderItem.quantity))
+        .join(Order, Order.id == OrderItem.order_id)
+        .where(Order.created_at.isnot(None))
+        .group_by(day, OrderItem.product_id)
+    ))
+
+
+def status_counts():
+    """{статус: кількість замовлень} за весь час"""
+    from models import db, OrderStatsDaily
+    rows = db.session.query(OrderStatsDaily.status, func.sum(OrderStatsDaily.orders)).group_by(
+        OrderStatsDaily.status
+    ).all()
+    return {status: int(count or 0) for status, count in rows}
+
+
+def orders_by_day(since):
+    """Пари (день, замовлень) від дати since"""
+    from models import db, OrderStatsDaily
+    return db.session.query(OrderStatsDaily.day, func.sum(OrderStatsDaily.orders)).filter(
+        OrderStatsDaily.day >= since
+    ).group_by(OrderStatsDaily.day).all()
+
+
+def units_by_day(since, exclude_status=None):
+    """Пари (день, продано одиниць) від дати since"""
+    from models import db, OrderStatsDaily
+    query = db.session.query(OrderStatsDaily.day, func.sum(OrderStatsDaily.units)).filter(
+        OrderStatsDaily.day >= since
+    )
+    if exclude_status:
+        query = query.filter(OrderStatsDaily.status != exclude_status)
+    return query.group_by(OrderStatsDaily.day).all()
+
+
+def top_products(limit=5, since=None):
+    """Список (назва товару, продано одиниць) за спаданням"""
+    from models import db, Product, ProductSalesDaily
+    total = func.sum(ProductSalesDaily.units)
+    query = db.session.query(Product.name, total.label('total_sold')).join(
+        Product, Product.id == ProductSalesDaily.product_id
+    )
+    if since is not None:
+        query = query.filter(ProductSalesDaily.day >= since)
+    rows = query.group_by(Product.id, Product.name).order_by(total.desc()).limit(limit).all()
+    return [(name, int(total_sold or 0)) for name, total_sold in rows]
@@ -0,0 +1,175 @@
+"""Keyset (cursor) пагінація.
+
+Замість OFFSET наступна сторінка вибирається умовою "після останнього
+рядка попередньої сторінки" за ключами сортування (порівняння кортежів,
+яке використовує індекс), тому вартість сторінки не залежить від її
+номера, і COUNT(*) не потрібен.
+"""
+import base64
+import json
+from datetime import datetime
+from decimal import Decimal
+from sqlalchemy import and_, literal, tuple_
+
+
+class KeysetPage:
+    """Сторінка результатів з курсорами на попередню та наступну сторінки"""
+
+    def __init__(self, items, per_page, next_cursor=None, prev_cursor=None):
+        self.items = items
+        self.per_page = per_page
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+
+def _encode_value(value):
+    if isinstance(value, datetime):
+        return {'dt': value.isoformat()}
+    return value
+
+
+def _decode_value(value):
+    if isinstance(value, dict):
+        return datetime.fromisoformat(value['dt'])
+    if isinstance(value, (str, int, float, bool)):
+        return value
+    raise ValueError('Недопустиме значення курсора')
+
+
+def _matches_type(value, expr):
+    """Чи підходить значення курсора до типу колонки ключа (курсор міг прийти з іншого сортування)"""
+    try:
+        python_type = expr.type.python_type
+    except NotImplementedError:
+        return True
+    if python_type is bool:
+        return isinstance(value, bool)
+    if isinstance(value, bool):
+        return False
+    if python_type in (float, Decimal):
+        return isinstance(value, (int, float))
+    return isinstance(value, python_type)
+
+
+def encode_cursor(direction, values):
+    payload = json.dumps([direction, [_encode_value(v) for v in values]], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, keys):
+    """Повертає (direction, values) або (None, None) для пустого/некоректного курсора.
+
+    Курсор некоректний і тоді, коли кількість або типи значень не
+    відповідають keys (наприклад, курсор з іншого сортування) - тоді
+    показується перша сторінка.
+    """
+    if not cursor:
+        return None, None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        direction, values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if direction not in ('next', 'prev') or len(values) != len(keys):
+            return None, None
+        values = [_decode_value(v) for v in values]
+    except (ValueError, TypeError, KeyError):
+        return None, None
+    if not all(_matches_type(value, expr) for value, (expr, _) in zip(values, keys)):
+        return None, None
+    return direction, values
+
+
+def _runs(keys):
+    """Індекси keys, згруповані в послідовні групи з однаковим напрямком сортування"""
+    runs = []
+    for i, (_, descending) in enumerate(keys):
+        if runs and keys[runs[-1][0]][1] == descending:
+            runs[-1].append(i)
+        else:
+            runs.append([i])
+    return runs
+
+
+def _seek_conditions(keys, values, backwards):
+    """Умови "рядок іде після values" у порядку keys - від найближчого сегмента до найдальшого.
+
+    Кожна умова - рівність ключів попередніх груп плюс порівняння кортежів
+    (row value) для групи ключів з однаковим напрямком, тобто один діапазон
+    індексу. Разом вони дорівнюють лексикографічному порівнянню всіх ключів,
+    але виконуються окремими запитами: розгорнуту через OR умову SQLite не
+    може використати для пошуку в індексі і сканує його з початку.
+    """
+    # literal() потрібен для True/False: SQLAlchemy не дозволяє "< True" напряму
+    bound = [literal(value, type_=expr.type) for (expr, _), value in zip(keys, values)]
+    conditions = []
+    for run in _runs(keys):
+        if len(run) == 1:
+            exprs, bounds = keys[run[0]][0], bound[run[0]]
+        else:
+            exprs, bounds = tuple_(*[keys[i][0] for i in run]), tuple_(*[bound[i] for i in run])
+        compare = exprs < bounds if keys[run[0]][1] != backwards else exprs > bounds
+        equal = [keys[i][0] == bound[i] for i in range(run[0])]
+        conditions.append(and_(*equal, compare))
+    conditions.reverse()
+    return conditions
+
+
+def keyset_paginate(query, keys, cursor=None, per_page=25):
+    """Пагінація запиту за ключами сортування.
+
+    keys - список (вираз, descending). Останній ключ має бути унікальним
+    (зазвичай id), щоб порядок був однозначним. Запит не повинен мати
+    власного order_by. Сторінка з курсором - по одному запиту на групу
+    ключів з однаковим напрямком (зазвичай один-два), кожен з яких шукає
+    в індексі, тому вартість не залежить від глибини курсора.
+    """
+    direction, values = decode_cursor(cursor, keys)
+    backwards = direction == 'prev'
+
+    order = []
+    for expr, descending in keys:
+        order.append(expr.desc() if descending != backwards else expr.asc())
+
+    labeled = [expr.label(f'_keyset_{i}') for i, (expr, _) in enumerate(keys)]
+    ordered = query.add_columns(*labeled).order_by(*order)
+    limit = per_page + 1
+
+    if values is None:
+        rows = ordered.limit(limit).all()
+    else:
+        # Спочатку продовжуємо поточний сегмент (наприклад, активні товари),
+        # наступний сегмент читаємо лише якщо сторінка ще не заповнена
+        rows = []
+        for condition in _seek_conditions(keys, values, backwards):
+            rows += ordered.filter(condition).limit(limit - len(rows)).all()
+            if len(rows) >= limit:
+                break
+
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    if backwards:
+        rows.reverse()
+
+    if not rows:
+        return KeysetPage([], per_page)
+
+    if backwards:
+        has_prev, has_next = has_more, True
+    else:
+        has_prev, has_next = values is not None, has_more
+
+    first_keys = list(rows[0][1:])
+    last_keys = list(rows[-1][1:])
+    return KeysetPage(
+        [row[0] for row in rows],
+        per_page,
+        next_cursor=encode_cursor('next', last_keys) if has_next else None,
+        prev_cursor=encode_cursor('prev', first_keys) if has_prev else None,
+    )
@@ -0,0 +1,83 @@
+"""Кеш статистики та звітів адмін-панелі, спільний для всіх воркерів.
+
+Значення зберігаються в shared_cache (Config.SHARED_STATE_DIR, тобто
+/dev/shm, як і worker_tmp_dir Gunicorn) з TTL. При промаху перераховує
+лише один воркер, решта чекає на його результат (get_or_set).
+
+Ключі містять версію 'orders'. Вона змінюється після commit, який змінив
+замовлення, їх елементи або денну статистику, тож адміністратори одразу
+бачать нові замовлення. Також ключ містить версію каталогу (назви товарів
+у топі) та поточну дату (графіки по днях).
+"""
+from datetime import datetime
+from flask import g, has_request_context
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+import shared_cache
+from cache_versions import get_version, bump_version
+from catalog_cache import catalog_version
+from config import Config
+
+VERSION_NAME = 'orders'
+NAMESPACE = 'reports'
+
+_ORDER_TABLES = {'orders', 'order_items', 'order_stats_daily', 'product_sales_daily'}
+
+
+def reports_version():
+    """Поточна версія даних замовлень (читається один раз за запит)"""
+    if not has_request_context():
+        return get_version(VERSION_NAME)
+    if 'reports_version' not in g:
+        g.reports_version = get_version(VERSION_NAME)
+    return g.reports_version
+
+
+def invalidate_reports():
+    """Робить застарілими всі закешовані звіти в усіх воркерах"""
+    version = bump_version(VERSION_NAME)
+    if has_request_context():
+        g.reports_version = version
+    shared_cache.clear(NAMESPACE)
+
+
+def _touches_orders(objects):
+    return any(getattr(obj, '__tablename__', None) in _ORDER_TABLES for obj in objects)
+
+
+def _track_flush(session, flush_context, instances):
+    if _touches_orders(session.new) or _touches_orders(session.dirty) or _touches_orders(session.deleted):
+        session.info['orders_changed'] = True
+
+
+def _track_bulk(orm_execute_state):
+    # Пакетні insert()/update()/delete() (checkout, зміна статусу) не проходять через flush
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        mapper = orm_execute_state.bind_mapper
+        if mapper is not None and mapper.local_table.name in _ORDER_TABLES:
+            orm_execute_state.session.info['orders_changed'] = True
+
+
+def _after_commit(session):
+    if session.info.pop('orders_changed', False):
+        invalidate_reports()
+
+
+def _after_rollback(session):
+    session.info.pop('orders_changed', None)
+
+
+def init_report_cache(app):
+    """Підключає відстеження змін замовлень"""
+    if not event.contains(Session, 'before_flush', _track_flush):
+        event.listen(Session, 'before_flush', _track_flush)
+        event.listen(Session, 'do_orm_execute', _track_bulk)
+        event.listen(Session, 'after_commit', _after_commit)
+        event.listen(Session, 'after_rollback', _after_rollback)
+
+
+def cached_report(name, creator, ttl=None):
+    """Значення звіту name з кешу або creator() (обчислює лише один воркер)"""
+    today = datetime.utcnow().strftime('%Y-%m-%d')
+    key = f'{reports_version()}:{catalog_version()}:{today}:{name}'
+    return shared_cache.get_or_set(NAMESPACE, key, creator, ttl=ttl or Config.REPORT_CACHE_TTL)
@@ -1,11 +1,22 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, request
+from flask import Blueprint, render_template, redirect, url_for, flash, request, Response, stream_with_context
 from flask_login import login_required
 from flask_wtf.csrf import validate_csrf
 from werkzeug.exceptions import BadRequest
 from models import db, Product, Order, OrderItem, User, Category, ProductImage, Settings
 from forms import ProductForm, OrderStatusForm, CategoryForm, TelegramSettingsForm
-from utils import admin_required, save_uploaded_file, delete_file
-from sqlalchemy import func
+from utils import admin_required, save_uploaded_file
+from images import ImageRejected, local_path
+from upload_storage import UploadTooLarge, enqueue_file_deletions
+from image_queue import STATE_PENDING, notify_image_worker, reuse_processed
+from search import apply_search, apply_user_search
+from pagination import keyset_paginate
+from category_tree import get_category_tree, invalidate_category_tree
+import order_stats
+import order_export
+import bulk_products
+from report_cache import cached_report
+from sqlalchemy import func, select
+from sqlalchemy.orm import joinedload, selectinload
 from datetime import datetime, timedelta
 from flask_login import current_user
 import re
@@ -17,81 +28,77 @@ admin_bp = Blueprint('admin', __name__, url_prefix='/admin')
 @admin_required
 def dashboard():
     """Головна сторінка адмін-панелі зі статистикою"""
-    total_products = Product.query.count()
-    total_orders = Order.query.count()
-    pending_orders = Order.query.filter_by(status='pending').count()
-    processing_orders = Order.query.filter_by(status='processing').count()
-    completed_orders = Order.query.filter_by(status='completed').count()
-    total_users = User.query.count()
-    
-    # Статистика замовлень за останні 7 днів
-    seven_days_ago = datetime.utcnow() - timedelta(days=7)
-    recent_orders = Order.query.filter(
-        Order.created_at >= seven_days_ago
-    ).count()
-    
-    # Останні замовлення
-    latest_orders = Order.query.order_by(Order.created_at.desc()).limit(5).all()
+    # Спільний для воркерів кеш: перераховується після змін замовлень або TTL
+    stats = cached_report('dashboard', _dashboard_stats)
+    
+    # Останні замовлення (користувачі - в тому ж запиті)
+    latest_orders = Order.query.options(joinedload(Order.user)).order_by(Order.created_at.desc()).limit(5).all()
     
     # Останні товари
     latest_products = Product.query.order_by(Product.created_at.desc()).limit(5).all()
     
-    # Топ товарів за кількістю продажів
-    top_products = db.session.query(
-        Product.name,
-        func.sum(OrderItem.quantity).label('total_sold')
-    ).join(OrderItem).group_by(Product.id).order_by(func.sum(OrderItem.quantity).desc()).limit(5).all()
+    return render_template('admin/dashboard.html',
+                         latest_orders=latest_orders,
+                         latest_products=latest_products,
+                         **stats)
+
+
+def _day_series(rows, days, now, field):
+    """Значення за останні days днів (включно з сьогодні); дні без даних заповнюються нулями.
     
-    # Статистика по статусах
-    cancelled_orders = Order.query.filter_by(status='cancelled').count()
-    
-    # Статистика замовлень за останні 30 днів (для графіку)
-    orders_by_day = []
-    for i in range(30, -1, -1):
-        date = datetime.utcnow() - timedelta(days=i)
-        date_start = date.replace(hour=0, minute=0, second=0, microsecond=0)
-        date_end = date.replace(hour=23, minute=59, second=59, microsecond=999999)
-        count = Order.query.filter(
-            Order.created_at >= date_start,
-            Order.created_at <= date_end
-        ).count()
-        orders_by_day.append({
+    rows - пари (дата, значення) з GROUP BY date(created_at).
+    """
+    values = {str(day)[:10]: int(value or 0) for day, value in rows}
+    series = []
+    for i in range(days - 1, -1, -1):
+        date = now - timedelta(days=i)
+        series.append({
             'date': date.strftime('%d.%m'),
-            'count': count
+            field: values.get(date.strftime('%Y-%m-%d'), 0)
         })
+    return series
+
+
+def _dashboard_stats():
+    """Агрегована статистика для dashboard.
     
-    # Статистика продажів за останні 7 днів
-    sales_by_day = []
-    for i in range(6, -1, -1):
-        date = datetime.utcnow() - timedelta(days=i)
-        date_start = date.replace(hour=0, minute=0, second=0, microsecond=0)
-        date_end = date.replace(hour=23, minute=59, second=59, microsecond=999999)
-        total_quantity = db.session.query(
-            func.sum(OrderItem.quantity)
-        ).join(Order).filter(
-            Order.created_at >= date_start,
-            Order.created_at <= date_end,
-            Order.status != 'cancelled'
-        ).scalar() or 0
-        sales_by_day.append({
-            'date': date.strftime('%d.%m'),
-            'quantity': int(total_quantity)
-        })
+    Замовлення та продажі читаються з денної статистики (order_stats.py):
+    кілька запитів по O(днів) рядків, незалежно від кількості замовлень.
+    """
+    now = datetime.utcnow()
+    today = now.date()
     
-    return render_template('admin/dashboard.html',
-                         total_products=total_products,
-                         total_orders=total_orders,
-                         pending_orders=pending_orders,
-                         processing_orders=processing_orders,
-                         completed_orders=completed_orders,
-                         cancelled_orders=cancelled_orders,
-                         total_users=total_users,
-                         recent_orders=recent_orders,
-                         latest_orders=latest_orders,
-                         latest_products=latest_products,
-                         top_products=top_products,
-                         orders_by_day=orders_by_day,
-                         sales_by_day=sales_by_day)
+    # Загальні лічильники одним запитом
+    total_products, total_users = db.session.query(
+        select(func.count(Product.id)).scalar_subquery(),
+        select(func.count(User.id)).scalar_subquery(),
+    ).one()
+    
+    # Статистика по статусах
+    status_counts = order_stats.status_counts()
+    
+    # Статистика замовлень за останні 30 днів (для графіку);
+    # "за 7 днів" - сьогодні та 6 попередніх днів
+    orders_by_day = _day_series(order_stats.orders_by_day(today - timedelta(days=30)), 31, now, 'count')
+    recent_orders = sum(day['count'] for day in orders_by_day[-7:])
+    
+    # Статистика продажів за останні 7 днів
+    sales_rows = order_stats.units_by_day(today - timedelta(days=6), exclude_status='cancelled')
+    
+    return {
+        'total_products': total_products,
+        'total_orders': sum(status_counts.values()),
+        'pending_orders': status_counts.get('pending', 0),
+        'processing_orders': status_counts.get('processing', 0),
+        'completed_orders': status_counts.get('completed', 0),
+        'cancelled_orders': status_counts.get('cancelled', 0),
+        'total_users': total_users,
+        'recent_orders': recent_orders,
+        # Топ товарів за кількістю продажів
+        'top_products': order_stats.top_products(limit=5),
+        'orders_by_day': orders_by_day,
+        'sales_by_day': _day_series(sales_rows, 7, now, 'quantity'),
+    }
 
 
 @admin_bp.route('/products')
@@ -102,29 +109,30 @@ def products():
     page = request.args.get('page', 1, type=int)
     search = request.args.get('search', '')
     
-    query = Product.query
+    query = Product.query.options(selectinload(Product.images))
     
     if search:
-        query = query.filter(Product.name.contains(search) | Product.description.contains(search))
+        query, relevance = apply_search(query, search)
+        if relevance is not None:
+            query = query.order_by(relevance)
     
     products = query.order_by(Product.created_at.desc()).paginate(page=page, per_page=20, error_out=False)
     
     # Отримуємо всі категорії для масової зміни категорії
-    def get_all_categories(categories, result=None):
-        if result is None:
-            result = []
-        for cat in categories:
-            result.append(cat)
-            if cat.children:
-                get_all_categories(cat.children, result)
-        return result
-    
-    main_categories = Category.query.filter_by(parent_id=None).all()
-    categories = get_all_categories(main_categories)
+    categories = get_category_tree().flat()
     
     return render_template('admin/products.html', products=products, search=search, categories=categories)
 
 
+def _save_product_image(img_file):
+    """Зберігає завантажене зображення; відхилений файл пропускається з повідомленням (None)"""
+    try:
+        return save_uploaded_file(img_file)
+    except (ImageRejected, UploadTooLarge) as e:
+        flash(f'Файл {img_file.filename} пропущено: {e}', 'error')
+        return None
+
+
 @admin_bp.route('/products/add', methods=['GET', 'POST'])
 @login_required
 @admin_required
@@ -154,21 +162,26 @@ def add_product():
             uploaded_images = [img for img in request.files.getlist('image_files') if img and getattr(img, 'filename', '')]
             saved_index = 0
             for img_file in uploaded_images:
-                img_path = save_uploaded_file(img_file)
+                img_path = _save_product_image(img_file)
                 if img_path:
                     is_primary = saved_index == 0
                     product_image = ProductImage(
                         product_id=product.id,
                         image_url='/' + img_path,
                         is_primary=is_primary,
-                        display_order=saved_index
+                        display_order=saved_index,
+                        processing_state=STATE_PENDING
                     )
+                    # Той самий файл уже оброблявся для іншого товару - без повторної обробки
+                    reuse_processed(product_image)
                     db.session.add(product_image)
                     if is_primary:
                         product.image_url = '/' + img_path
                     saved_index += 1
             
             db.session.commit()
+            # Зображення обробляються у фоні (image_queue.py)
+            notify_image_worker()
             flash('Товар успішно додано', 'success')
             return redirect(url_for('admin.products'))
             
@@ -214,7 +227,7 @@ def edit_product(product_id):
                     max_order = -1
                 saved_index = 0
                 for img_file in uploaded_images:
-                    img_path = save_uploaded_file(img_file)
+                    img_path = _save_product_image(img_file)
                     if img_path:
                         if max_order == -1:
                             display_order = saved_index
@@ -226,14 +239,18 @@ def edit_product(product_id):
                             product_id=product.id,
                             image_url='/' + img_path,
                             is_primary=is_primary,
-                            display_order=display_order
+                            display_order=display_order,
+                            processing_state=STATE_PENDING
                         )
+                        # Той самий файл уже оброблявся для іншого товару - без повторної обробки
+                        reuse_processed(product_image)
                         db.session.add(product_image)
                         if is_primary:
                             product.image_url = '/' + img_path
                         saved_index += 1
             
             db.session.commit()
+            notify_image_worker()
             flash('Товар успішно оновлено', 'success')
             return redirect(url_for('admin.products'))
             
@@ -322,12 +339,12 @@ def delete_product_image(image_id):
                 # Якщо немає інших зображень, очищаємо image_url
                 product.image_url = None
         
-        # Видаляємо файл якщо він локальний
-        if product_image.image_url and product_image.image_url.startswith('/static/uploads'):
-            try:
-                delete_file(product_image.image_url[1:])
-            except Exception as e:
-                print(f"Помилка видалення файлу: {e}")
+        # Зміна галереї - це зміна товару (для Last-Modified сторінки товару)
+        product.updated_at = datetime.utcnow()
+        
+        # Файл (з похідними) видалить диспетчер після commit, якщо він більше нікому не потрібен
+        if local_path(product_image.image_url):
+            enqueue_file_deletions([local_path(product_image.image_url)])
         
         # Зберігаємо product_id та порядок перед видаленням
         saved_product_id = int(product_id)
@@ -378,14 +395,9 @@ def delete_product(product_id):
     """Видалити товар"""
     product = Product.query.get_or_404(product_id)
     
-    # Видаляємо головне зображення якщо воно локальне
-    if product.image_url and product.image_url.startswith('/static/uploads'):
-        delete_file(product.image_url[1:])
-    
-    # Видаляємо всі додаткові зображення
-    for img in product.images:
-        if img.image_url and img.image_url.startswith('/static/uploads'):
-            delete_file(img.image_url[1:])
+    # Файли зображень видалить диспетчер після commit, якщо вони не використовуються іншими товарами
+    urls = [product.image_url] + [img.image_url for img in product.images]
+    enqueue_file_deletions([local_path(url) for url in urls if local_path(url)])
     
     db.session.delete(product)
     db.session.commit()
@@ -411,6 +423,33 @@ def orders():
     return render_template('admin/orders.html', orders=orders, status_filter=status_filter)
 
 
+@admin_bp.route('/orders/export')
+@login_required
+@admin_required
+def export_orders():
+    """Потоковий експорт замовлень за період (CSV або NDJSON)"""
+    fmt = request.args.get('format', 'csv')
+    date_from = request.args.get('date_from', '')
+    date_to = request.args.get('date_to', '')
+    if fmt not in order_export.FORMATS:
+        flash('Невідомий формат експорту', 'error')
+        return redirect(url_for('admin.orders'))
+    try:
+        start, end = order_export.parse_date_range(date_from, date_to)
+    except ValueError:
+        flash('Некоректна дата (очікується РРРР-ММ-ДД)', 'error')
+        return redirect(url_for('admin.orders'))
+    
+    filename = f"orders_{date_from or 'all'}_{date_to or 'all'}.{fmt}"
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    response = Response(stream_with_context(order_export.iter_export(fmt, start, end)),
+                        mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    # Nginx передає частини одразу, не буферизуючи всю відповідь
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
 @admin_bp.route('/orders/<int:order_id>')
 @login_required
 @admin_required
@@ -440,8 +479,8 @@ def update_order_status(order_id):
     form = OrderStatusForm()
     
     if form.validate_on_submit():
-        order.status = form.status.data
-        order.updated_at = datetime.utcnow()
+        # Статус і денна статистика змінюються разом
+        order_stats.change_order_status(order, form.status.data)
         db.session.commit()
         flash('Статус замовлення оновлено', 'success')
         return redirect(url_for('admin.order_detail', order_id=order_id))
@@ -493,6 +532,7 @@ def add_category():
         )
         db.session.add(category)
         db.session.commit()
+        invalidate_category_tree()
         flash('Категорію успішно додано', 'success')
         return redirect(url_for('admin.categories'))
     
@@ -539,6 +579,7 @@ def edit_category(category_id):
                 category.parent_id = None
             
             db.session.commit()
+            invalidate_category_tree()
             flash('Категорію успішно оновлено', 'success')
             return redirect(url_for('admin.categories'))
         except Exception as e:
@@ -567,6 +608,7 @@ def delete_category(category_id):
     
     db.session.delete(category)
     db.session.commit()
+    invalidate_category_tree()
     flash('Категорію успішно видалено', 'success')
     return redirect(url_for('admin.categories'))
 
@@ -576,19 +618,13 @@ def delete_category(category_id):
 @admin_required
 def bulk_activate_products():
     """Масове активування товарів"""
-    product_ids = request.form.get('product_ids', '').split(',')
-    product_ids = [int(id) for id in product_ids if id.strip().isdigit()]
-    
-    if product_ids:
-        products = Product.query.filter(Product.id.in_(product_ids)).all()
-        for product in products:
-            product.is_active = True
-        db.session.commit()
-        flash(f'Успішно активовано {len(products)} товар(ів)', 'success')
-    else:
+    if _bulk_selection_empty():
         flash('Не вибрано товарів для активації', 'error')
+    else:
+        count = bulk_products.bulk_update(bulk_products.iter_selected_ids(request.form), is_active=True)
+        flash(f'Успішно активовано {count} товар(ів)', 'success')
     
-    return redirect(url_for('admin.products'))
+    return redirect(_products_list_url())
 
 
 @admin_bp.route('/products/bulk/deactivate', methods=['POST'])
@@ -596,19 +632,13 @@ def bulk_activate_products():
 @admin_required
 def bulk_deactivate_products():
     """Масове деактивування товарів"""
-    product_ids = request.form.get('product_ids', '').split(',')
-    product_ids = [int(id) for id in product_ids if id.strip().isdigit()]
-    
-    if product_ids:
-        products = Product.query.filter(Product.id.in_(product_ids)).all()
-        for product in products:
-            product.is_active = False
-        db.session.commit()
-        flash(f'Успішно деактивовано {len(products)} товар(ів)', 'success')
-    else:
+    if _bulk_selection_empty():
         flash('Не вибрано товарів для деактивації', 'error')
+    else:
+        count = bulk_products.bulk_update(bulk_products.iter_selected_ids(request.form), is_active=False)
+        flash(f'Успішно деактивовано {count} товар(ів)', 'success')
     
-    return redirect(url_for('admin.products'))
+    return redirect(_products_list_url())
 
 
 @admin_bp.route('/products/bulk/delete', methods=['POST'])
@@ -616,31 +646,16 @@ def bulk_deactivate_products():
 @admin_required
 def bulk_delete_products():
     """Масове видалення товарів"""
-    product_ids = request.form.get('product_ids', '').split(',')
-    product_ids = [int(id) for id in product_ids if id.strip().isdigit()]
-    
-    if product_ids:
-        products = Product.query.filter(Product.id.in_(product_ids)).all()
-        deleted_count = 0
-        for product in products:
-            # Видаляємо головне зображення
-            if product.image_url and product.image_url.startswith('/static/uploads'):
-                delete_file(product.image_url[1:])
-            
-            # Видаляємо всі додаткові зображення
-            for img in product.images:
-                if img.image_url and img.image_url.startswith('/static/uploads'):
-                    delete_file(img.image_url[1:])
-            
-            db.session.delete(product)
-            deleted_count += 1
-        
-        db.session.commit()
-        flash(f'Успішно видалено {deleted_count} товар(ів)', 'success')
-    else:
+    if _bulk_selection_empty():
         flash('Не вибрано товарів для видалення', 'error')
+    else:
+        deleted_count, skipped_count = bulk_products.bulk_delete(bulk_products.iter_selected_ids(request.form))
+        if deleted_count or not skipped_count:
+            flash(f'Успішно видалено {deleted_count} товар(ів)', 'success')
+        if skipped_count:
+            flash(f'{skipped_count} товар(ів) не видалено, бо вони є в замовленнях. Їх можна деактивувати', 'error')
     
-    return redirect(url_for('admin.products'))
+    return redirect(_products_list_url())
 
 
 @admin_bp.route('/products/bulk/change-category', methods=['POST'])
@@ -648,22 +663,27 @@ def bulk_delete_products():
 @admin_required
 def bulk_change_category():
     """Масове зміна категорії товарів"""
-    product_ids = request.form.get('product_ids', '').split(',')
-    product_ids = [int(id) for id in product_ids if id.strip().isdigit()]
     category_id = request.form.get('category_id', type=int)
     
-    if product_ids and category_id:
-        products = Product.query.filter(Product.id.in_(product_ids)).all()
-        for product in products:
-            product.category_id = category_id
-        db.session.commit()
-        flash(f'Успішно змінено категорію для {len(products)} товар(ів)', 'success')
+    if category_id and not _bulk_selection_empty():
+        count = bulk_products.bulk_update(bulk_products.iter_selected_ids(request.form), category_id=category_id)
+        flash(f'Успішно змінено категорію для {count} товар(ів)', 'success')
     elif not category_id:
         flash('Не вибрано категорію', 'error')
     else:
         flash('Не вибрано товарів', 'error')
     
-    return redirect(url_for('admin.products'))
+    return redirect(_products_list_url())
+
+
+def _bulk_selection_empty():
+    return request.form.get('select_all') != '1' and not request.form.get('product_ids', '').strip()
+
+
+def _products_list_url():
+    """Повернення до списку товарів з тим самим пошуком"""
+    search = request.form.get('search', '')
+    return url_for('admin.products', search=search) if search else url_for('admin.products')
 
 
 @admin_bp.route('/users')
@@ -674,22 +694,27 @@ def users():
     page = request.args.get('page', 1, type=int)
     search = request.args.get('search', '')
     
-    query = User.query
-    
-    if search:
-        from sqlalchemy import or_
-        query = query.filter(
-            or_(
-                User.username.contains(search),
-                User.email.contains(search),
-                User.city.contains(search),
-                User.institution.contains(search)
-            )
-        )
-    
+    query = apply_user_search(User.query, search)
     users = query.order_by(User.created_at.desc()).paginate(page=page, per_page=20, error_out=False)
     
-    return render_template('admin/users.html', users=users, search=search)
+    return render_template('admin/users.html', users=users, search=search,
+                           user_stats=_users_order_stats([user.id for user in users.items]))
+
+
+def _users_order_stats(user_ids):
+    """{user_id: (замовлень, останнє замовлення, одиниць)} одним запитом для сторінки списку"""
+    if not user_ids:
+        return {}
+    # count(DISTINCT) - join з order_items дає рядок на кожен елемент замовлення
+    rows = db.session.query(
+        Order.user_id,
+        func.count(func.distinct(Order.id)),
+        func.max(Order.created_at),
+        func.coalesce(func.sum(OrderItem.quantity), 0)
+    ).outerjoin(OrderItem, OrderItem.order_id == Order.id).filter(
+        Order.user_id.in_(user_ids)
+    ).group_by(Order.user_id).all()
+    return {user_id: (count, last_order, int(units)) for user_id, count, last_order, units in rows}
 
 
 @admin_bp.route('/users/<int:user_id>/toggle-block', methods=['POST'])
@@ -723,23 +748,37 @@ def toggle_user_block(user_id):
 def user_orders(user_id):
     """Замовлення користувача"""
     user = User.query.get_or_404(user_id)
-    orders = Order.query.filter_by(user_id=user_id).order_by(Order.created_at.desc()).all()
     
-    # Статистика
-    total_orders = len(orders)
-    pending_count = sum(1 for o in orders if o.status == 'pending')
-    processing_count = sum(1 for o in orders if o.status == 'processing')
-    completed_count = sum(1 for o in orders if o.status == 'completed')
-    cancelled_count = sum(1 for o in orders if o.status == 'cancelled')
+    # Статистика: один GROUP BY замість завантаження всіх замовлень (кешується до змін замовлень)
+    counts = cached_report(f'user_orders:{user_id}', lambda: _user_status_counts(user_id))
+    
+    # Сторінка замовлень (keyset за індексом (user_id, created_at));
+    # елементи замовлень сторінки та їх товари - двома запитами з IN (selectin)
+    page = keyset_paginate(
+        Order.query.filter(Order.user_id == user_id).options(
+            selectinload(Order.items).selectinload(OrderItem.product)
+        ),
+        [(Order.created_at, True), (Order.id, True)],
+        cursor=request.args.get('cursor'),
+        per_page=50
+    )
     
     return render_template('admin/user_orders.html', 
                          user=user, 
-                         orders=orders,
-                         total_orders=total_orders,
-                         pending_count=pending_count,
-                         processing_count=processing_count,
-                         completed_count=completed_count,
-                         cancelled_count=cancelled_count)
+                         orders=page.items,
+                         page=page,
+                         total_orders=sum(counts.values()),
+                         pending_count=counts.get('pending', 0),
+                         processing_count=counts.get('processing', 0),
+                         completed_count=counts.get('completed', 0),
+                         cancelled_count=counts.get('cancelled', 0))
+
+
+def _user_status_counts(user_id):
+    """{статус: кількість замовлень} користувача"""
+    return dict(db.session.query(Order.status, func.count(Order.id)).filter(
+        Order.user_id == user_id
+    ).group_by(Order.status).all())
 
 
 @admin_bp.route('/settings/telegram', methods=['GET', 'POST'])
@@ -1,10 +1,18 @@
 from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify
 from flask_login import login_required, current_user, logout_user
-from models import db, Product, CartItem, Order, OrderItem, Category
-from sqlalchemy import func
+from models import db, Product, CartItem, Order, OrderItem
+from sqlalchemy import insert, update, delete
+from sqlalchemy.orm import selectinload, joinedload
 from datetime import datetime
-from utils import send_telegram_message
+from notifications import enqueue_telegram, notify_dispatcher
+from idempotency import idempotent
+from order_stats import record_new_order, change_order_status
+from search import apply_search
+from category_tree import get_category_tree
+from pagination import keyset_paginate
+from catalog_cache import cached_page, conditional_response, product_last_modified, catalog_count
 from functools import wraps
+from config import Config
 
 main_bp = Blueprint('main', __name__)
 
@@ -21,70 +29,55 @@ def check_user_blocked(f):
     return decorated_function
 
 @main_bp.route('/')
+@cached_page(params=('category', 'search', 'sort', 'cursor'))
 def index():
     """Головна сторінка з каталогом товарів"""
-    page = request.args.get('page', 1, type=int)
     category_id = request.args.get('category', type=int)
     search = request.args.get('search', '')
-    sort_by = request.args.get('sort', 'newest')  # newest, name_asc, name_desc
+    # relevance (за замовчуванням при пошуку), newest, name_asc, name_desc
+    sort_by = request.args.get('sort', 'relevance' if search else 'newest')
     
     # Показуємо всі товари (активні та неактивні), неактивні будуть тусклі
-    query = Product.query
+    # Зображення всіх карток завантажуються одним додатковим запитом (selectin)
+    query = Product.query.options(selectinload(Product.images))
+    relevance = None
     
     if search:
-        query = query.filter(Product.name.contains(search) | Product.description.contains(search))
+        query, relevance = apply_search(query, search)
     
     if category_id:
-        # Перевіряємо чи це основна категорія (має підкатегорії)
-        category = Category.query.get(category_id)
-        if category:
-            # Отримуємо всі ID категорій (основна + всі підкатегорії)
-            category_ids = [category_id]
-            
-            # Рекурсивно отримуємо всі підкатегорії
-            def get_all_children(cat_id):
-                children = Category.query.filter_by(parent_id=cat_id).all()
-                for child in children:
-                    category_ids.append(child.id)
-                    get_all_children(child.id)  # Рекурсивно для вкладених підкатегорій
-            
-            get_all_children(category_id)
+        # Основна категорія + всі підкатегорії з кешу дерева: один IN запит
+        category_ids = get_category_tree().descendant_ids(category_id)
+        if category_ids:
             query = query.filter(Product.category_id.in_(category_ids))
         else:
             query = query.filter(Product.category_id == category_id)
     
-    # Сортування
+    # Сортування (ключі keyset-пагінації, останній ключ - унікальний id)
     # Спочатку активні товари, потім неактивні
     if sort_by == 'name_asc':
-        query = query.order_by(Product.is_active.desc(), Product.name.asc())
+        keys = [(Product.is_active, True), (Product.name, False), (Product.id, False)]
     elif sort_by == 'name_desc':
-        query = query.order_by(Product.is_active.desc(), Product.name.desc())
+        keys = [(Product.is_active, True), (Product.name, True), (Product.id, True)]
+    elif sort_by == 'relevance' and relevance is not None:
+        keys = [(Product.is_active, True), (relevance, False), (Product.id, False)]
     else:  # newest (за замовчуванням)
-        query = query.order_by(Product.is_active.desc(), Product.created_at.desc())
+        keys = [(Product.is_active, True), (Product.created_at, True), (Product.id, True)]
     
-    products = query.paginate(page=page, per_page=25, error_out=False)
+    products = keyset_paginate(query, keys, cursor=request.args.get('cursor'), per_page=25)
+    # Загальна кількість - з кешу (однакова для всіх сторінок фільтра)
+    total_count = catalog_count(f'{category_id}:{search}', query)
     
     # Отримуємо список категорій з підкатегоріями
-    def get_categories_tree():
-        main_categories = Category.query.filter_by(parent_id=None).all()
-        result = []
-        for cat in main_categories:
-            result.append({
-                'id': cat.id,
-                'name': cat.name,
-                'full_path': cat.name,
-                'children': [{'id': child.id, 'name': child.name, 'full_path': child.full_path} 
-                            for child in cat.children]
-            })
-        return result
-    
-    categories = get_categories_tree()
+    categories = get_category_tree().menu()
     
     return render_template('index.html', products=products, categories=categories, 
-                         current_category_id=category_id, search=search, sort_by=sort_by)
+                         current_category_id=category_id, search=search, sort_by=sort_by,
+                         total_count=total_count)
 
 
 @main_bp.route('/product/<int:product_id>')
+@cached_page(last_modified=product_last_modified)
 def product_detail(product_id):
     """Детальна сторінка товару"""
     product = Product.query.get_or_404(product_id)
@@ -95,12 +88,18 @@ def product_detail(product_id):
 @check_user_blocked
 def cart():
     """Сторінка кошика"""
-    cart_items = CartItem.query.filter_by(user_id=current_user.id).all()
+    cart_items = (
+        CartItem.query
+        .filter_by(user_id=current_user.id)
+        .options(joinedload(CartItem.product).selectinload(Product.images))
+        .all()
+    )
     return render_template('cart.html', cart_items=cart_items)
 
 
 @main_bp.route('/cart/add/<int:product_id>', methods=['POST'])
 @check_user_blocked
+@idempotent
 def add_to_cart(product_id):
     """Додати товар до кошика"""
     product = Product.query.get_or_404(product_id)
@@ -110,22 +109,8 @@ def add_to_cart(product_id):
         flash('Кількість повинна бути більше 0', 'error')
         return redirect(url_for('main.product_detail', product_id=product_id))
     
-    # Перевіряємо чи товар вже в кошику
-    cart_item = CartItem.query.filter_by(
-        user_id=current_user.id,
-        product_id=product_id
-    ).first()
-    
-    if cart_item:
-        cart_item.quantity += quantity
-    else:
-        cart_item = CartItem(
-            user_id=current_user.id,
-            product_id=product_id,
-            quantity=quantity
-        )
-        db.session.add(cart_item)
-    
+    # Додаємо або збільшуємо кількість одним атомарним запитом
+    CartItem.add_quantity(current_user.id, product_id, quantity)
     db.session.commit()
     flash('Товар додано до кошика', 'success')
     return redirect(url_for('main.cart'))
@@ -171,13 +156,47 @@ def remove_from_cart(cart_item_id):
     return redirect(url_for('main.cart', deleted=1))
 
 
+def _take_cart_lines(user_id):
+    """Видаляє рядки кошика користувача і повертає їх як [(product_id, quantity)]"""
+    if db.session.get_bind().dialect.delete_returning:
+        rows = db.session.execute(
+            delete(CartItem).where(CartItem.user_id == user_id)
+            .returning(CartItem.id, CartItem.product_id, CartItem.quantity)
+        ).all()
+    else:
+        rows = db.session.query(CartItem.id, CartItem.product_id, CartItem.quantity).filter(
+            CartItem.user_id == user_id
+        ).all()
+        if rows:
+            db.session.execute(delete(CartItem).where(CartItem.id.in_([row.id for row in rows])))
+    # Порядок додавання в кошик
+    return [(row.product_id, row.quantity) for row in sorted(rows, key=lambda row: row.id)]
+
+
 @main_bp.route('/cart/checkout', methods=['POST'])
 @check_user_blocked
+@idempotent
 def checkout():
-    """Оформити замовлення"""
-    cart_items = CartItem.query.filter_by(user_id=current_user.id).all()
+    """Оформити замовлення.
+    
+    Кілька запитів незалежно від розміру кошика: DELETE ... RETURNING
+    забирає рядки кошика (паралельний повторний checkout отримає порожній
+    кошик), один запит - дані товарів, одна пакетна вставка елементів
+    замовлення. Шляхи категорій беруться з кешу дерева категорій.
+    """
+    lines = _take_cart_lines(current_user.id)
+    
+    # Рядки кошика з товарами, яких вже немає, пропускаємо
+    products = {}
+    if lines:
+        products = {
+            row.id: row for row in db.session.query(Product.id, Product.name, Product.category, Product.category_id)
+            .filter(Product.id.in_([product_id for product_id, _ in lines]))
+        }
+    lines = [(product_id, quantity) for product_id, quantity in lines if product_id in products]
     
-    if not cart_items:
+    if not lines:
+        db.session.rollback()
         flash('Кошик порожній', 'error')
         return redirect(url_for('main.cart'))
     
@@ -186,27 +205,26 @@ def checkout():
         user_id=current_user.id,
         status='pending',
         city=current_user.city,
-        institution=current_user.institution
+        institution=current_user.institution,
+        created_at=datetime.utcnow()
     )
     db.session.add(order)
     db.session.flush()  # Отримуємо ID замовлення
     
-    # Створюємо елементи замовлення
-    for item in cart_items:
-        order_item = OrderItem(
-            order_id=order.id,
-            product_id=item.product_id,
-            quantity=item.quantity
-        )
-        db.session.add(order_item)
-        
-        # Видаляємо з кошика
-        db.session.delete(item)
+    # Створюємо елементи замовлення однією пакетною вставкою
+    db.session.execute(insert(OrderItem), [
+        {'order_id': order.id, 'product_id': product_id, 'quantity': quantity}
+        for product_id, quantity in lines
+    ])
     
-    db.session.commit()
+    # Денна статистика для dashboard - в тій самій транзакції
+    record_new_order(order.created_at, order.status, lines)
     
-    # Відправляємо повідомлення в Telegram
+    # Повідомлення в Telegram ставимо в чергу в тій самій транзакції:
+    # відправить фоновий диспетчер (notifications.py), checkout не чекає на Telegram
     try:
+        tree = get_category_tree()
+        
         # Формуємо повідомлення про нове замовлення
         message = f"🛒 <b>Нове замовлення #{order.id}</b>\n\n"
         message += f"👤 <b>Користувач:</b> {current_user.username}\n"
@@ -216,17 +234,18 @@ def checkout():
         message += f"📦 <b>Товари:</b>\n"
         
         total_items = 0
-        for item in order.items:
-            product = item.product
-            category_path = product.category_obj.full_path if product.category_obj else (product.category or 'Без категорії')
-            message += f"  • {product.name} ({category_path}) - {item.quantity} шт.\n"
-            total_items += item.quantity
+        item_lines = []
+        for product_id, quantity in lines:
+            product = products[product_id]
+            category_path = tree.full_path(product.category_id) or product.category or 'Без категорії'
+            item_lines.append(f"  • {product.name} ({category_path}) - {quantity} шт.\n")
+            total_items += quantity
+        message += ''.join(item_lines)
         
         message += f"\n📊 <b>Всього товарів:</b> {total_items} шт.\n"
         message += f"📅 <b>Дата:</b> {order.created_at.strftime('%d.%m.%Y %H:%M')}\n"
         
         # Отримуємо URL для адмін-панелі
-        from flask import url_for
         try:
             admin_url = url_for('admin.order_detail', order_id=order.id, _external=True)
             message += f"\n🔗 <a href='{admin_url}'>Переглянути замовлення</a>"
@@ -234,11 +253,14 @@ def checkout():
             # Якщо не вдається отримати URL, просто вказуємо ID
             message += f"\n🔗 ID замовлення: {order.id}"
         
-        send_telegram_message(message)
+        enqueue_telegram(message)
     except Exception as e:
-        print(f"Помилка відправки повідомлення в Telegram: {e}")
+        print(f"Помилка формування повідомлення в Telegram: {e}")
         # Не перериваємо процес оформлення замовлення через помилку Telegram
     
+    db.session.commit()
+    notify_dispatcher()
+    
     flash('Замовлення успішно оформлено!', 'success')
     return redirect(url_for('main.orders'))
 
@@ -267,59 +289,118 @@ def cancel_order(order_id):
         flash('Можна скасувати тільки замовлення зі статусом "Очікує обробки"', 'error')
         return redirect(url_for('main.orders'))
     
-    # Змінюємо статус на cancelled
-    order.status = 'cancelled'
+    # Змінюємо статус на cancelled (лише якщо його паралельно не змінили)
+    if not change_order_status(order, 'cancelled', expected_status='pending'):
+        db.session.rollback()
+        flash('Можна скасувати тільки замовлення зі статусом "Очікує обробки"', 'error')
+        return redirect(url_for('main.orders'))
     db.session.commit()
     
     flash('Замовлення успішно скасовано', 'success')
     return redirect(url_for('main.orders'))
 
 
+def _positive_int(value):
+    """Ціле число > 0 (також з рядка "5") або None"""
+    if isinstance(value, bool):
+        return None
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        return None
+    return value if value > 0 else None
+
+
 @main_bp.route('/api/cart/sync', methods=['POST'])
 @check_user_blocked
 def sync_cart():
-    """Синхронізація кошика з localStorage"""
+    """Синхронізація кошика з localStorage.
+    
+    Злиття виконується пакетно: один запит товарів, один запит рядків
+    кошика, одна вставка та одне оновлення. Для товарів, що вже є в
+    кошику, залишається більша кількість.
+    """
+    if request.content_length and request.content_length > Config.CART_SYNC_MAX_BYTES:
+        return jsonify({
+            'success': False,
+            'message': 'Занадто великий кошик для синхронізації'
+        }), 413
+    
     try:
-        data = request.get_json()
+        data = request.get_json(silent=True) or {}
         cart_items = data.get('cart', [])
+        if not isinstance(cart_items, list):
+            raise ValueError('cart має бути списком')
+        if len(cart_items) > Config.CART_SYNC_MAX_ITEMS:
+            return jsonify({
+                'success': False,
+                'message': f'Можна синхронізувати не більше {Config.CART_SYNC_MAX_ITEMS} товарів'
+            }), 413
         
-        synced = 0
+        # Валідуємо позиції та об'єднуємо дублікати (беремо максимум)
+        results = []
+        wanted = {}
         for item in cart_items:
-            product_id = item.get('product_id')
-            quantity = item.get('quantity', 1)
-            
-            if not product_id or quantity <= 0:
+            if not isinstance(item, dict):
+                results.append({'product_id': None, 'status': 'skipped', 'reason': 'invalid'})
                 continue
-            
-            # Перевіряємо чи товар існує та активний
-            product = Product.query.get(product_id)
-            if not product or not product.is_active:
+            product_id = _positive_int(item.get('product_id'))
+            quantity = _positive_int(item.get('quantity', 1))
+            if product_id is None or quantity is None:
+                results.append({'product_id': item.get('product_id'), 'status': 'skipped', 'reason': 'invalid'})
                 continue
-            
-            # Перевіряємо чи товар вже в кошику
-            cart_item = CartItem.query.filter_by(
-                user_id=current_user.id,
-                product_id=product_id
-            ).first()
-            
-            if cart_item:
-                # Оновлюємо кількість (беремо максимум)
-                cart_item.quantity = max(cart_item.quantity, quantity)
+            wanted[product_id] = min(max(wanted.get(product_id, 0), quantity), Config.CART_MAX_QUANTITY)
+        
+        # Один запит для всіх активних товарів з кошика
+        active_ids = set()
+        if wanted:
+            active_ids = {
+                row.id for row in db.session.query(Product.id)
+                .filter(Product.id.in_(list(wanted)), Product.is_active.is_(True))
+            }
+        
+        # Один запит для наявних рядків кошика користувача
+        existing = {}
+        if active_ids:
+            existing = {
+                row.product_id: row for row in db.session.query(CartItem.id, CartItem.product_id, CartItem.quantity)
+                .filter(CartItem.user_id == current_user.id, CartItem.product_id.in_(active_ids))
+            }
+        
+        inserts = []
+        updates = []
+        for product_id, quantity in wanted.items():
+            if product_id not in active_ids:
+                results.append({'product_id': product_id, 'status': 'skipped', 'reason': 'unavailable'})
+            elif product_id in existing:
+                row = existing[product_id]
+                if quantity > row.quantity:
+                    # Оновлюємо кількість (беремо максимум)
+                    updates.append({'id': row.id, 'quantity': quantity})
+                    results.append({'product_id': product_id, 'status': 'updated', 'quantity': quantity})
+                else:
+                    results.append({'product_id': product_id, 'status': 'unchanged', 'quantity': row.quantity})
             else:
-                # Додаємо новий товар
-                cart_item = CartItem(
-                    user_id=current_user.id,
-                    product_id=product_id,
-                    quantity=quantity
-                )
-                db.session.add(cart_item)
-                synced += 1
+                inserts.append({
+                    'user_id': current_user.id,
+                    'product_id': product_id,
+                    'quantity': quantity,
+                    'created_at': datetime.utcnow()
+                })
+                results.append({'product_id': product_id, 'status': 'added', 'quantity': quantity})
         
+        if inserts:
+            CartItem.insert_or_keep_max(inserts)
+        if updates:
+            db.session.execute(update(CartItem), updates)
         db.session.commit()
         
+        synced = len(inserts)
         return jsonify({
             'success': True,
             'synced': synced,
+            'updated': len(updates),
+            'items': results,
             'message': f'Синхронізовано {synced} товарів'
         })
     except Exception as e:
@@ -339,11 +420,12 @@ def get_cart():
         'product_id': item.product_id,
         'quantity': item.quantity
     } for item in cart_items]
-    return jsonify({'cart': cart_data})
+    return conditional_response(jsonify({'cart': cart_data}))
 
 
 @main_bp.route('/api/cart/add/<int:product_id>', methods=['POST'])
 @check_user_blocked
+@idempotent
 def api_add_to_cart(product_id):
     """API endpoint для швидкого додавання товару до кошика"""
     try:
@@ -372,27 +454,12 @@ def api_add_to_cart(product_id):
                 'message': 'Кількість повинна бути більше 0'
             }), 400
         
-        # Перевіряємо чи товар вже в кошику
-        cart_item = CartItem.query.filter_by(
-            user_id=current_user.id,
-            product_id=product_id
-        ).first()
-        
-        if cart_item:
-            cart_item.quantity += quantity
-        else:
-            cart_item = CartItem(
-                user_id=current_user.id,
-                product_id=product_id,
-                quantity=quantity
-            )
-            db.session.add(cart_item)
-        
+        # Додаємо або збільшуємо кількість одним атомарним запитом
+        CartItem.add_quantity(current_user.id, product_id, quantity)
         db.session.commit()
         
         # Отримуємо оновлену кількість товарів у кошику
-        cart_items = CartItem.query.filter_by(user_id=current_user.id).all()
-        cart_count = sum(item.quantity for item in cart_items)
+        cart_count = CartItem.count_for_user(current_user.id)
         
         return jsonify({
             'success': True,
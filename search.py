@@ -0,0 +1,240 @@
+"""Повнотекстовий пошук по каталогу товарів та пошук користувачів.
+
+Для SQLite використовується віртуальна таблиця FTS5 (products_fts), яка
+синхронізується з таблицею products тригерами. Для PostgreSQL - GIN індекс
+по tsvector. Для інших СУБД залишається пошук через LIKE.
+
+Користувачі шукаються за підрядком (як і раніше через contains), але по
+індексу триграм: FTS5 з tokenize='trigram' (users_fts) для SQLite та
+pg_trgm GIN індекси для PostgreSQL.
+"""
+import re
+from sqlalchemy import text, func, Integer, Float
+from models import db, Product, User
+
+# Ваги колонок для bm25: збіг у назві важливіший за збіг в описі
+NAME_WEIGHT = 10.0
+DESCRIPTION_WEIGHT = 1.0
+
+# Слова запиту: літери/цифри та апострофи (м'ячик, м’ячик)
+_TERM_RE = re.compile(r"[\w'’ʼ]+", re.UNICODE)
+
+# Поточний механізм пошуку: 'fts5', 'postgresql' або None (LIKE)
+_backend = None
+# Те саме для пошуку користувачів: 'trigram', 'postgresql' або None (LIKE)
+_user_backend = None
+
+# Триграмний індекс знаходить лише підрядки від 3 символів
+MIN_TRIGRAM_LENGTH = 3
+
+_USER_SEARCH_COLUMNS = ('username', 'email', 'city', 'institution')
+
+_SQLITE_SCHEMA = [
+    # unicode61 приводить до нижнього регістру кирилицю (включно з і, ї, є, ґ);
+    # remove_diacritics 0 - щоб "ї" та "й" не зливались з "і" та "и"
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(
+        name, description,
+        content='products', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 0',
+        prefix='2 3'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS products_fts_ai AFTER INSERT ON products BEGIN
+        INSERT INTO products_fts(rowid, name, description)
+        VALUES (new.id, new.name, new.description);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS products_fts_ad AFTER DELETE ON products BEGIN
+        INSERT INTO products_fts(products_fts, rowid, name, description)
+        VALUES ('delete', old.id, old.name, old.description);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS products_fts_au AFTER UPDATE OF name, description ON products BEGIN
+        INSERT INTO products_fts(products_fts, rowid, name, description)
+        VALUES ('delete', old.id, old.name, old.description);
+        INSERT INTO products_fts(rowid, name, description)
+        VALUES (new.id, new.name, new.description);
+    END
+    """,
+]
+
+_SQLITE_USER_SCHEMA = [
+    # trigram (SQLite 3.34+) індексує всі послідовності з 3 символів, тому
+    # MATCH знаходить будь-який підрядок без повного перегляду таблиці
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS users_fts USING fts5(
+        username, email, city, institution,
+        content='users', content_rowid='id',
+        tokenize='trigram'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS users_fts_ai AFTER INSERT ON users BEGIN
+        INSERT INTO users_fts(rowid, username, email, city, institution)
+        VALUES (new.id, new.username, new.email, new.city, new.institution);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS users_fts_ad AFTER DELETE ON users BEGIN
+        INSERT INTO users_fts(users_fts, rowid, username, email, city, institution)
+        VALUES ('delete', old.id, old.username, old.email, old.city, old.institution);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS users_fts_au AFTER UPDATE OF username, email, city, institution ON users BEGIN
+        INSERT INTO users_fts(users_fts, rowid, username, email, city, institution)
+        VALUES ('delete', old.id, old.username, old.email, old.city, old.institution);
+        INSERT INTO users_fts(rowid, username, email, city, institution)
+        VALUES (new.id, new.username, new.email, new.city, new.institution);
+    END
+    """,
+]
+
+# 'simple' конфігурація не має стемінгу, але приводить текст до нижнього регістру
+_PG_DOCUMENT = "to_tsvector('simple', coalesce(name, '') || ' ' || coalesce(description, ''))"
+
+
+def _pg_document():
+    return func.to_tsvector(
+        'simple',
+        func.coalesce(Product.name, '') + ' ' + func.coalesce(Product.description, '')
+    )
+
+
+def init_search_index():
+    """Створює пошуковий індекс (якщо не існує) та заповнює його"""
+    global _backend
+    dialect = db.engine.dialect.name
+    try:
+        if dialect == 'sqlite':
+            with db.engine.begin() as conn:
+                existed = conn.execute(text(
+                    "SELECT 1 FROM sqlite_master WHERE type='table' AND name='products_fts'"
+                )).first() is not None
+                for statement in _SQLITE_SCHEMA:
+                    conn.execute(text(statement))
+                if not existed:
+                    # Індексуємо товари, які були додані до появи FTS таблиці
+                    conn.execute(text("INSERT INTO products_fts(products_fts) VALUES ('rebuild')"))
+            _backend = 'fts5'
+        elif dialect == 'postgresql':
+            with db.engine.begin() as conn:
+                conn.execute(text(
+                    f"CREATE INDEX IF NOT EXISTS ix_products_fts ON products USING GIN ({_PG_DOCUMENT})"
+                ))
+            _backend = 'postgresql'
+    except Exception as e:
+        print(f"Повнотекстовий пошук недоступний, використовується LIKE: {e}")
+        _backend = None
+
+
+def init_user_search_index():
+    """Створює триграмний індекс для пошуку користувачів (якщо СУБД підтримує)"""
+    global _user_backend
+    dialect = db.engine.dialect.name
+    try:
+        if dialect == 'sqlite':
+            with db.engine.begin() as conn:
+                existed = conn.execute(text(
+                    "SELECT 1 FROM sqlite_master WHERE type='table' AND name='users_fts'"
+                )).first() is not None
+                for statement in _SQLITE_USER_SCHEMA:
+                    conn.execute(text(statement))
+                if not existed:
+                    conn.execute(text("INSERT INTO users_fts(users_fts) VALUES ('rebuild')"))
+            _user_backend = 'trigram'
+        elif dialect == 'postgresql':
+            with db.engine.begin() as conn:
+                conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+                for column in _USER_SEARCH_COLUMNS:
+                    conn.execute(text(
+                        f"CREATE INDEX IF NOT EXISTS ix_users_{column}_trgm ON users USING GIN ({column} gin_trgm_ops)"
+                    ))
+            _user_backend = 'postgresql'
+    except Exception as e:
+        print(f"Триграмний пошук користувачів недоступний, використовується LIKE: {e}")
+        _user_backend = None
+
+
+def rebuild_search_index():
+    """Повністю перебудовує пошукові індекси SQLite FTS5; повертає назви перебудованих таблиць.
+
+    Потрібно лише якщо дані змінювали в обхід тригерів (наприклад, імпорт
+    з вимкненими тригерами); PostgreSQL рахує індекси з самих таблиць.
+    """
+    rebuilt = []
+    with db.engine.begin() as conn:
+        if _backend == 'fts5':
+            conn.execute(text("INSERT INTO products_fts(products_fts) VALUES ('rebuild')"))
+            rebuilt.append('products_fts')
+        if _user_backend == 'trigram':
+            conn.execute(text("INSERT INTO users_fts(users_fts) VALUES ('rebuild')"))
+            rebuilt.append('users_fts')
+    return rebuilt
+
+
+def _terms(search):
+    return [t for t in _TERM_RE.findall(search) if t.strip("'’ʼ")]
+
+
+def apply_search(query, search):
+    """Фільтрує запит товарів за пошуковим рядком.
+
+    Кожне слово шукається як префікс, всі слова мають бути присутні.
+    Повертає (query, relevance), де relevance - вираз, за зростанням якого
+    йдуть найрелевантніші товари, або None, якщо ранжування недоступне.
+    """
+    terms = _terms(search)
+    if not terms:
+        return query.filter(db.false()), None
+
+    if _backend == 'fts5':
+        # Кожне слово - окрема фраза з префіксом: "м'яч" * знайде "м'ячик"
+        match = ' '.join('"{}" *'.format(term) for term in terms)
+        hits = text(
+            "SELECT rowid AS product_id, "
+            f"bm25(products_fts, {NAME_WEIGHT}, {DESCRIPTION_WEIGHT}) AS rank "
+            "FROM products_fts WHERE products_fts MATCH :match"
+        ).bindparams(match=match).columns(product_id=Integer, rank=Float).subquery('search_hits')
+        # bm25 повертає від'ємні значення: менше - релевантніше
+        return query.join(hits, hits.c.product_id == Product.id), hits.c.rank
+
+    if _backend == 'postgresql':
+        tsquery = func.to_tsquery('simple', ' & '.join(
+            "'{}':*".format(term.replace("'", "''")) for term in terms
+        ))
+        document = _pg_document()
+        return query.filter(document.op('@@')(tsquery)), -func.ts_rank(document, tsquery)
+
+    return query.filter(Product.name.contains(search) | Product.description.contains(search)), None
+
+
+def _escape_like(value):
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def apply_user_search(query, search):
+    """Фільтрує запит користувачів: рядок search міститься в імені, email, місті чи закладі"""
+    search = search.strip()
+    if not search:
+        return query
+
+    if _user_backend == 'trigram' and len(search) >= MIN_TRIGRAM_LENGTH:
+        # Весь рядок - одна фраза: збіг підрядка в будь-якій колонці
+        match = '"{}"'.format(search.replace('"', '""'))
+        hits = text(
+            "SELECT rowid AS user_id FROM users_fts WHERE users_fts MATCH :match"
+        ).bindparams(match=match).columns(user_id=Integer).subquery('user_search_hits')
+        return query.join(hits, hits.c.user_id == User.id)
+
+    pattern = f'%{_escape_like(search)}%'
+    columns = [getattr(User, column) for column in _USER_SEARCH_COLUMNS]
+    if _user_backend == 'postgresql':
+        # ILIKE по кожній колонці використовує її GIN (gin_trgm_ops) індекс
+        return query.filter(db.or_(*(column.ilike(pattern, escape='\\') for column in columns)))
+    # Короткі запити (1-2 символи) та СУБД без індексу
+    return query.filter(db.or_(*(column.like(pattern, escape='\\') for column in columns)))
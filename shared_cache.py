@@ -0,0 +1,110 @@
+"""Простий кеш, спільний для всіх воркерів Gunicorn.
+
+Записи зберігаються файлами в Config.SHARED_STATE_DIR/cache/<namespace>/
+(за замовчуванням /dev/shm, тобто в пам'яті). Запис атомарний (тимчасовий
+файл + os.replace). get_or_set() гарантує, що при одночасних промахах по
+одному ключу значення обчислює лише один процес, а решта чекає на результат.
+"""
+import hashlib
+import os
+import pickle
+import shutil
+import threading
+import time
+from config import Config
+
+try:
+    import fcntl
+except ImportError:  # Windows: блокування між процесами недоступне
+    fcntl = None
+
+_MISSING = object()
+
+
+def _namespace_dir(namespace):
+    return os.path.join(Config.SHARED_STATE_DIR, 'cache', namespace)
+
+
+def _entry_path(namespace, key):
+    digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+    return os.path.join(_namespace_dir(namespace), digest)
+
+
+def get(namespace, key, default=None):
+    """Значення з кешу або default, якщо запису немає чи він застарів"""
+    try:
+        with open(_entry_path(namespace, key), 'rb') as f:
+            expires_at, value = pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError, ValueError):
+        return default
+    if expires_at is not None and expires_at < time.time():
+        return default
+    return value
+
+
+def set(namespace, key, value, ttl=None):
+    """Зберігає значення; ttl - час життя в секундах (None - без обмеження)"""
+    path = _entry_path(namespace, key)
+    expires_at = time.time() + ttl if ttl else None
+    try:
+        os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump((expires_at, value), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print(f"Помилка запису в кеш {namespace}: {e}")
+
+
+def clear(namespace):
+    """Видаляє всі записи простору імен"""
+    shutil.rmtree(_namespace_dir(namespace), ignore_errors=True)
+
+
+def get_or_set(namespace, key, creator, ttl=None, should_cache=None, wait_timeout=10.0):
+    """Повертає значення з кешу або обчислює його через creator().
+
+    Поки один процес обчислює значення, інші чекають (до wait_timeout
+    секунд) і отримують вже збережений результат. Якщо should_cache
+    повертає False для результату, він не зберігається.
+
+    Блокування - лише flock на файл ключа (окремий open() на кожен виклик,
+    тому він розділяє і потоки одного процесу). creator() може сам
+    викликати get_or_set() для інших ключів: сторінка рендерить картки.
+    """
+    value = get(namespace, key, _MISSING)
+    if value is not _MISSING:
+        return value
+
+    path = _entry_path(namespace, key)
+    try:
+        os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+        lock_file = open(f'{path}.lock', 'a')
+    except OSError:
+        lock_file = None
+
+    try:
+        if lock_file is not None and fcntl is not None:
+            deadline = time.monotonic() + wait_timeout
+            while True:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except BlockingIOError:
+                    if time.monotonic() >= deadline:
+                        # Не дочекались - обчислюємо самі, без блокування
+                        return creator()
+                    time.sleep(0.05)
+
+        # Поки ми чекали, значення могло з'явитися
+        value = get(namespace, key, _MISSING)
+        if value is not _MISSING:
+            return value
+
+        value = creator()
+        if should_cache is None or should_cache(value):
+            set(namespace, key, value, ttl=ttl)
+        return value
+    finally:
+        if lock_file is not None:
+            lock_file.close()  # закриття файлу знімає flock
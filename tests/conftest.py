@@ -0,0 +1,137 @@
+"""Спільні фікстури тестів.
+
+Додаток працює з тимчасовою SQLite БД (файл, як у продакшені - з WAL та
+кількома з'єднаннями), окремим SHARED_STATE_DIR та без фонових потоків.
+Змінні середовища задаються до імпорту config.py; процеси, які запускають
+тести (spawn), успадковують їх і працюють з тією самою БД.
+"""
+import os
+import sys
+import tempfile
+from contextlib import contextmanager
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TMP_DIR = os.environ.get('SHOP_TESTS_DIR') or tempfile.mkdtemp(prefix='shop-tests-')
+
+os.environ['SHOP_TESTS_DIR'] = TMP_DIR
+
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(TMP_DIR, 'shop.db')
+os.environ['SHARED_STATE_DIR'] = os.path.join(TMP_DIR, 'state')
+os.environ['IMAGE_PROCESSING_IN_APP'] = 'false'
+os.environ['OUTBOX_DISPATCHER_IN_APP'] = 'false'
+os.environ['TELEGRAM_ENABLED'] = 'false'
+sys.path.insert(0, ROOT)
+# static/uploads (шлях відносно поточної директорії) - у тимчасовій директорії
+os.chdir(TMP_DIR)
+
+
+@pytest.fixture(scope='session')
+def app():
+    from app import app as flask_app
+    flask_app.config.update(TESTING=True, WTF_CSRF_ENABLED=False)
+    return flask_app
+
+
+@pytest.fixture(autouse=True)
+def clean_db(app):
+    """Порожні таблиці (крім адміністратора) та скинуті кеші перед кожним тестом"""
+    from models import db, User
+    from catalog_cache import invalidate_catalog
+    from category_tree import invalidate_category_tree
+    from report_cache import invalidate_reports
+
+    with app.app_context():
+        for table in reversed(db.metadata.sorted_tables):
+            if table.name != 'users':
+                db.session.execute(table.delete())
+        db.session.execute(User.__table__.delete().where(User.username != 'admin'))
+        db.session.commit()
+        invalidate_catalog()
+        invalidate_category_tree()
+        invalidate_reports()
+    yield
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+def login(client, username, password='password'):
+    response = client.post('/login', data={'username': username, 'password': password})
+    assert response.status_code == 302, 'вхід не вдався'
+    return client
+
+
+@pytest.fixture
+def admin_client(app):
+    return login(app.test_client(), 'admin', 'admin123')
+
+
+@pytest.fixture
+def make_user(app):
+    """Створює користувача з паролем 'password'; повертає його id"""
+    from models import db, User
+
+    def make(username):
+        with app.app_context():
+            user = User(username=username, email=f'{username}@example.com')
+            user.set_password('password')
+            db.session.add(user)
+            db.session.commit()
+            return user.id
+    return make
+
+
+@pytest.fixture
+def make_products(app):
+    """Створює count активних товарів (із зображеннями) у підкатегорії; повертає їх id"""
+    from models import db, Category, Product, ProductImage
+
+    def make(count, images=2, category_name='Категорія'):
+        with app.app_context():
+            category = Category.query.filter_by(name=category_name).first()
+            if category is None:
+                parent = Category(name=f'{category_name} (розділ)')
+                db.session.add(parent)
+                db.session.flush()
+                category = Category(name=category_name, parent_id=parent.id)
+                db.session.add(category)
+                db.session.flush()
+            ids = []
+            for i in range(count):
+                product = Product(name=f'Товар {i}', description='Опис', category_id=category.id, is_active=True)
+                db.session.add(product)
+                db.session.flush()
+                for j in range(images):
+                    db.session.add(ProductImage(product_id=product.id, image_url=f'https://example.com/{product.id}-{j}.jpg',
+                                                is_primary=j == 0, display_order=j))
+                ids.append(product.id)
+            db.session.commit()
+            return ids
+    return make
+
+
+@pytest.fixture
+def count_queries(app):
+    """Контекстний менеджер: список SQL інструкцій, виконаних усередині блоку"""
+    from sqlalchemy import event
+    from models import db
+
+    @contextmanager
+    def counter():
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        with app.app_context():
+            engine = db.engine
+        event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            yield statements
+        finally:
+            event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+    return counter
@@ -0,0 +1,89 @@
+"""Паралельні додавання в кошик з кількох процесів (файлова SQLite, як у Gunicorn)"""
+import multiprocessing
+
+from conftest import login
+
+PROCESSES = 4
+REQUESTS = 20
+
+
+def _client(username):
+    from app import app
+    app.config.update(TESTING=True, WTF_CSRF_ENABLED=False)
+    return login(app.test_client(), username)
+
+
+def _add_many(barrier, product_id):
+    """Процес-"воркер": REQUESTS додавань по одному через обидва маршрути"""
+    client = _client('buyer')
+    barrier.wait(timeout=60)
+    statuses = []
+    for i in range(REQUESTS):
+        if i % 2:
+            response = client.post(f'/api/cart/add/{product_id}', json={'quantity': 1})
+        else:
+            response = client.post(f'/cart/add/{product_id}', data={'quantity': 1})
+        statuses.append(response.status_code)
+    return statuses
+
+
+def _add_with_key(barrier, product_id):
+    """Процес-"воркер": той самий запит з тим самим Idempotency-Key, що й у решти"""
+    client = _client('buyer')
+    barrier.wait(timeout=60)
+    response = client.post(f'/api/cart/add/{product_id}', json={'quantity': 3},
+                           headers={'Idempotency-Key': 'double-click'})
+    return response.status_code, response.headers.get('Idempotent-Replayed') == 'true'
+
+
+def _worker(target, barrier, results, *args):
+    try:
+        results.put(target(barrier, *args))
+    except Exception as e:
+        # Помилка в процесі - провал тесту, а не очікування результату
+        results.put(e)
+
+
+def _run_processes(target, *args):
+    """Запускає PROCESSES процесів одночасно (spawn, окремі з'єднання з БД); повертає їх результати"""
+    context = multiprocessing.get_context('spawn')
+    barrier = context.Barrier(PROCESSES)
+    results = context.Queue()
+    processes = [context.Process(target=_worker, args=(target, barrier, results) + args) for _ in range(PROCESSES)]
+    for process in processes:
+        process.start()
+    collected = [results.get(timeout=120) for _ in processes]
+    for process in processes:
+        process.join(timeout=30)
+        assert process.exitcode == 0
+    errors = [result for result in collected if isinstance(result, Exception)]
+    assert not errors, errors
+    return collected
+
+
+def _cart_rows(app, user_id):
+    from models import CartItem
+    with app.app_context():
+        return [(item.product_id, item.quantity) for item in CartItem.query.filter_by(user_id=user_id)]
+
+
+def test_parallel_adds_keep_one_row_and_every_increment(app, make_user, make_products):
+    user_id = make_user('buyer')
+    product_id = make_products(1)[0]
+
+    statuses = [status for statuses in _run_processes(_add_many, product_id) for status in statuses]
+
+    assert set(statuses) <= {200, 302}
+    assert _cart_rows(app, user_id) == [(product_id, PROCESSES * REQUESTS)]
+
+
+def test_parallel_replays_of_one_idempotency_key_add_once(app, make_user, make_products):
+    user_id = make_user('buyer')
+    product_id = make_products(1)[0]
+
+    responses = _run_processes(_add_with_key, product_id)
+
+    assert [status for status, _ in responses] == [200] * PROCESSES
+    # Виконався один запит, решта отримали його збережену відповідь
+    assert sorted(replayed for _, replayed in responses) == [False] + [True] * (PROCESSES - 1)
+    assert _cart_rows(app, user_id) == [(product_id, 3)]
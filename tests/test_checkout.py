@@ -0,0 +1,74 @@
+"""Checkout: кількість запитів не залежить від розміру кошика, час росте значно повільніше"""
+import statistics
+import time
+
+import pytest
+
+from conftest import login
+
+CART_SIZES = (1, 50, 500)
+
+# Медіана часу checkout кошика з 500 рядків - не більше ніж у стільки разів
+# довша, ніж кошика з 1 рядка (для порівняння: по одному INSERT/DELETE на
+# рядок з лінивим завантаженням товарів - у десятки разів)
+MAX_LATENCY_RATIO = 10
+
+
+def _checkout(app, client, count_queries, user_id, product_ids):
+    from sqlalchemy import insert
+    from models import db, CartItem
+    with app.app_context():
+        db.session.execute(insert(CartItem), [
+            {'user_id': user_id, 'product_id': product_id, 'quantity': 2} for product_id in product_ids
+        ])
+        db.session.commit()
+    with count_queries() as statements:
+        started = time.perf_counter()
+        response = client.post('/cart/checkout')
+        elapsed = time.perf_counter() - started
+    assert response.status_code == 302
+    return len(statements), elapsed
+
+
+@pytest.mark.parametrize('size', CART_SIZES)
+def test_checkout_creates_order_from_whole_cart(app, client, make_user, make_products, count_queries, size):
+    from models import CartItem, Order, OutboxMessage
+    user_id = make_user('buyer')
+    login(client, 'buyer')
+    product_ids = make_products(size, images=0)
+
+    _checkout(app, client, count_queries, user_id, product_ids)
+
+    with app.app_context():
+        order = Order.query.filter_by(user_id=user_id).one()
+        assert sorted((item.product_id, item.quantity) for item in order.items) == [(pid, 2) for pid in product_ids]
+        assert CartItem.query.filter_by(user_id=user_id).count() == 0
+        message = OutboxMessage.query.filter_by(channel='telegram').one()
+        assert f'{size * 2} шт.' in message.payload
+
+
+def test_checkout_query_count_is_flat(app, client, make_user, make_products, count_queries):
+    user_id = make_user('buyer')
+    login(client, 'buyer')
+    product_ids = make_products(max(CART_SIZES), images=0)
+    # Дерево категорій кешується на версію, а не на запит
+    _checkout(app, client, count_queries, user_id, product_ids[:1])
+
+    counts = {size: _checkout(app, client, count_queries, user_id, product_ids[:size])[0] for size in CART_SIZES}
+    assert len(set(counts.values())) == 1, counts
+
+
+
+def test_checkout_latency_stays_flat(app, client, make_user, make_products, count_queries):
+    user_id = make_user('buyer')
+    login(client, 'buyer')
+    product_ids = make_products(max(CART_SIZES), images=0)
+    _checkout(app, client, count_queries, user_id, product_ids[:1])
+
+    latency = {}
+    for size in CART_SIZES:
+        runs = [_checkout(app, client, count_queries, user_id, product_ids[:size])[1] for _ in range(5)]
+        latency[size] = statistics.median(runs)
+    report = ', '.join(f'{size}: {seconds * 1000:.1f} мс' for size, seconds in latency.items())
+    print(f'\nМедіана checkout за розміром кошика - {report}')
+    assert latency[max(CART_SIZES)] < latency[min(CART_SIZES)] * MAX_LATENCY_RATIO, report
@@ -0,0 +1,25 @@
+"""Умовні запити: 304 лише поки сторінка справді не змінилась"""
+import time
+
+
+def test_product_page_modified_by_image_processing(app, client, make_products):
+    from sqlalchemy import update
+    from models import db, ProductImage
+    product_id = make_products(1)[0]
+
+    response = client.get(f'/product/{product_id}')
+    last_modified = response.headers['Last-Modified']
+    response = client.get(f'/product/{product_id}', headers={'If-Modified-Since': last_modified})
+    assert response.status_code == 304
+
+    # Last-Modified має точність до секунди
+    time.sleep(1.1)
+    # Як image_queue.process_pending: пакетне оновлення без власних міток часу
+    with app.app_context():
+        db.session.execute(update(ProductImage).where(ProductImage.product_id == product_id)
+                           .values(processing_state='ready'))
+        db.session.commit()
+
+    response = client.get(f'/product/{product_id}', headers={'If-Modified-Since': last_modified})
+    assert response.status_code == 200
+    assert response.headers['Last-Modified'] != last_modified
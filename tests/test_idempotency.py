@@ -0,0 +1,68 @@
+"""Idempotency-Key: HTML форми отримують перенаправлення з повідомленням, API - JSON"""
+from conftest import login
+
+
+def _flashes(client):
+    with client.session_transaction() as session:
+        return session.get('_flashes', [])
+
+
+def _quantity(app, product_id):
+    from models import CartItem
+    with app.app_context():
+        return sum(item.quantity for item in CartItem.query.filter_by(product_id=product_id))
+
+
+def test_form_replay_redirects_with_message(app, client, make_user, make_products):
+    make_user('buyer')
+    login(client, 'buyer')
+    product_id = make_products(1)[0]
+    url = f'/cart/add/{product_id}'
+    referrer = f'http://localhost/product/{product_id}'
+
+    response = client.post(url, data={'quantity': 1, 'idempotency_key': 'k1'}, headers={'Referer': referrer})
+    assert response.status_code == 302
+    client.get('/cart')  # показує і прибирає перше повідомлення
+
+    # Та сама форма ще раз (сторінка з кешу "Назад"): не виконується, але користувач про це знає
+    response = client.post(url, data={'quantity': 1, 'idempotency_key': 'k1'}, headers={'Referer': referrer})
+    assert response.status_code == 302
+    assert response.headers['Location'].endswith('/cart')
+    assert response.headers['Idempotent-Replayed'] == 'true'
+    assert [category for category, _ in _flashes(client)] == ['info']
+    assert _quantity(app, product_id) == 1
+
+
+def test_form_key_reused_with_other_data(app, client, make_user, make_products):
+    make_user('buyer')
+    login(client, 'buyer')
+    product_id = make_products(1)[0]
+    url = f'/cart/add/{product_id}'
+    referrer = f'http://localhost/product/{product_id}'
+
+    client.post(url, data={'quantity': 1, 'idempotency_key': 'k1'}, headers={'Referer': referrer})
+    client.get('/cart')
+
+    response = client.post(url, data={'quantity': 2, 'idempotency_key': 'k1'}, headers={'Referer': referrer})
+    assert response.status_code == 302
+    assert response.headers['Location'] == referrer
+    assert not response.is_json
+    assert [category for category, _ in _flashes(client)] == ['error']
+    assert _quantity(app, product_id) == 1
+
+
+def test_api_key_reused_with_other_data(app, client, make_user, make_products):
+    make_user('buyer')
+    login(client, 'buyer')
+    product_id = make_products(1)[0]
+    url = f'/api/cart/add/{product_id}'
+
+    response = client.post(url, json={'quantity': 1}, headers={'Idempotency-Key': 'k1'})
+    assert response.status_code == 200
+    response = client.post(url, json={'quantity': 1}, headers={'Idempotency-Key': 'k1'})
+    assert response.headers['Idempotent-Replayed'] == 'true'
+
+    response = client.post(url, json={'quantity': 2}, headers={'Idempotency-Key': 'k1'})
+    assert response.status_code == 422
+    assert response.is_json
+    assert _quantity(app, product_id) == 1
@@ -0,0 +1,141 @@
+"""Фонова обробка завантажень: файли з адресацією за вмістом не змінюються"""
+import hashlib
+import io
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from PIL import Image
+
+
+def _jpeg(size, color=(200, 30, 30)):
+    buffer = io.BytesIO()
+    Image.new('RGB', size, color).save(buffer, 'JPEG', quality=95)
+    buffer.seek(0)
+    return buffer
+
+
+def _content_matches_name(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest() == os.path.splitext(os.path.basename(path))[0]
+
+
+def _add_product(admin_client, name, files):
+    return admin_client.post('/admin/products/add', data={
+        'name': name, 'description': 'Опис', 'category_id': '0', 'is_active': 'y', 'image_files': files,
+    }, content_type='multipart/form-data')
+
+
+def _process(app):
+    from image_queue import process_pending
+    with app.app_context(), ThreadPoolExecutor(2) as pool:
+        while process_pending(pool):
+            pass
+
+
+@pytest.fixture(autouse=True)
+def _no_worker_wakeups(monkeypatch):
+    import image_queue
+    monkeypatch.setattr(image_queue, 'notify_image_worker', lambda: None)
+
+
+def test_processed_original_is_a_new_file(app, admin_client):
+    from models import Product, OutboxMessage
+    from image_queue import STATE_PENDING, STATE_READY
+    from upload_storage import IMMUTABLE_URL_RE
+
+    _add_product(admin_client, 'Велике фото', [(_jpeg((3000, 2000)), 'photo.jpg')])
+    with app.app_context():
+        product = Product.query.filter_by(name='Велике фото').one()
+        image = product.images[0]
+        raw_url = image.image_url
+        assert image.processing_state == STATE_PENDING
+        assert product.image_url == raw_url
+    raw_path = raw_url[1:]
+    with open(raw_path, 'rb') as f:
+        raw_bytes = f.read()
+
+    _process(app)
+
+    with app.app_context():
+        product = Product.query.filter_by(name='Велике фото').one()
+        image = product.images[0]
+        assert image.processing_state == STATE_READY
+        assert image.image_url != raw_url
+        assert product.image_url == image.image_url
+        assert (image.width, image.height) == (2560, 1707)
+        queued = {message.payload for message in OutboxMessage.query.filter_by(channel='delete_file')}
+        variant_urls = [url for entries in image.variants.values() for _, url in entries]
+    # Завантажений файл не змінено, оброблений - окремий файл під своїм хешем
+    with open(raw_path, 'rb') as f:
+        assert f.read() == raw_bytes
+    assert _content_matches_name(image.image_url[1:])
+    assert IMMUTABLE_URL_RE.match(image.image_url)
+    stem = os.path.splitext(os.path.basename(image.image_url))[0]
+    assert all(os.path.basename(url).startswith(stem + '-') and os.path.exists(url[1:]) for url in variant_urls)
+    assert queued == {raw_path}
+
+
+def test_duplicate_upload_after_processing_reuses_processed_file(app, admin_client):
+    from models import ProductImage
+
+    _add_product(admin_client, 'Перший', [(_jpeg((1200, 800)), 'a.jpg')])
+    _process(app)
+    _add_product(admin_client, 'Другий', [(_jpeg((1200, 800)), 'b.jpg')])
+    _process(app)
+
+    with app.app_context():
+        urls = {image.image_url for image in ProductImage.query}
+    assert len(urls) == 1
+    assert _content_matches_name(urls.pop()[1:])
+
+
+def test_rejected_file_is_skipped_and_product_saved(app, admin_client, monkeypatch):
+    from config import Config
+    from models import Product
+    monkeypatch.setattr(Config, 'UPLOAD_MAX_FILE_SIZE', 200 * 1024)
+    noise = io.BytesIO()
+    Image.effect_noise((600, 600), 80).convert('RGB').save(noise, 'PNG')
+    noise.seek(0)
+
+    response = _add_product(admin_client, 'Частково', [
+        (io.BytesIO(b'not an image'), 'fake.jpg'),
+        (noise, 'huge.png'),
+        (_jpeg((400, 300)), 'good.jpg'),
+    ])
+
+    assert response.status_code == 302
+    with admin_client.session_transaction() as session:
+        messages = [message for _, message in session['_flashes']]
+    assert any('fake.jpg' in message for message in messages)
+    assert any('huge.png' in message for message in messages)
+    with app.app_context():
+        product = Product.query.filter_by(name='Частково').one()
+        assert len(product.images) == 1
+        assert product.image_url == product.images[0].image_url
+
+
+def test_backfill_covers_legacy_image_url(app):
+    from models import db, Product
+    from images import backfill_variants
+    folder = os.path.join('static', 'uploads', 'products')
+    os.makedirs(folder, exist_ok=True)
+    with open(os.path.join(folder, 'legacy.jpg'), 'wb') as f:
+        f.write(_jpeg((1200, 800)).getvalue())
+
+    with app.app_context():
+        db.session.add(Product(name='Старий товар', description='Опис', is_active=True,
+                               image_url='/static/uploads/products/legacy.jpg'))
+        db.session.add(Product(name='Зовнішнє фото', description='Опис', is_active=True,
+                               image_url='https://example.com/photo.jpg'))
+        db.session.commit()
+
+        processed, failed = backfill_variants(workers=1, echo=lambda message: None)
+        assert (processed, failed) == (1, 0)
+        legacy = Product.query.filter_by(name='Старий товар').one()
+        assert [image.image_url for image in legacy.images] == [legacy.image_url]
+        assert legacy.images[0].is_primary and legacy.images[0].variants
+        assert Product.query.filter_by(name='Зовнішнє фото').one().images == []
+
+        # Повторний запуск нічого не додає
+        assert backfill_variants(workers=1, echo=lambda message: None) == (0, 0)
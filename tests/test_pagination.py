@@ -0,0 +1,118 @@
+"""Keyset пагінація: повний обхід у правильному порядку, вартість сторінки не залежить від глибини"""
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+import pytest
+
+
+def _fill(app, count, inactive_every=0):
+    """count товарів з різними created_at та назвами; кожен inactive_every-й - неактивний"""
+    from sqlalchemy import insert
+    from models import db, Product
+    start = datetime(2024, 1, 1)
+    with app.app_context():
+        db.session.execute(insert(Product), [
+            {'name': f'Товар {(i * 7919) % count:06d}', 'description': 'Опис',
+             'is_active': not (inactive_every and i % inactive_every == 0),
+             'created_at': start + timedelta(minutes=i)}
+            for i in range(count)
+        ])
+        db.session.commit()
+
+
+def _keys(sort_by):
+    from models import Product
+    if sort_by == 'name_asc':
+        return [(Product.is_active, True), (Product.name, False), (Product.id, False)]
+    return [(Product.is_active, True), (Product.created_at, True), (Product.id, True)]
+
+
+def _expected(app, sort_by):
+    from models import Product
+    with app.app_context():
+        products = Product.query.all()
+        if sort_by == 'name_asc':
+            products.sort(key=lambda p: (not p.is_active, p.name, p.id))
+        else:
+            products.sort(key=lambda p: (not p.is_active, -p.created_at.timestamp(), -p.id))
+        return [p.id for p in products]
+
+
+@contextmanager
+def _vm_steps():
+    """Кількість інструкцій віртуальної машини SQLite у з'єднанні сесії"""
+    from models import db
+    connection = db.session.connection().connection.dbapi_connection
+    steps = [0]
+
+    def count():
+        steps[0] += 1
+
+    connection.set_progress_handler(count, 1)
+    try:
+        yield steps
+    finally:
+        connection.set_progress_handler(None, 1)
+
+
+@pytest.mark.parametrize('sort_by', ['newest', 'name_asc'])
+def test_walk_all_pages(app, sort_by):
+    from models import Product
+    from pagination import keyset_paginate
+    _fill(app, 120, inactive_every=5)
+    expected = _expected(app, sort_by)
+    keys = _keys(sort_by)
+
+    with app.app_context():
+        seen, cursors, cursor = [], [], None
+        while True:
+            page = keyset_paginate(Product.query, keys, cursor=cursor, per_page=25)
+            seen += [p.id for p in page.items]
+            cursors.append(page.prev_cursor)
+            if not page.has_next:
+                break
+            cursor = page.next_cursor
+        assert seen == expected
+
+        # Назад з останньої сторінки - попередня сторінка
+        page = keyset_paginate(Product.query, keys, cursor=cursors[-1], per_page=25)
+        assert [p.id for p in page.items] == expected[75:100]
+
+
+@pytest.mark.parametrize('sort_by', ['newest', 'name_asc'])
+def test_deep_cursor_costs_like_shallow(app, sort_by):
+    from models import db, Product
+    from pagination import keyset_paginate, encode_cursor
+    _fill(app, 5000)
+    keys = _keys(sort_by)
+    expected = _expected(app, sort_by)
+
+    def steps_at(depth):
+        with app.app_context():
+            product = db.session.get(Product, expected[depth])
+            values = [product.is_active, product.name if sort_by == 'name_asc' else product.created_at, product.id]
+            with _vm_steps() as steps:
+                page = keyset_paginate(Product.query, keys, cursor=encode_cursor('next', values), per_page=25)
+            assert [p.id for p in page.items] == expected[depth + 1:depth + 26]
+            return steps[0]
+
+    shallow = steps_at(10)
+    deep = steps_at(4900)
+    assert deep < shallow * 2, (shallow, deep)
+
+
+def test_catalog_total_count_is_cached(app, client, count_queries):
+    import shared_cache
+    from catalog_cache import CARDS_NAMESPACE
+    _fill(app, 40)
+    response = client.get('/')
+    assert 'Знайдено товарів: 40' in response.get_data(as_text=True)
+
+    # Наступна сторінка того ж фільтра не рахує товари повторно
+    cursor = response.get_data(as_text=True).split('cursor=', 1)[1].split('&', 1)[0].split('"', 1)[0]
+    shared_cache.clear(CARDS_NAMESPACE)
+    with count_queries() as statements:
+        response = client.get(f'/?cursor={cursor}')
+    assert 'Знайдено товарів: 40' in response.get_data(as_text=True)
+    assert 'Попередня' in response.get_data(as_text=True)
+    assert not any('count(' in statement.lower() for statement in statements)
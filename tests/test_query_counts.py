@@ -0,0 +1,117 @@
+"""Кількість SQL запитів на сторінку не залежить від кількості рядків"""
+from conftest import login
+
+
+def _queries(count_queries, client, url, reset=None):
+    """Кількість запитів на повторний запит сторінки без кешу карток.
+
+    Перший запит прогріває кеш дерева категорій (один запит на версію, не
+    на сторінку); кеш відрендерених карток скидається, щоб картки
+    рендерились з даних сторінки, а не з кешу.
+    """
+    import shared_cache
+    from catalog_cache import CARDS_NAMESPACE, PAGES_NAMESPACE
+    client.get(url)
+    shared_cache.clear(CARDS_NAMESPACE)
+    shared_cache.clear(PAGES_NAMESPACE)
+    if reset is not None:
+        reset()
+    with count_queries() as statements:
+        response = client.get(url)
+    assert response.status_code == 200
+    return len(statements)
+
+
+def test_catalog_page(client, make_user, make_products, count_queries):
+    make_user('buyer')
+    login(client, 'buyer')
+    make_products(2)
+    few = _queries(count_queries, client, '/')
+    make_products(23)
+    many = _queries(count_queries, client, '/')
+    assert many == few
+
+
+def test_admin_products_page(admin_client, make_products, count_queries):
+    make_products(2)
+    few = _queries(count_queries, admin_client, '/admin/products')
+    make_products(30)
+    many = _queries(count_queries, admin_client, '/admin/products')
+    assert many == few
+
+
+def test_cart_page(app, client, make_user, make_products, count_queries):
+    from models import db, CartItem
+    user_id = make_user('buyer')
+    login(client, 'buyer')
+
+    def fill_cart(product_ids):
+        with app.app_context():
+            for product_id in product_ids:
+                db.session.add(CartItem(user_id=user_id, product_id=product_id, quantity=1))
+            db.session.commit()
+
+    fill_cart(make_products(2))
+    few = _queries(count_queries, client, '/cart')
+    fill_cart(make_products(30))
+    many = _queries(count_queries, client, '/cart')
+    assert many == few
+
+
+def test_admin_dashboard(app, admin_client, make_user, make_products, count_queries):
+    from datetime import datetime, timedelta
+    from models import db, Order, OrderItem
+    from order_stats import record_new_order
+    from report_cache import invalidate_reports
+    user_id = make_user('buyer')
+    product_ids = make_products(10, images=0)
+
+    def add_orders(count):
+        with app.app_context():
+            for i in range(count):
+                created_at = datetime.utcnow() - timedelta(days=i % 30)
+                status = ('pending', 'processing', 'completed', 'cancelled')[i % 4]
+                order = Order(user_id=user_id, status=status, created_at=created_at)
+                db.session.add(order)
+                db.session.flush()
+                lines = [(product_ids[(i + j) % len(product_ids)], j + 1) for j in range(3)]
+                db.session.add_all(OrderItem(order_id=order.id, product_id=product_id, quantity=quantity)
+                                   for product_id, quantity in lines)
+                record_new_order(created_at, status, lines)
+            db.session.commit()
+
+    def dashboard_queries():
+        # Статистика кешується між запитами - рахуємо саме її перерахунок
+        return _queries(count_queries, admin_client, '/admin/', reset=invalidate_reports)
+
+    add_orders(4)
+    few = dashboard_queries()
+    add_orders(120)
+    many = dashboard_queries()
+    assert many == few
+    assert many <= 10
+
+
+def test_admin_user_orders_page(app, admin_client, make_user, make_products, count_queries):
+    from datetime import datetime, timedelta
+    from models import db, Order, OrderItem
+    user_id = make_user('buyer')
+    product_ids = make_products(10, images=0)
+
+    def add_orders(count):
+        with app.app_context():
+            for i in range(count):
+                order = Order(user_id=user_id, status='pending', created_at=datetime.utcnow() - timedelta(minutes=i))
+                db.session.add(order)
+                db.session.flush()
+                db.session.add_all(OrderItem(order_id=order.id, product_id=product_ids[(i + j) % len(product_ids)],
+                                             quantity=1) for j in range(3))
+            db.session.commit()
+
+    url = f'/admin/users/{user_id}/orders'
+    add_orders(2)
+    few = _queries(count_queries, admin_client, url)
+    add_orders(40)
+    many = _queries(count_queries, admin_client, url)
+    assert many == few
+    assert 'Товар 0' in admin_client.get(url).get_data(as_text=True)
@@ -0,0 +1,65 @@
+"""shared_cache.get_or_set: вкладені виклики та одночасні промахи"""
+import re
+import threading
+import time
+
+import shared_cache
+
+
+def _run_with_timeout(target, timeout=20):
+    """Виконує target у потоці; самоблокування - провал тесту, а не зависання"""
+    result = {}
+
+    def run():
+        result['value'] = target()
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), 'get_or_set заблокувався'
+    return result['value']
+
+
+def test_nested_get_or_set_does_not_deadlock():
+    def outer():
+        # Як сторінка каталогу, що рендерить кешовані картки
+        return [shared_cache.get_or_set('test_cards', f'card:{i}', lambda i=i: i) for i in range(300)]
+
+    assert _run_with_timeout(lambda: shared_cache.get_or_set('test_pages', 'page', outer)) == list(range(300))
+
+
+def test_concurrent_misses_compute_once():
+    calls = []
+
+    def slow():
+        calls.append(1)
+        time.sleep(0.3)
+        return 'value'
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(shared_cache.get_or_set('test_misses', 'key', slow)))
+               for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == ['value'] * 8
+    assert len(calls) == 1
+
+
+def test_cached_catalog_pages_with_many_cards(client, make_products):
+    # Більше карток, ніж було спільних блокувань у пам'яті (64)
+    make_products(80)
+
+    def walk_catalog():
+        seen, url = set(), '/'
+        while url:
+            response = client.get(url)
+            assert response.status_code == 200
+            body = response.get_data(as_text=True)
+            seen.update(re.findall(r'href="/product/(\d+)"', body))
+            next_link = re.search(r'<a href="([^"]*)"[^>]*>\s*<span[^>]*>Наступна', body)
+            url = next_link.group(1).replace('&amp;', '&') if next_link else None
+        return len(seen)
+
+    assert _run_with_timeout(walk_catalog) == 80
@@ -0,0 +1,100 @@
+"""Видалення файлів завантажень: черга диспетчера та збирач файлів без посилань"""
+import io
+import os
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+import upload_storage
+
+
+def _age(path, seconds):
+    moment = time.time() - seconds
+    os.utime(path, (moment, moment))
+
+
+def _run_due_deletions(app):
+    from models import db, OutboxMessage
+    from upload_storage import delete_files_once
+    with app.app_context():
+        OutboxMessage.query.filter_by(channel='delete_file', status='pending').update(
+            {'next_attempt_at': datetime.utcnow() - timedelta(seconds=1)})
+        db.session.commit()
+        while delete_files_once():
+            pass
+
+
+def _enqueue(app, path):
+    from models import db
+    from upload_storage import enqueue_file_deletions
+    with app.app_context():
+        enqueue_file_deletions([path])
+        db.session.commit()
+
+
+def test_unreferenced_file_is_deleted_after_delay(app):
+    path = upload_storage.store_stream(io.BytesIO(b'unused'), 'jpg')
+    _age(path, 60)
+    _enqueue(app, path)
+
+    _run_due_deletions(app)
+
+    assert not os.path.exists(path)
+
+
+def test_file_reused_after_queueing_is_not_deleted(app):
+    path = upload_storage.store_stream(io.BytesIO(b'reused'), 'jpg')
+    _age(path, 60)
+    _enqueue(app, path)
+    # Той самий вміст завантажили знову; запис з посиланням ще не збережено
+    assert upload_storage.store_stream(io.BytesIO(b'reused'), 'jpg') == path
+
+    _run_due_deletions(app)
+
+    assert os.path.exists(path)
+
+
+def test_collect_orphans_queues_only_old_unreferenced_files(app, make_products):
+    from models import db, ProductImage
+    orphan = upload_storage.store_stream(io.BytesIO(b'orphan'), 'jpg')
+    recent = upload_storage.store_stream(io.BytesIO(b'recent'), 'jpg')
+    used = upload_storage.store_stream(io.BytesIO(b'used'), 'jpg')
+    product_id = make_products(1, images=0)[0]
+    with app.app_context():
+        db.session.add(ProductImage(product_id=product_id, image_url='/' + used))
+        db.session.commit()
+    _age(orphan, 2 * 86400)
+    _age(used, 2 * 86400)
+
+    with app.app_context():
+        count, _ = upload_storage.collect_orphans(grace=86400)
+    _run_due_deletions(app)
+
+    assert count == 1
+    assert not os.path.exists(orphan)
+    assert os.path.exists(recent) and os.path.exists(used)
+
+
+@pytest.fixture
+def gc_calls(monkeypatch, tmp_path):
+    from config import Config
+    monkeypatch.setattr(Config, 'SHARED_STATE_DIR', str(tmp_path))
+    calls = []
+    monkeypatch.setattr(upload_storage, 'collect_orphans', lambda: calls.append(1) or (0, 0))
+    return calls
+
+
+def test_gc_interval_is_shared_between_processes(gc_calls, tmp_path):
+    from config import Config
+    stamp = tmp_path / 'upload_gc.last'
+    # Інший процес диспетчера щойно запускав збирач
+    stamp.write_text(str(time.time() - 60))
+    upload_storage.cleanup_orphaned_uploads()
+    assert gc_calls == []
+
+    stamp.write_text(str(time.time() - Config.UPLOAD_GC_INTERVAL - 1))
+    upload_storage.cleanup_orphaned_uploads()
+    upload_storage.cleanup_orphaned_uploads()
+    assert len(gc_calls) == 1
+    assert time.time() - float(stamp.read_text()) < 60
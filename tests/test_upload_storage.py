@@ -0,0 +1,28 @@
+"""Сховище з адресацією за вмістом: файли за хеш-шляхом записуються один раз"""
+import io
+import os
+
+from upload_storage import IMMUTABLE_URL_RE, store_stream, write_once
+
+
+def test_same_content_is_stored_once_and_never_rewritten():
+    first = store_stream(io.BytesIO(b'content'), 'jpg', 'test')
+    inode = os.stat(first).st_ino
+    second = store_stream(io.BytesIO(b'content'), 'jpg', 'test')
+
+    assert second == first
+    assert os.stat(first).st_ino == inode
+    assert IMMUTABLE_URL_RE.match('/' + first)
+    assert store_stream(io.BytesIO(b'other'), 'jpg', 'test') != first
+
+
+def test_write_once_keeps_existing_file(tmp_path):
+    path = str(tmp_path / 'file')
+    for content in (b'first', b'second'):
+        tmp = str(tmp_path / 'tmp')
+        with open(tmp, 'wb') as f:
+            f.write(content)
+        write_once(tmp, path)
+        assert not os.path.exists(tmp)
+    with open(path, 'rb') as f:
+        assert f.read() == b'first'
@@ -0,0 +1,342 @@
+"""Сховище завантажених файлів з адресацією за вмістом.
+
+Файл зберігається під іменем SHA-256 свого вмісту з розбиттям на
+підкаталоги: static/uploads/products/ab/cd/abcd....jpg. Однакові
+завантаження (той самий файл для кількох товарів) зберігаються один раз,
+імена не конфліктують, а вміст за URL не змінюється - тому такі URL
+віддаються з довгим immutable кешем (IMMUTABLE_URL_RE).
+
+Головне правило: файл з адресацією за вмістом (оригінал чи похідна)
+записується один раз, атомарно і вже остаточним (write_once), і більше
+ніколи не змінюється. Будь-яка обробка (зменшення, оптимізація) дає новий
+файл з новим хешем, а не перезаписує наявний.
+
+Посилання на файл - це рядки Product.image_url та ProductImage.image_url
+з його URL; кількість посилань рахується запитом (is_referenced) в момент
+видалення. Видалення файлів іде лише через чергу outbox (канал
+'delete_file': enqueue_file_deletions ставить файли в чергу разом з
+поточною транзакцією, delete_files_once виконує диспетчер notifications.py)
+із затримкою Config.UPLOAD_DELETE_DELAY: за цей час завершуються запити,
+які вже повторно використали файл, але ще не зберегли свій запис.
+
+Файли, на які не посилається жоден запис (завантаження з транзакцій, що
+завершилися помилкою, залишки тимчасових файлів, похідні без оригіналу),
+знаходить collect_orphans() - `flask gc-uploads` або диспетчер раз на
+Config.UPLOAD_GC_INTERVAL - і ставить у ту саму чергу видалення.
+"""
+import glob
+import hashlib
+import os
+import re
+import tempfile
+import time
+from datetime import datetime, timedelta
+from config import Config
+
+CHUNK_SIZE = 64 * 1024
+
+# Канал черги outbox (OutboxMessage), через який диспетчер видаляє файли
+CHANNEL_DELETE_FILE = 'delete_file'
+
+# URL файлів з адресацією за вмістом (для заголовка Cache-Control: immutable)
+IMMUTABLE_URL_RE = re.compile(r'^/static/uploads/[\w-]+/[0-9a-f]{2}/[0-9a-f]{2}/(variants/)?[0-9a-f]{64}[.\w-]*$')
+
+
+def content_path(digest, extension, folder='products'):
+    """Шлях файлу за хешем вмісту: static/uploads/<folder>/ab/cd/<хеш>.<розширення>"""
+    return '/'.join([Config.UPLOAD_FOLDER, folder, digest[:2], digest[2:4], f'{digest}.{extension}'])
+
+
+class UploadTooLarge(ValueError):
+    """Файл більший за дозволений розмір"""
+
+
+def upload_folder(path):
+    """Підкаталог сховища, до якого належить path ('static/uploads/products/...' -> 'products')"""
+    relative = path[len(Config.UPLOAD_FOLDER) + 1:]
+    return relative.split('/', 1)[0] if '/' in relative else 'products'
+
+
+def write_once(tmp_path, path):
+    """Атомарно переносить готовий tmp_path у path, якщо path ще не існує.
+
+    Наявний файл не перезаписується навіть тим самим вмістом (os.link
+    завершується помилкою, якщо path вже є): відданий з immutable кешем
+    вміст не змінюється. Повертає True, якщо файл записано.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    try:
+        os.link(tmp_path, path)
+        return True
+    except FileExistsError:
+        return False
+    finally:
+        os.remove(tmp_path)
+
+
+def store_stream(stream, extension, folder='products', max_size=None, detect_extension=None):
+    """Зберігає потік у сховище; повертає відносний шлях файлу.
+
+    Вміст за один прохід записується в тимчасовий файл з одночасним
+    обчисленням хешу і потім атомарно перейменовується. Якщо записано
+    більше max_size байт - читання зупиняється з UploadTooLarge.
+    detect_extension(тимчасовий_шлях) може перевірити вміст і повернути
+    справжнє розширення (замість extension) або відхилити файл винятком.
+    Якщо такий вміст уже є - тимчасовий файл видаляється, а повертається
+    шлях наявного (файл за хеш-шляхом не перезаписується, див. write_once).
+    """
+    upload_root = os.path.join(Config.UPLOAD_FOLDER, folder)
+    os.makedirs(upload_root, exist_ok=True)
+    digest = hashlib.sha256()
+    size = 0
+    fd, tmp_path = tempfile.mkstemp(dir=upload_root, prefix='.upload-')
+    try:
+        with os.fdopen(fd, 'wb') as tmp:
+            for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+                size += len(chunk)
+                if max_size is not None and size > max_size:
+                    raise UploadTooLarge(f'Файл завеликий, максимум {max_size // (1024 * 1024)} МБ')
+                digest.update(chunk)
+                tmp.write(chunk)
+        if detect_extension is not None:
+            extension = detect_extension(tmp_path)
+        path = content_path(digest.hexdigest(), extension, folder)
+        if not write_once(tmp_path, path):
+            # Повторне використання "оновлює" файл: збирач сиріт (collect_orphans) його не чіпатиме
+            os.utime(path)
+        return path
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def stored_files(path):
+    """Файл та всі його похідні (images.py: variants/<ім'я>-<ширина>.<формат>)"""
+    from images import VARIANTS_DIR
+    folder, filename = os.path.split(path)
+    stem = os.path.splitext(filename)[0]
+    # Лише <ім'я>-<ширина>.<формат>, а не похідні файлу "<ім'я>-щось.jpg"
+    variant_re = re.compile(re.escape(stem) + r'-\d+\.\w+$')
+    variants = glob.glob(os.path.join(glob.escape(folder), VARIANTS_DIR, glob.escape(stem) + '-*'))
+    return [path] + sorted(
+        variant.replace('\\', '/') for variant in variants if variant_re.match(os.path.basename(variant))
+    )
+
+
+def is_referenced(path):
+    """Чи посилається на файл хоч один товар або зображення товару"""
+    from models import db, Product, ProductImage
+    url = '/' + path
+    return db.session.query(
+        db.session.query(ProductImage.id).filter(ProductImage.image_url == url).exists()
+    ).scalar() or db.session.query(
+        db.session.query(Product.id).filter(Product.image_url == url).exists()
+    ).scalar()
+
+
+def enqueue_file_deletions(paths):
+    """Ставить у чергу видалення файлів (шляхи виду 'static/uploads/...') разом з поточною транзакцією.
+
+    Разом з файлом видаляються його похідні (images.py).
+    """
+    from sqlalchemy import insert
+    from models import db, OutboxMessage
+    if paths:
+        delete_after = datetime.utcnow() + timedelta(seconds=Config.UPLOAD_DELETE_DELAY)
+        # Один executemany замість INSERT на кожен файл
+        db.session.execute(insert(OutboxMessage), [
+            {'channel': CHANNEL_DELETE_FILE, 'payload': path, 'next_attempt_at': delete_after}
+            for path in sorted(set(paths))
+        ])
+
+
+def _modified_after(path, moment):
+    """Чи змінювався файл (mtime) пізніше moment (naive UTC)"""
+    try:
+        return datetime.utcfromtimestamp(os.path.getmtime(path)) > moment
+    except OSError:
+        return False
+
+
+def delete_files_once():
+    """Один прохід по черзі видалення файлів (викликає диспетчер); повертає кількість оброблених записів"""
+    from models import db, OutboxMessage
+    from utils import delete_file
+
+    due = OutboxMessage.query.filter(
+        OutboxMessage.channel == CHANNEL_DELETE_FILE,
+        OutboxMessage.status == 'pending',
+        OutboxMessage.next_attempt_at <= datetime.utcnow()
+    ).order_by(OutboxMessage.id).limit(Config.OUTBOX_BATCH_SIZE).all()
+    if not due:
+        return 0
+    sent_at = datetime.utcnow()
+    for message in due:
+        if is_referenced(message.payload):
+            # Файл знову використовується (той самий вміст завантажили для іншого товару)
+            message.status = 'skipped'
+        elif _modified_after(message.payload, message.created_at):
+            # Файл повторно завантажили після постановки в чергу (store_stream оновлює mtime),
+            # а запис, що на нього посилатиметься, ще може бути не збережений. Якщо запису
+            # так і не буде - файл прибере збирач сиріт (collect_orphans) після
+            # Config.UPLOAD_ORPHAN_GRACE від останнього використання
+            message.status = 'skipped'
+        else:
+            # Файлу вже немає - теж успіх: повторне видалення нічого не змінює
+            for path in stored_files(message.payload):
+                delete_file(path)
+            message.status = 'sent'
+        message.sent_at = sent_at
+        message.attempts += 1
+    db.session.commit()
+    return len(due)
+
+
+_VARIANT_NAME_RE = re.compile(r'^(.+)-\d+\.\w+$')
+# Час останнього запуску збирача - спільний для процесів (диспетчер міг перезапуститися
+# або перейти до іншого воркера)
+_GC_STAMP = 'upload_gc.last'
+
+
+def _is_temporary(name):
+    return name.startswith('.upload-') or name.endswith('.tmp')
+
+
+def _scan(folder):
+    """Файли сховища: (шлях, DirEntry, вид), вид - 'original' / 'variant' / 'temp'.
+
+    Каталоги читаються по одному (os.scandir), тому пам'ять не залежить від
+    кількості файлів. Похідні, оригінал яких існує, не повертаються - вони
+    видаляються разом з оригіналом (stored_files).
+    """
+    files, subdirs = [], []
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                subdirs.append(entry.name)
+            elif entry.is_file(follow_symlinks=False):
+                files.append(entry)
+    stems = set()
+    for entry in files:
+        path = folder + '/' + entry.name
+        if _is_temporary(entry.name):
+            yield path, entry, 'temp'
+        else:
+            stems.add(os.path.splitext(entry.name)[0])
+            yield path, entry, 'original'
+    from images import VARIANTS_DIR
+    for name in sorted(subdirs):
+        if name != VARIANTS_DIR:
+            yield from _scan(folder + '/' + name)
+            continue
+        with os.scandir(folder + '/' + name) as entries:
+            for entry in entries:
+                if not entry.is_file(follow_symlinks=False):
+                    continue
+                match = _VARIANT_NAME_RE.match(entry.name)
+                if _is_temporary(entry.name) or not match or match.group(1) not in stems:
+                    yield folder + '/' + name + '/' + entry.name, entry, 'variant'
+
+
+def _referenced_urls(urls):
+    """Які з urls використовуються в Product.image_url / ProductImage.image_url (індексовані)"""
+    from models import db, Product, ProductImage
+    referenced = set(db.session.scalars(db.select(ProductImage.image_url).where(ProductImage.image_url.in_(urls))))
+    referenced.update(db.session.scalars(db.select(Product.image_url).where(Product.image_url.in_(urls))))
+    return referenced
+
+
+def find_orphans(grace=None, batch_size=500):
+    """Порції [(шлях, розмір), ...] файлів без посилань, старших за grace секунд.
+
+    Дерево сховища обходиться потоково, а посилання перевіряються одним
+    запитом на порцію з batch_size шляхів.
+    """
+    from models import db
+    grace = Config.UPLOAD_ORPHAN_GRACE if grace is None else grace
+    cutoff = time.time() - grace
+    root = Config.UPLOAD_FOLDER
+    if not os.path.isdir(root):
+        return
+
+    batch = []
+
+    def orphans_of(batch):
+        referenced = _referenced_urls(['/' + path for path, _, kind in batch if kind == 'original'])
+        # Не тримаємо транзакцію читання між порціями
+        db.session.rollback()
+        return [(path, size) for path, size, kind in batch if '/' + path not in referenced]
+
+    for path, entry, kind in _scan(root):
+        try:
+            stat = entry.stat(follow_symlinks=False)
+        except FileNotFoundError:
+            continue
+        if stat.st_mtime > cutoff:
+            continue
+        batch.append((path, stat.st_size, kind))
+        if len(batch) >= batch_size:
+            orphans = orphans_of(batch)
+            batch = []
+            if orphans:
+                yield orphans
+    if batch:
+        orphans = orphans_of(batch)
+        if orphans:
+            yield orphans
+
+
+def collect_orphans(grace=None, dry_run=False, echo=None):
+    """Знаходить файли без посилань і ставить їх у чергу видалення. Повертає (файлів, байт).
+
+    Файли не видаляються одразу: диспетчер (delete_files_once) видалить їх
+    через Config.UPLOAD_DELETE_DELAY, якщо на них так і не з'явиться
+    посилання - тому збирач безпечно запускати під навантаженням. Файли,
+    вже поставлені в чергу, повторно не додаються.
+    """
+    from models import db, OutboxMessage
+
+    count = size = 0
+    for orphans in find_orphans(grace):
+        queued = set(db.session.scalars(db.select(OutboxMessage.payload).where(
+            OutboxMessage.channel == CHANNEL_DELETE_FILE,
+            OutboxMessage.status == 'pending',
+            OutboxMessage.payload.in_([path for path, _ in orphans])
+        )))
+        orphans = [(path, file_size) for path, file_size in orphans if path not in queued]
+        for path, file_size in orphans:
+            if echo:
+                echo(f"{path} ({file_size} байт)")
+        count += len(orphans)
+        size += sum(file_size for _, file_size in orphans)
+        if dry_run:
+            db.session.rollback()
+            continue
+        enqueue_file_deletions([path for path, _ in orphans])
+        db.session.commit()
+    return count, size
+
+
+def cleanup_orphaned_uploads():
+    """Завдання диспетчера: collect_orphans() не частіше ніж раз на Config.UPLOAD_GC_INTERVAL"""
+    stamp = os.path.join(Config.SHARED_STATE_DIR, _GC_STAMP)
+    try:
+        with open(stamp) as f:
+            last_run = float(f.read().strip() or 0)
+    except (OSError, ValueError):
+        last_run = 0.0
+    if time.time() - last_run < Config.UPLOAD_GC_INTERVAL:
+        return 0
+    try:
+        os.makedirs(Config.SHARED_STATE_DIR, exist_ok=True)
+        tmp_path = f'{stamp}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(str(time.time()))
+        os.replace(tmp_path, stamp)
+    except OSError as e:
+        print(f"Не вдалося записати час запуску збирача файлів: {e}")
+    count, size = collect_orphans()
+    if count:
+        print(f"Файлів без посилань поставлено на видалення: {count} ({size} байт)")
+    return count
@@ -5,12 +5,6 @@ import os
 from werkzeug.utils import secure_filename
 from config import Config
 
-try:
-    from PIL import Image
-    HAS_PIL = True
-except ImportError:
-    HAS_PIL = False
-
 def admin_required(f):
     """Декоратор для перевірки прав адміністратора"""
     @wraps(f)
@@ -25,39 +19,16 @@ def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in Config.ALLOWED_EXTENSIONS
 
 def save_uploaded_file(file, folder='products'):
-    """Збереження завантаженого файлу"""
+    """Збереження завантаженого файлу (ім'я - хеш вмісту, див. upload_storage.py)"""
     if file and allowed_file(file.filename):
-        # Створюємо директорію якщо її немає
-        upload_path = os.path.join(Config.UPLOAD_FOLDER, folder)
-        os.makedirs(upload_path, exist_ok=True)
-        
-        # Безпечне ім'я файлу
-        filename = secure_filename(file.filename)
-        
-        # Додаємо timestamp для унікальності
-        from datetime import datetime
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S_')
-        filename = timestamp + filename
+        from upload_storage import store_stream
+        from images import inspect_upload
         
-        filepath = os.path.join(upload_path, filename)
-        
-        # Зберігаємо файл
-        file.save(filepath)
-        
-        # Оптимізуємо зображення
-        if HAS_PIL:
-            try:
-                img = Image.open(filepath)
-                # Конвертуємо в RGB якщо потрібно
-                if img.mode in ('RGBA', 'LA', 'P'):
-                    img = img.convert('RGB')
-                # Зберігаємо з оптимізацією
-                img.save(filepath, optimize=True, quality=85)
-            except Exception as e:
-                print(f"Помилка оптимізації зображення: {e}")
-        
-        # Повертаємо відносний шлях
-        return os.path.join(Config.UPLOAD_FOLDER, folder, filename).replace('\\', '/')
+        extension = secure_filename(file.filename).rsplit('.', 1)[-1].lower()
+        # Розміри та формат перевіряються за заголовком, розширення - за вмістом;
+        # оптимізація та похідні - у фоні (image_queue.py)
+        return store_stream(file.stream, extension, folder,
+                            max_size=Config.UPLOAD_MAX_FILE_SIZE, detect_extension=inspect_upload)
     return None
 
 def delete_file(filepath):
@@ -72,30 +43,41 @@ def delete_file(filepath):
                 print(f"Помилка видалення файлу: {e}")
     return False
 
-def send_telegram_message(message):
-    """Відправка повідомлення в Telegram групу"""
+def get_telegram_settings():
+    """Налаштування Telegram: (enabled, bot_token, chat_id)"""
+    from models import Settings
+    
+    # Спочатку перевіряємо налаштування з бази даних
+    enabled = Settings.get_setting('telegram_enabled', 'false').lower() == 'true'
+    bot_token = Settings.get_setting('telegram_bot_token', '')
+    chat_id = Settings.get_setting('telegram_chat_id', '')
+    
+    # Якщо в БД немає налаштувань, використовуємо config
+    if not bot_token:
+        bot_token = Config.TELEGRAM_BOT_TOKEN
+    if not chat_id:
+        chat_id = Config.TELEGRAM_CHAT_ID
+    if not enabled:
+        enabled = Config.TELEGRAM_ENABLED
+    
+    return enabled, bot_token, chat_id
+
+def send_telegram_message(message, raise_errors=False):
+    """Відправка повідомлення в Telegram групу.
+    
+    Виконує HTTP запит синхронно, тому в обробниках запитів замість неї
+    використовується черга notifications.enqueue_telegram(). З
+    raise_errors=True помилки передаються викликаючому коду (для повторів).
+    """
     try:
-        from models import Settings
-        
-        # Спочатку перевіряємо налаштування з бази даних
-        enabled = Settings.get_setting('telegram_enabled', 'false').lower() == 'true'
-        bot_token = Settings.get_setting('telegram_bot_token', '')
-        chat_id = Settings.get_setting('telegram_chat_id', '')
-        
-        # Якщо в БД немає налаштувань, використовуємо config
-        if not bot_token:
-            bot_token = Config.TELEGRAM_BOT_TOKEN
-        if not chat_id:
-            chat_id = Config.TELEGRAM_CHAT_ID
-        if not enabled:
-            enabled = Config.TELEGRAM_ENABLED
+        enabled, bot_token, chat_id = get_telegram_settings()
         
         if not enabled or not bot_token or not chat_id:
             return False
         
         import requests
         
-        url = f"https://api.telegram.org/bot{bot_token}/sendMessage"
+        url = f"{Config.TELEGRAM_API_URL.rstrip('/')}/bot{bot_token}/sendMessage"
         
         payload = {
             'chat_id': chat_id,
@@ -103,12 +85,16 @@ def send_telegram_message(message):
             'parse_mode': 'HTML'
         }
         
-        response = requests.post(url, json=payload, timeout=10)
+        response = requests.post(url, json=payload, timeout=Config.TELEGRAM_TIMEOUT)
         response.raise_for_status()
         return True
     except ImportError:
+        if raise_errors:
+            raise
         print("Помилка: бібліотека requests не встановлена")
         return False
     except Exception as e:
+        if raise_errors:
+            raise
         print(f"Помилка відправки повідомлення в Telegram: {e}")
         return False